@@ -0,0 +1,165 @@
+"""
+Contrôle d'admission et délestage pour les endpoints coûteux.
+
+Deux mécanismes sont appliqués avant d'exécuter la vue:
+
+- une limite de requêtes simultanées par endpoint, partagée entre les
+  workers gunicorn grâce à des verrous fcntl sur des fichiers "slots"
+  (un verrou est libéré automatiquement si le worker meurt). Sans fcntl
+  (Windows), la limite est un sémaphore propre au processus;
+- un token bucket par utilisateur (ou IP) et par endpoint, en mémoire du
+  worker.
+
+Un refus ne coûte que quelques microsecondes: 503 quand l'endpoint est
+saturé, 429 quand l'utilisateur dépasse son débit, avec Retry-After dans
+les deux cas. Les compteurs d'admission et de refus sont exposés par stats().
+"""
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+try:
+    import fcntl
+except ImportError:  # Windows: limites de concurrence par processus seulement
+    fcntl = None
+
+DEFAULT_LOCK_DIR = os.path.join(tempfile.gettempdir(), "mafinance-admission")
+
+# Au-delà, les buckets pleins (utilisateurs inactifs) sont oubliés
+MAX_BUCKET_KEYS = 10000
+
+class SlotLimiter:
+    """At most `slots` concurrent holders across every process sharing `directory`"""
+
+    def __init__(self, name, slots, directory=DEFAULT_LOCK_DIR):
+        self.slots = slots
+        if fcntl is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.paths = [os.path.join(directory, f"{name}.{i}.lock") for i in range(slots)]
+        else:
+            self.semaphore = threading.BoundedSemaphore(slots)
+
+    def try_acquire(self):
+        """Return a slot handle, or None when every slot is taken (never blocks)"""
+        if fcntl is None:
+            return True if self.semaphore.acquire(blocking=False) else None
+        for path in self.paths:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def release(self, handle):
+        if fcntl is None:
+            self.semaphore.release()
+            return
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            os.close(handle)
+
+class TokenBuckets:
+    """One token bucket per key: `rate` tokens per second, at most `burst` stored"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.state = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, now=None):
+        """Consume one token; returns 0 if admitted, else the seconds to wait for one"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, updated = self.state.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self.state[key] = (tokens - 1, now)
+                return 0.0
+            self.state[key] = (tokens, now)
+            if len(self.state) > MAX_BUCKET_KEYS:
+                self._forget_full(now)
+            return (1 - tokens) / self.rate
+
+    def _forget_full(self, now):
+        for key, (tokens, updated) in list(self.state.items()):
+            if tokens + (now - updated) * self.rate >= self.burst:
+                del self.state[key]
+
+class Decision:
+    __slots__ = ("status", "retry_after", "message", "slot", "limiter")
+
+    def __init__(self, status=None, retry_after=0, message=None, slot=None, limiter=None):
+        self.status = status
+        self.retry_after = retry_after
+        self.message = message
+        self.slot = slot
+        self.limiter = limiter
+
+    @property
+    def admitted(self):
+        return self.status is None
+
+class AdmissionController:
+    """
+    Per-endpoint admission rules:
+        {endpoint: {"concurrency": N, "rate": tokens/s, "burst": B, "retry_after": s}}
+    Every key is optional; endpoints without rules are always admitted.
+    """
+
+    def __init__(self, rules, directory=DEFAULT_LOCK_DIR):
+        self.rules = rules
+        self.limiters = {
+            endpoint: SlotLimiter(endpoint, rule["concurrency"], directory)
+            for endpoint, rule in rules.items() if rule.get("concurrency")
+        }
+        self.buckets = {
+            endpoint: TokenBuckets(rule["rate"], rule.get("burst", 1))
+            for endpoint, rule in rules.items() if rule.get("rate")
+        }
+        self.counters = defaultdict(Counter)
+        self.lock = threading.Lock()
+
+    def _count(self, endpoint, outcome):
+        with self.lock:
+            self.counters[endpoint][outcome] += 1
+
+    def admit(self, endpoint, key):
+        """Decide on a request; an admitted decision may hold a slot to release()"""
+        rule = self.rules.get(endpoint)
+        if rule is None:
+            return Decision()
+
+        bucket = self.buckets.get(endpoint)
+        if bucket is not None:
+            wait = bucket.take(key)
+            if wait > 0:
+                self._count(endpoint, "rejected_rate")
+                return Decision(429, wait, "Too many requests, slow down")
+
+        limiter = self.limiters.get(endpoint)
+        if limiter is not None:
+            slot = limiter.try_acquire()
+            if slot is None:
+                self._count(endpoint, "rejected_busy")
+                return Decision(503, rule.get("retry_after", 1), "Server busy, try again shortly")
+            self._count(endpoint, "admitted")
+            return Decision(slot=slot, limiter=limiter)
+
+        self._count(endpoint, "admitted")
+        return Decision()
+
+    def release(self, decision):
+        if decision.limiter is not None:
+            decision.limiter.release(decision.slot)
+            decision.limiter = None
+
+    def stats(self):
+        """Admission / rejection counters of this process, per endpoint"""
+        with self.lock:
+            return {endpoint: dict(counts) for endpoint, counts in self.counters.items()}
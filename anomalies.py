@@ -0,0 +1,203 @@
+"""
+Détection d'anomalies en continu sur les prix et les volumes.
+
+Pour chaque symbole et chaque métrique (rendement entre deux snapshots,
+quantité et montant échangés depuis le snapshot précédent), le détecteur
+maintient une moyenne et une variance de long terme (Welford) et une
+moyenne / variance exponentielles (EWMA) qui suivent le régime récent.
+Chaque snapshot est comparé à ces statistiques en une passe vectorisée
+sur tous les symboles, puis les met à jour: aucun historique n'est relu.
+
+Un point est signalé quand son z-score dépasse le seuil à la fois contre
+l'EWMA et contre la statistique de long terme (une période très calme ne
+suffit pas à faire d'un mouvement ordinaire une anomalie). Pour les
+volumes, seuls les pics à la hausse comptent.
+
+Au démarrage de l'application, les statistiques sont réchauffées sur les
+derniers jours de price_history seulement (voir risk_engine.warmup_start).
+
+Benchmark (marché simulé avec des chocs injectés):
+    python anomalies.py --symbols 80 --snapshots 2000
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from snapshot_changes import load_history_frames
+
+METRICS = ("return", "volume", "value")
+Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "4"))
+EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.05"))
+
+# Observations avant de signaler quoi que ce soit pour un symbole
+MIN_OBSERVATIONS = 20
+
+class AnomalyDetector:
+    """Running per-symbol statistics of returns, traded quantity and traded value"""
+
+    def __init__(self, threshold=Z_THRESHOLD, alpha=EWMA_ALPHA, min_observations=MIN_OBSERVATIONS):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.min_observations = min_observations
+        self.symbols = []
+        self.index = {}
+        shape = (len(METRICS), 0)
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.ewm_mean = np.zeros(shape)
+        self.ewm_var = np.zeros(shape)
+        self.last = np.zeros(shape)  # dernier prix, quantité et montant cumulés
+        self.last_timestamp = None
+        self.latest = []
+
+    def _ensure_symbols(self, symbols):
+        new = [s for s in dict.fromkeys(symbols) if s not in self.index]
+        if not new:
+            return
+        for symbol in new:
+            self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        grow = ((0, 0), (0, len(new)))
+        for name in ("count", "mean", "m2", "ewm_mean", "ewm_var"):
+            setattr(self, name, np.pad(getattr(self, name), grow))
+        self.last = np.pad(self.last, grow, constant_values=np.nan)
+
+    def _align(self, symbols, values):
+        aligned = np.full(len(self.symbols), np.nan)
+        if values is not None:
+            aligned[[self.index[s] for s in symbols]] = np.asarray(values, dtype=np.float64)
+        return aligned
+
+    def observations(self, current):
+        """Per-metric observations of one snapshot given the cumulative (price, quantity, value)"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = np.empty_like(current)
+            x[0] = current[0] / self.last[0] - 1
+            # Quantités cumulées sur la séance: une baisse signale une nouvelle séance
+            increments = current[1:] - self.last[1:]
+            x[1:] = np.where(increments < 0, current[1:], increments)
+        x[~np.isfinite(x)] = np.nan
+        return x
+
+    def update(self, symbols, prices, volumes=None, values=None, timestamp=None):
+        """Score one snapshot against the running statistics, then fold it in; returns the anomalies"""
+        if timestamp is not None and self.last_timestamp is not None and str(timestamp) <= str(self.last_timestamp):
+            return self.latest
+
+        self._ensure_symbols(symbols)
+        current = np.vstack([self._align(symbols, prices), self._align(symbols, volumes), self._align(symbols, values)])
+        x = self.observations(current)
+        observed = np.isfinite(x)
+
+        # Scores contre les statistiques d'avant ce snapshot
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ewm_z = (x - self.ewm_mean) / np.sqrt(self.ewm_var)
+            long_z = (x - self.mean) / np.sqrt(self.m2 / (self.count - 1))
+        scored = observed & (self.count >= self.min_observations) & (self.ewm_var > 0) & (self.m2 > 0)
+        exceeds = np.minimum(np.abs(ewm_z), np.abs(long_z))
+        exceeds[1:] = np.minimum(ewm_z[1:], long_z[1:])  # volumes: pics à la hausse seulement
+        flagged = scored & (exceeds >= self.threshold)
+        typical = self.ewm_mean
+
+        # Welford
+        xs = np.where(observed, x, 0.0)
+        self.count += observed
+        delta = np.where(observed, xs - self.mean, 0.0)
+        self.mean += np.where(observed, delta / np.maximum(self.count, 1), 0.0)
+        self.m2 += delta * (xs - self.mean)
+
+        # EWMA (initialisée avec la première observation)
+        first = observed & (self.count == 1)
+        diff = np.where(observed, xs - self.ewm_mean, 0.0)
+        step = self.alpha * diff
+        self.ewm_mean = np.where(first, xs, self.ewm_mean + step)
+        self.ewm_var = np.where(first, 0.0, (1 - self.alpha) * (self.ewm_var + diff * step))
+
+        self.last = np.where(np.isfinite(current), current, self.last)
+        self.last_timestamp = timestamp
+
+        metric_idx, symbol_idx = np.nonzero(flagged)
+        self.latest = sorted((
+            {
+                "symbol": self.symbols[s],
+                "metric": METRICS[m],
+                "value": float(x[m, s]),
+                "zscore": round(float(ewm_z[m, s]), 2),
+                "long_run_zscore": round(float(long_z[m, s]), 2),
+                "typical": float(typical[m, s]),
+                "timestamp": timestamp,
+            }
+            for m, s in zip(metric_idx, symbol_idx)
+        ), key=lambda a: abs(a["zscore"]), reverse=True)
+        return self.latest
+
+    def update_from_snapshot(self, snapshot):
+        """Snapshot listener entry point (see snapshot_changes.register_snapshot_listener)"""
+        return self.update(snapshot["symbols"], snapshot["price"], snapshot["volume"], snapshot["value"],
+                           snapshot["timestamp"])
+
+    def flags_by_symbol(self):
+        """{symbol: [metric, ...]} for the anomalies of the last snapshot"""
+        flags = {}
+        for anomaly in self.latest:
+            flags.setdefault(anomaly["symbol"], []).append(anomaly["metric"])
+        return flags
+
+    @classmethod
+    def from_history(cls, conn, since=None, placeholder="?", **kwargs):
+        """Warm the statistics up from price_history since `since` (default: all; no traded value stored)"""
+        detector = cls(**kwargs)
+        history = load_history_frames(conn, ["price", "volume"], since, placeholder)
+        if history is None:
+            return detector
+
+        times, symbols, frames = history
+        for timestamp, price_row, volume_row in zip(times, frames["price"], frames["volume"]):
+            detector.update(symbols, price_row, volume_row, None, timestamp)
+        detector.latest = []  # les anomalies passées ne sont pas celles du snapshot courant
+        return detector
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark streaming anomaly detection on a simulated market")
+    parser.add_argument("--symbols", type=int, default=80)
+    parser.add_argument("--snapshots", type=int, default=2000)
+    parser.add_argument("--shocks", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    n, t = args.symbols, args.snapshots
+    symbols = [f"SYM{i:03d}" for i in range(n)]
+    returns = rng.normal(0, 0.002, (t, n))
+    trades = rng.poisson(200, (t, n)).astype(np.float64)
+
+    # Chocs injectés après la période d'apprentissage: saut de prix ou pic de volume
+    shocks = set()
+    for _ in range(args.shocks):
+        step, s = int(rng.integers(MIN_OBSERVATIONS * 2, t)), int(rng.integers(n))
+        if rng.random() < 0.5:
+            returns[step, s] += 0.03 * rng.choice([-1, 1])
+            shocks.add((step, s, "return"))
+        else:
+            trades[step, s] *= 8
+            shocks.add((step, s, "volume"))
+
+    prices = 100 * np.cumprod(1 + returns, axis=0)
+    volumes = np.cumsum(trades, axis=0)
+    values = np.cumsum(trades * prices, axis=0)
+
+    detector = AnomalyDetector()
+    found = set()
+    started = time.perf_counter()
+    for step in range(t):
+        for anomaly in detector.update(symbols, prices[step], volumes[step], values[step], f"{step:08d}"):
+            if anomaly["metric"] != "value":
+                found.add((step, detector.index[anomaly["symbol"]], anomaly["metric"]))
+    elapsed = time.perf_counter() - started
+
+    print(f"[INFO] {t} snapshots x {n} symbols: {elapsed / t * 1e6:.0f} us per snapshot")
+    print(f"[INFO] Injected shocks detected: {len(shocks & found)}/{len(shocks)}, "
+          f"other flags: {len(found - shocks)} of {t * n * 2} observations")
@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, send_from_directory, abort, request, session
+from flask import Flask, jsonify, send_from_directory, abort, request, session, Response, stream_with_context, g
 import pandas as pd
 import numpy as np
 import json
@@ -6,8 +6,41 @@ import os
 import re
 import secrets
 from datetime import datetime, timedelta
-from bvc_hourly_scraper import fetch_bvc_prices
-from init_db import get_db_connection, hash_password, init_database
+from bvc_orchestrator import (
+    fetch_market_snapshot, resolve_pages, save_snapshot, snapshot_csv_path, PRIMARY_PAGE, BVC_BASE_URL
+)
+from snapshot_changes import (
+    ChangeDetector, notify_listeners, register_listener, summarize_changes,
+    notify_snapshot_listeners, register_snapshot_listener
+)
+from screener import ScreenerIndex, parse_screen_params
+from search_index import SearchIndexCache
+from microstructure import compute_microstructure, metrics_records, INPUT_COLUMNS as MICROSTRUCTURE_INPUTS
+from risk_engine import RiskEngine, holdings_market_values, warmup_start
+from backtester import PriceMatrixCache, parse_rules, run_backtest, MAX_API_RULES
+from build_assets import load_manifest, pick_variant, IMMUTABLE_CACHE, PAGE_CACHE
+import mimetypes
+from werkzeug.middleware.proxy_fix import ProxyFix
+import math
+from admission import AdmissionController, DEFAULT_LOCK_DIR
+from exports import (
+    EXPORT_FORMATS, MAX_EXPORT_SYMBOLS, PORTFOLIO_COLUMNS, ALERT_COLUMNS, HISTORY_COLUMNS,
+    iter_batches, stream_rows, portfolio_query, alerts_query, history_query
+)
+from notifications import enqueue_alert_notifications
+from intraday import IntradayBuffer, moving_average, json_values
+from anomalies import AnomalyDetector, METRICS as ANOMALY_METRICS
+from market_index import MarketIndexEngine
+from instruments import InstrumentRegistry
+from single_flight import SingleFlight, jittered, cache_state
+from request_profiler import RequestProfiler, reset_db_time, db_time
+from user_cache import UserResponseCache, UserVersions
+import time
+from bulk_import import (
+    UploadError, read_upload, symbol_lookup, validate_watchlist, validate_portfolio,
+    insert_watchlist, insert_portfolio
+)
+from init_db import get_db_connection, hash_password, init_database, IS_PRODUCTION
 # from logger import Logger # Assuming logger is defined elsewhere or commented out if not used
 
 # Initialiser un logger basique si la classe Logger n'est pas définie
@@ -16,6 +49,8 @@ class BasicLogger:
         print(f"[INFO] {msg}")
     def error(self, msg):
         print(f"[ERROR] {msg}")
+    def warning(self, msg):
+        print(f"[WARNING] {msg}")
     def debug(self, msg):
         pass # Ignorer les logs de debug pour la simplicité
 
@@ -29,9 +64,14 @@ logger.info("Application démarrée")
 
 app = Flask(__name__, static_folder='.') # Serve static files from the root directory
 app.secret_key = os.getenv('SECRET_KEY', secrets.token_hex(32))  # Use environment variable or generate random key
+# Render ajoute l'IP du client en dernier dans X-Forwarded-For: seul ce saut est digne de confiance
+# (PROXY_HOPS=0 sans proxy devant l'application)
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv('PROXY_HOPS', '1')))
 
-# Initialize database on startup
-init_database()
+# Le schéma est créé une fois par déploiement (python init_db.py, voir render.yaml),
+# pas au démarrage de chaque worker; INIT_DB_ON_STARTUP=true pour forcer l'ancien comportement
+if os.getenv('INIT_DB_ON_STARTUP', 'false').lower() == 'true':
+    init_database()
 
 # Security headers
 @app.after_request
@@ -41,6 +81,117 @@ def add_security_headers(response):
     response.headers['X-XSS-Protection'] = '1; mode=block'
     return response
 
+# ===== ADMISSION CONTROL =====
+# Limites de concurrence partagées entre workers (verrous fichiers) et débit par utilisateur.
+# Avec des workers sync, garder au moins un worker libre pour les routes légères.
+ADMISSION_RULES = {
+    'refresh_data': {'concurrency': 1, 'rate': 1 / 30, 'burst': 2, 'retry_after': 30},
+    # Servi depuis le snapshot en cache: pas de limite de concurrence, seulement un débit par utilisateur
+    'get_all_stocks': {'rate': 1, 'burst': 5},
+    'backtest_rules': {'concurrency': 1, 'rate': 0.1, 'burst': 3, 'retry_after': 5},
+    'export_history': {'concurrency': 1, 'rate': 0.1, 'burst': 3, 'retry_after': 10},
+    'export_portfolio': {'rate': 0.2, 'burst': 3},
+    'export_alerts': {'rate': 0.2, 'burst': 3},
+    'import_watchlist': {'rate': 0.1, 'burst': 3},
+    'import_portfolio': {'rate': 0.1, 'burst': 3},
+    'get_portfolio_risk': {'rate': 1, 'burst': 5},
+    'screen_stocks': {'rate': 5, 'burst': 20},
+    'search_stocks': {'rate': 10, 'burst': 30},
+}
+if os.getenv('ADMISSION_CONTROL', 'true').lower() == 'false':
+    ADMISSION_RULES = {}
+admission = AdmissionController(ADMISSION_RULES, os.getenv('ADMISSION_LOCK_DIR', DEFAULT_LOCK_DIR))
+
+@app.before_request
+def admission_control():
+    """Reject over-limit requests early with 429/503 and Retry-After"""
+    # Ne lire la session que pour les endpoints limités: y accéder ajoute Vary: Cookie à la réponse,
+    # ce qui empêche les CDN de mettre en cache les assets immutables
+    if request.endpoint not in admission.rules:
+        return None
+    # remote_addr vient de ProxyFix; la première IP de X-Forwarded-For est choisie par le client
+    decision = admission.admit(request.endpoint, session.get('user_id') or request.remote_addr)
+    if not decision.admitted:
+        response = jsonify({"status": "error", "message": decision.message})
+        response.status_code = decision.status
+        response.headers['Retry-After'] = str(max(1, math.ceil(decision.retry_after)))
+        return response
+    g.admission = decision
+
+@app.teardown_request
+def release_admission_slot(exc):
+    decision = g.pop('admission', None)
+    if decision is not None:
+        admission.release(decision)
+
+# Profils à la demande (X-Profile + X-Profile-Token, ou PROFILE_SAMPLE_RATE) et requêtes lentes
+request_profiler = RequestProfiler(logger)
+
+def stock_cache_status():
+    """State of the snapshot cache, for the slow-request log"""
+    cache = getattr(app, 'stock_data_cache', None)
+    if cache is None:
+        state = 'empty'
+    else:
+        age = (datetime.now() - cache['load_time']).total_seconds()
+        state = cache_state(age, cache['fresh_for'], CACHE_MAX_STALE_SECONDS)
+    return f"{state}+rebuilding" if stock_cache_rebuild.in_flight else state
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    g.cache_state = stock_cache_status()
+    reset_db_time()
+    mode = request_profiler.requested_mode(request.headers)
+    if mode:
+        g.profile = request_profiler.start(mode)
+
+def pop_request_timing():
+    """Measurement state of the current request, taken out of g; None if it was not started"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return None
+    return started, g.pop('profile', None), request.method, request.path, request.endpoint, g.get('cache_state')
+
+def finish_request_timing(timing, status, response=None):
+    """Stop the request's profile and log it if slow; profile headers go on `response` when given"""
+    started, profile, method, path, endpoint, cache_state = timing
+    duration_ms = (time.perf_counter() - started) * 1e3
+    db_seconds, queries = db_time()
+    if profile is not None:
+        profile_file = request_profiler.finish(profile, endpoint, duration_ms)
+        if response is not None:
+            response.headers['X-Profile-File'] = profile_file
+            response.headers['Server-Timing'] = f"app;dur={duration_ms:.1f}, db;dur={db_seconds * 1e3:.1f}"
+    request_profiler.record(method, path, endpoint, status, duration_ms, db_seconds, queries, cache_state)
+
+@app.after_request
+def finish_response_timing(response):
+    timing = pop_request_timing()
+    if timing is None:  # requête refusée avant le début de la mesure
+        return response
+    if response.is_streamed:
+        # Exports en flux: le corps n'est pas encore envoyé, la mesure se termine à la fermeture
+        response.call_on_close(lambda: finish_request_timing(timing, response.status_code))
+    else:
+        finish_request_timing(timing, response.status_code, response)
+    return response
+
+@app.teardown_request
+def finish_failed_request_timing(exc):
+    # Exception non gérée (debug, PROPAGATE_EXCEPTIONS): after_request n'a pas tourné,
+    # le profil et le thread d'échantillonnage sont arrêtés quand même
+    timing = pop_request_timing()
+    if timing is not None:
+        finish_request_timing(timing, 500)
+
+@app.route('/api/admission', methods=['GET'])
+def admission_stats():
+    """Admission and rejection counters of this worker"""
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+    return jsonify({"status": "success", "pid": os.getpid(), "counters": admission.stats()})
+
 # Support reading from the freshest available CSV among candidates
 import os
 CSV_CANDIDATES = ['bvc_prices_latest.csv', 'bvc_prices_latest_new.csv']
@@ -106,11 +257,29 @@ def clean_numeric(value):
 AUTO_SCRAPE_ENABLED = False  # Set to False to disable automatic scraping
 DATA_REFRESH_MINUTES = 1    # Scrape new data if CSV is older than this (changed from 15 to 1 minute)
 
+# Pages BVC à récupérer en parallèle à chaque scrape (ex: "actions,indices,obligations")
+SCRAPE_PAGES = [p.strip() for p in os.getenv('BVC_SCRAPE_PAGES', PRIMARY_PAGE).split(',') if p.strip()]
+if PRIMARY_PAGE not in SCRAPE_PAGES:
+    SCRAPE_PAGES.insert(0, PRIMARY_PAGE)
+SCRAPE_MAX_WORKERS = int(os.getenv('BVC_SCRAPE_WORKERS', '4'))
+SCRAPE_PAGE_TIMEOUT = int(os.getenv('BVC_SCRAPE_TIMEOUT', '30'))
+# Source des pages: le site (selenium) ou un serveur local, ex. feed_simulator.py --serve (http)
+SCRAPE_BACKEND = os.getenv('BVC_SCRAPE_BACKEND', 'selenium')
+SCRAPE_BASE_URL = os.getenv('BVC_BASE_URL', BVC_BASE_URL)
+
+# Hashes des lignes du dernier snapshot scrapé, pour n'écrire que ce qui a bougé
+scrape_change_detector = ChangeDetector()
+last_scrape = {'time': None, 'changes': None}
+
 def should_refresh_data():
     """Check if we need to fetch fresh data from BVC"""
     if not AUTO_SCRAPE_ENABLED:
         return False
 
+    # Un scrape sans changement ne réécrit pas le CSV: on tient compte de l'heure du dernier scrape
+    if last_scrape['time'] and datetime.now() - last_scrape['time'] <= timedelta(minutes=DATA_REFRESH_MINUTES):
+        return False
+
     try:
         csv_path = get_csv_file()
         file_age = datetime.now() - datetime.fromtimestamp(os.path.getmtime(csv_path))
@@ -126,16 +295,44 @@ def scrape_and_save_data():
     """Fetch fresh data from BVC and save to CSV and SQLite database"""
     try:
         logger.info("[AUTO-REFRESH] Fetching fresh data from Casablanca Stock Exchange...")
-        df = fetch_bvc_prices()
-
-        if not df.empty:
-            output_file = "bvc_prices_latest_new.csv"
-            df.to_csv(output_file, index=False)
-            logger.info(f"[SUCCESS] Fresh data saved to {output_file}")
-
-            # Also save to SQLite database
-            save_stocks_to_database(df)
-
+        snapshot = fetch_market_snapshot(
+            resolve_pages(SCRAPE_PAGES),
+            base_url=SCRAPE_BASE_URL,
+            backend=SCRAPE_BACKEND,
+            max_workers=SCRAPE_MAX_WORKERS,
+            page_timeout=SCRAPE_PAGE_TIMEOUT
+        )
+
+        for page, error in snapshot['errors'].items():
+            logger.error(f"[ERROR] Page {page} failed: {error}")
+
+        if snapshot['complete']:
+            df = snapshot['frames'][PRIMARY_PAGE]
+            if not scrape_change_detector.seeded:
+                scrape_change_detector.seed_from_csv(snapshot_csv_path(PRIMARY_PAGE))
+            changes = scrape_change_detector.diff(df)
+            last_scrape['time'] = datetime.now()
+            last_scrape['changes'] = summarize_changes(changes)
+
+            if changes['changed'] or changes['removed']:
+                save_snapshot(snapshot)
+                logger.info(f"[SUCCESS] Fresh snapshot {snapshot['timestamp']} saved ({', '.join(snapshot['frames'])})")
+
+                # Also save to SQLite database (only rows that moved)
+                changed_df = df[changes['mask']]
+                if save_stocks_to_database(changed_df, snapshot['timestamp']):
+                    # Snapshot de référence avancé seulement une fois CSV et base écrits:
+                    # sinon les mêmes lignes sont de nouveau détectées au prochain scrape
+                    scrape_change_detector.commit(changes['current'])
+                    notify_listeners(changed_df, changes, logger)
+            else:
+                save_snapshot(snapshot, names=[name for name in snapshot['frames'] if name != PRIMARY_PAGE])
+                scrape_change_detector.commit(changes['current'])
+
+            logger.info(
+                f"[SCRAPE] {changes['changed']}/{changes['total']} rows changed "
+                f"({changes['added']} added, {changes['modified']} modified, {len(changes['removed'])} removed)"
+            )
             return True
         else:
             logger.error("[ERROR] Scraper returned empty data")
@@ -144,27 +341,65 @@ def scrape_and_save_data():
         logger.error(f"[ERROR] Error during scraping: {e}")
         return False
 
-def save_stocks_to_database(df):
-    """Save stock data to SQLite database"""
+# Identifiants entiers des instruments (table instruments) et symboles internés
+instrument_registry = InstrumentRegistry()
+
+def snapshot_symbols(df):
+    """(symbol, company name) of every row, as used for the stocks table and the frontend"""
+    pairs = []
+    for _, row in df.iterrows():
+        instrument_name = row['Instrument'].strip()
+        symbol = row['Ticker'].strip() if 'Ticker' in df.columns and row['Ticker'].strip() else instrument_name
+        company_name = row['Company'].strip() if 'Company' in df.columns and row['Company'].strip() else instrument_name
+        pairs.append((instrument_registry.intern(symbol), instrument_registry.intern(company_name)))
+    return pairs
+
+def snapshot_instrument_ids(pairs):
+    """{symbol: instrument id}; the database is only queried for symbols not seen before"""
+    if all(symbol in instrument_registry.ids for symbol, _ in pairs):
+        return instrument_registry.ensure(None, pairs)
+    conn = get_db_connection()
     try:
+        return instrument_registry.ensure(conn, pairs)
+    except Exception as e:
+        logger.error(f"[ERROR] Could not register instruments: {e}")
+        return {}
+    finally:
+        conn.close()
+
+def save_stocks_to_database(df, snapshot_time=None):
+    """Save stock data to SQLite database and append it to the price history; False if the write failed"""
+    if df.empty:
+        return True
+
+    snapshot_time = snapshot_time or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        # Indicateurs de microstructure calculés une fois pour toutes les lignes
+        cleaned = pd.DataFrame({c: df[c].map(clean_numeric) for c in MICROSTRUCTURE_INPUTS if c in df.columns}, index=df.index)
+        metrics = compute_microstructure(cleaned)
+
+        pairs = snapshot_symbols(df)
+        instrument_ids = snapshot_instrument_ids(pairs)
+
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        for _, row in df.iterrows():
+        for (_, row), metric_values, (symbol, company_name) in zip(df.iterrows(), metrics.itertuples(index=False), pairs):
             instrument_name = row['Instrument'].strip()
-            symbol = row['Ticker'].strip() if 'Ticker' in df.columns and row['Ticker'].strip() else instrument_name
-            company_name = row['Company'].strip() if 'Company' in df.columns and row['Company'].strip() else instrument_name
+            instrument_id = instrument_ids.get(symbol)
             sector = MOCK_SECTOR_MAPPING.get(instrument_name, 'Other')
 
             cursor.execute('''
                 INSERT OR REPLACE INTO stocks (
-                    symbol, name, sector, price, change, volume, market_cap,
+                    symbol, instrument_id, name, sector, price, change, volume, market_cap,
                     statut, cours_reference, ouverture, plus_haut, plus_bas,
                     prix_achat, prix_vente, quantite_achat, quantite_vente,
-                    nombre_transactions, last_updated
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    nombre_transactions, spread, spread_bps, mid_price, imbalance,
+                    avg_trade_size, vwap, last_updated
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
             ''', (
                 symbol,
+                instrument_id,
                 company_name,
                 sector,
                 clean_numeric(row.get('Dernier_Cours', 0)),
@@ -180,28 +415,113 @@ def save_stocks_to_database(df):
                 clean_numeric(row.get('Meilleur_Prix_Vente', 0)),
                 int(clean_numeric(row.get('Quantite_Meilleur_Prix_Achat', 0))) if pd.notna(clean_numeric(row.get('Quantite_Meilleur_Prix_Achat', 0))) else 0,
                 int(clean_numeric(row.get('Quantite_Meilleur_Prix_Vente', 0))) if pd.notna(clean_numeric(row.get('Quantite_Meilleur_Prix_Vente', 0))) else 0,
-                int(clean_numeric(row.get('Nombre_Transactions', 0))) if pd.notna(clean_numeric(row.get('Nombre_Transactions', 0))) else 0
+                int(clean_numeric(row.get('Nombre_Transactions', 0))) if pd.notna(clean_numeric(row.get('Nombre_Transactions', 0))) else 0,
+                *metric_values
+            ))
+
+            cursor.execute('''
+                INSERT INTO price_history (
+                    symbol, instrument_id, price, change, volume, market_cap, statut,
+                    prix_achat, prix_vente, snapshot_time
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                symbol,
+                instrument_id,
+                clean_numeric(row.get('Dernier_Cours', 0)),
+                clean_numeric(row.get('Variation_Pourcentage', 0)),
+                int(clean_numeric(row.get('Quantite_Echangee', 0))) if pd.notna(clean_numeric(row.get('Quantite_Echangee', 0))) else 0,
+                clean_numeric(row.get('Capitalisation', 0)),
+                row.get('Statut', '-'),
+                clean_numeric(row.get('Meilleur_Prix_Achat', 0)),
+                clean_numeric(row.get('Meilleur_Prix_Vente', 0)),
+                snapshot_time
             ))
 
         conn.commit()
         conn.close()
-        logger.info("[SUCCESS] Stock data saved to database")
+        logger.info(f"[SUCCESS] {len(df)} changed stocks saved to database")
+        return True
     except Exception as e:
         logger.error(f"[ERROR] Error saving to database: {e}")
+        return False
+
+# Dernier snapshot transmis aux moteurs (risque, ...)
+published_snapshot = {'timestamp': None}
+
+def build_snapshot_arrays(df, stocks, timestamp):
+    """Column arrays of a cleaned snapshot, aligned with the stocks list, for the engines"""
+    def column(name):
+        if name in df.columns:
+            return pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float64)
+        return np.full(len(df), np.nan)
+
+    return {
+        'timestamp': timestamp,
+        'symbols': [s['symbol'] for s in stocks],
+        'ids': instrument_registry.array([s['symbol'] for s in stocks]),
+        'sectors': [s['sector'] for s in stocks],
+        'price': column('Dernier_Cours'),
+        'change': column('Variation_Pourcentage'),
+        'volume': column('Quantite_Echangee'),
+        'value': column('Volume'),
+        'market_cap': column('Capitalisation'),
+        'bid': column('Meilleur_Prix_Achat'),
+        'ask': column('Meilleur_Prix_Vente'),
+    }
+
+# Cache du snapshot: frais pendant CACHE_DURATION_SECONDS (avec gigue), puis servi tel quel
+# pendant qu'une seule reconstruction tourne en arrière-plan, jusqu'au plafond de péremption
+CACHE_DURATION_SECONDS = int(os.getenv('STOCK_CACHE_SECONDS', '60'))
+CACHE_MAX_STALE_SECONDS = int(os.getenv('STOCK_CACHE_MAX_STALE_SECONDS', '300'))
+CACHE_JITTER = float(os.getenv('STOCK_CACHE_JITTER', '0.2'))
+stock_cache_rebuild = SingleFlight(logger)
+# Incrémentée par invalidate_stock_cache à chaque nouveau CSV
+stock_cache_generation = {'value': 0}
+
+def set_stock_cache(cache, generation):
+    """Publish a rebuilt snapshot cache; fresh only if no new CSV arrived since `generation` was read"""
+    cache['load_time'] = datetime.now()
+    cache['generation'] = generation
+    if generation == stock_cache_generation['value']:
+        cache['fresh_for'] = jittered(CACHE_DURATION_SECONDS, CACHE_JITTER)
+    else:
+        # Reconstruction partie de l'ancien CSV: servie, mais déjà périmée
+        cache['fresh_for'] = 0
+    app.stock_data_cache = cache
 
-# Fonction de chargement et de nettoyage des données
 def load_and_process_stocks():
-    # Cache pour éviter de recharger le fichier à chaque requête
-    CACHE_DURATION_SECONDS = 60
-    if hasattr(app, 'stock_data_cache') and (datetime.now() - app.stock_data_cache['load_time']).total_seconds() < CACHE_DURATION_SECONDS:
-         return app.stock_data_cache['stocks'], app.stock_data_cache['timestamp'], app.stock_data_cache['source']
+    """Current snapshot (stocks, timestamp, source), rebuilt at most once at a time"""
+    cache = getattr(app, 'stock_data_cache', None)
+    if cache is None:
+        stock_cache_rebuild.run(rebuild_stock_cache)
+    else:
+        age = (datetime.now() - cache['load_time']).total_seconds()
+        state = cache_state(age, cache['fresh_for'], CACHE_MAX_STALE_SECONDS)
+        if state == 'stale':
+            stock_cache_rebuild.start(rebuild_stock_cache)
+        elif state == 'expired':
+            stock_cache_rebuild.run(rebuild_stock_cache)
+
+    cache = app.stock_data_cache
+    return cache['stocks'], cache['timestamp'], cache['source']
 
+# Fonction de chargement et de nettoyage des données
+def rebuild_stock_cache():
     # Check if we need to scrape fresh data
     if should_refresh_data():
         scrape_and_save_data()
 
+    # Lue avant le CSV: une invalidation pendant la lecture rend ce cache périmé
+    generation = stock_cache_generation['value']
     try:
         csv_path = get_csv_file()
+
+        # Snapshot inchangé sur disque: inutile de relire et retraiter le CSV
+        csv_version = (csv_path, os.path.getmtime(csv_path))
+        if hasattr(app, 'stock_data_cache') and app.stock_data_cache.get('csv_version') == csv_version:
+            set_stock_cache(app.stock_data_cache, generation)
+            return
+
         logger.info(f"Tentative de chargement du fichier CSV: {csv_path}")
         # 1. Lecture du CSV
         # Utiliser l'argument sep=',' et l'engine python pour une meilleure robustesse
@@ -224,6 +544,9 @@ def load_and_process_stocks():
             if col in df.columns:
                 df[col] = df[col].apply(clean_numeric)
 
+        # Spread, prix milieu, déséquilibre, taille moyenne et VWAP en une passe vectorisée
+        metrics = metrics_records(compute_microstructure(df))
+
         # 3. Préparation du format pour le frontend
         stocks = []
         logger.info("Début de la préparation des données pour le frontend")
@@ -231,11 +554,12 @@ def load_and_process_stocks():
         # Mapping for better symbol lookup in case 'Instrument' is too long
         symbol_map = {row['Instrument'].strip(): row['Ticker'].strip() if 'Ticker' in df.columns and row['Ticker'].strip() else row['Instrument'].strip() for _, row in df.iterrows()}
         
-        for _, row in df.iterrows():
-            # Utiliser le Ticker s'il existe, sinon l'Instrument pour le 'symbol'
+        # Utiliser le Ticker s'il existe, sinon l'Instrument pour le 'symbol' (chaînes internées)
+        pairs = snapshot_symbols(df)
+        instrument_ids = snapshot_instrument_ids(pairs)
+
+        for (_, row), row_metrics, (symbol, company_name) in zip(df.iterrows(), metrics, pairs):
             instrument_name = row['Instrument'].strip()
-            symbol = row['Ticker'].strip() if 'Ticker' in df.columns and row['Ticker'].strip() else instrument_name
-            company_name = row['Company'].strip() if 'Company' in df.columns and row['Company'].strip() else instrument_name
             
             # Utiliser l'Instrument pour la recherche du secteur
             sector = MOCK_SECTOR_MAPPING.get(instrument_name, 'Other')
@@ -254,12 +578,15 @@ def load_and_process_stocks():
             # Construire l'objet stock pour le frontend
             stock_data = {
                 "symbol": symbol,
+                "instrument_id": instrument_ids.get(symbol),
                 "name": company_name, 
                 "price": row['Dernier_Cours'] if pd.notna(row['Dernier_Cours']) else 0.0,
                 "change": row['Variation_Pourcentage'] if pd.notna(row['Variation_Pourcentage']) else 0.0,
                 "volume": int(row['Quantite_Echangee']) if pd.notna(row['Quantite_Echangee']) else 0,
                 "sector": sector,
                 "marketCap": market_cap_str,
+                "marketCapValue": float(market_cap_mad) if pd.notna(market_cap_mad) else None,
+                "metrics": row_metrics,
                 
                 # Tous les détails pour le modal / page de détails
                 "details": {
@@ -289,16 +616,19 @@ def load_and_process_stocks():
                 }
             }
             stocks.append(stock_data)
+
+        # Nouveau snapshot: le transmettre une seule fois aux moteurs abonnés
+        if timestamp != published_snapshot['timestamp']:
+            published_snapshot['timestamp'] = timestamp
+            notify_snapshot_listeners(build_snapshot_arrays(df, stocks, timestamp), logger)
             
         # 4. Gestion du Cache
-        app.stock_data_cache = {
+        set_stock_cache({
             'stocks': stocks,
             'timestamp': timestamp,
             'source': "SCRAPE",
-            'load_time': datetime.now()
-        }
-        
-        return stocks, timestamp, "SCRAPE"
+            'csv_version': csv_version
+        }, generation)
 
     except FileNotFoundError:
         logger.error(f"ERROR: Le fichier {CSV_FILE} est introuvable. Tentative de chargement de données de simulation.")
@@ -310,24 +640,187 @@ def load_and_process_stocks():
         ]
         
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        app.stock_data_cache = {
+        set_stock_cache({
             'stocks': mock_stocks,
             'timestamp': timestamp,
-            'source': "MOCK",
-            'load_time': datetime.now()
-        }
-        return mock_stocks, timestamp, "MOCK"
+            'source': "MOCK"
+        }, generation)
         
     except Exception as e:
         logger.error(f"FATAL ERROR processing data: {e}")
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        app.stock_data_cache = {
+        set_stock_cache({
             'stocks': [],
             'timestamp': timestamp,
-            'source': "MOCK",
-            'load_time': datetime.now()
-        }
-        return [], timestamp, "MOCK"
+            'source': "MOCK"
+        }, generation)
+
+def get_stock_index():
+    """Symbol -> stock dict for the current snapshot (built once per snapshot)"""
+    load_and_process_stocks()
+    cache = app.stock_data_cache
+    if 'index' not in cache:
+        cache['index'] = {s['symbol']: s for s in cache['stocks']}
+    return cache['index']
+
+def get_screener():
+    """Screener arrays and sort orders for the current snapshot (built once per snapshot)"""
+    load_and_process_stocks()
+    cache = app.stock_data_cache
+    if 'screener' not in cache:
+        cache['screener'] = ScreenerIndex(cache['stocks'])
+    return cache['screener']
+
+# L'index de recherche survit aux snapshots tant que la liste d'instruments ne change pas
+search_index_cache = SearchIndexCache()
+
+def get_search_index():
+    """Typeahead index for the current instrument set"""
+    load_and_process_stocks()
+    cache = app.stock_data_cache
+    if 'search' not in cache:
+        cache['search'] = search_index_cache.get((s['symbol'], s['name']) for s in cache['stocks'])
+    return cache['search']
+
+def attach_current_prices(rows, with_change=False):
+    """Add current_price (and change) from the in-memory snapshot to user rows"""
+    index = get_stock_index()
+    for row in rows:
+        stock = index.get(row['symbol'])
+        row['current_price'] = stock['price'] if stock else None
+        if with_change:
+            row['change'] = stock['change'] if stock else None
+    return rows
+
+# Listes des utilisateurs en cache, invalidées par version à chaque écriture (tous workers)
+user_cache = UserResponseCache(UserVersions(os.getenv('ADMISSION_LOCK_DIR', DEFAULT_LOCK_DIR)))
+
+USER_LIST_QUERIES = {
+    'watchlist': '''
+        SELECT id, symbol, name, added_date, added_price
+        FROM watchlists
+        WHERE user_id = ?
+        ORDER BY added_date DESC
+    ''',
+    'portfolio': '''
+        SELECT id, symbol, name, shares, buy_price, buy_date, total_investment
+        FROM portfolios
+        WHERE user_id = ?
+        ORDER BY created_at DESC
+    ''',
+    'alerts': '''
+        SELECT id, symbol, name, target_price, condition, triggered,
+               created_date, triggered_date
+        FROM price_alerts
+        WHERE user_id = ?
+        ORDER BY created_date DESC
+    ''',
+}
+
+def cached_user_rows(kind):
+    """The session user's watchlist, portfolio or alerts rows (copies), from the cache or the database"""
+    user_id = session['user_id']
+
+    def load():
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(USER_LIST_QUERIES[kind], (user_id,))
+            return [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    return user_cache.get(user_id, kind, load)
+
+# Moyennes et covariances des rendements, mises à jour à chaque snapshot
+risk_engine = RiskEngine()
+
+@register_snapshot_listener
+def update_risk_engine(snapshot):
+    """Feed each new snapshot to the risk engine (warmed up from recent price_history on first use)"""
+    global risk_engine
+    if risk_engine.last_timestamp is None:
+        conn = get_db_connection()
+        try:
+            risk_engine = RiskEngine.from_history(conn, warmup_start(), '%s' if IS_PRODUCTION else '?')
+        finally:
+            conn.close()
+    risk_engine.update_from_snapshot(snapshot)
+
+# Statistiques par symbole des rendements et volumes, pour signaler les mouvements inhabituels
+anomaly_detector = AnomalyDetector()
+
+@register_snapshot_listener
+def update_anomaly_detector(snapshot):
+    """Score each new snapshot for anomalies (statistics warmed up from price_history on first use)"""
+    global anomaly_detector
+    if anomaly_detector.last_timestamp is None:
+        conn = get_db_connection()
+        try:
+            anomaly_detector = AnomalyDetector.from_history(conn, warmup_start(), '%s' if IS_PRODUCTION else '?')
+        finally:
+            conn.close()
+    anomalies = anomaly_detector.update_from_snapshot(snapshot)
+    if anomalies:
+        logger.info(f"{len(anomalies)} anomalies in snapshot {snapshot['timestamp']}")
+
+# Snapshots de la séance en cours (taille fixée au démarrage)
+intraday_buffer = IntradayBuffer()
+logger.info(f"Intraday buffer: {intraday_buffer.ticks} ticks x {intraday_buffer.max_symbols} symbols "
+            f"({intraday_buffer.nbytes / 1e6:.1f} MB)")
+
+@register_snapshot_listener
+def update_intraday_buffer(snapshot):
+    """Append each new snapshot to the intraday ring (rebuilt from today's price_history on first use)"""
+    global intraday_buffer
+    if intraday_buffer.last_timestamp is None:
+        conn = get_db_connection()
+        try:
+            intraday_buffer = IntradayBuffer.from_history(conn, placeholder='%s' if IS_PRODUCTION else '?')
+        finally:
+            conn.close()
+    intraday_buffer.append_snapshot(snapshot)
+
+# Indices pondérés et équipondérés (marché et secteurs), chaînés à partir des lignes modifiées
+market_index = MarketIndexEngine()
+
+@register_snapshot_listener
+def update_market_index(snapshot):
+    """Chain each new snapshot into the index levels (replayed from price_history on first use)"""
+    global market_index
+    if market_index.last_timestamp is None:
+        conn = get_db_connection()
+        try:
+            market_index = MarketIndexEngine.from_history(conn, dict(zip(snapshot['symbols'], snapshot['sectors'])),
+                                                          placeholder='%s' if IS_PRODUCTION else '?')
+        finally:
+            conn.close()
+    market_index.update_from_snapshot(snapshot)
+
+@register_listener
+def invalidate_stock_cache(changed_df, changes):
+    """Mark the in-memory snapshot stale so the changed CSV is reloaded (still served meanwhile)"""
+    stock_cache_generation['value'] += 1
+    if hasattr(app, 'stock_data_cache'):
+        app.stock_data_cache['fresh_for'] = 0
+
+@register_listener
+def queue_alert_notifications(changed_df, changes):
+    """Trigger the pending alerts of the moved symbols; sending is left to notifications.py --worker"""
+    pairs = snapshot_symbols(changed_df)
+    prices = {symbol: clean_numeric(row.get('Dernier_Cours', 0))
+              for (symbol, _), (_, row) in zip(pairs, changed_df.iterrows())}
+    instrument_ids = snapshot_instrument_ids(pairs)
+
+    conn = get_db_connection()
+    try:
+        triggered = enqueue_alert_notifications(conn, prices, instrument_ids, 'postgres' if IS_PRODUCTION else 'sqlite')
+    finally:
+        conn.close()
+    for user_id in {alert['user_id'] for alert in triggered}:
+        user_cache.invalidate(user_id)
+    if triggered:
+        logger.info(f"{len(triggered)} price alerts triggered, notifications queued")
 
 
 # ===== AUTHENTICATION ROUTES =====
@@ -486,19 +979,10 @@ def get_watchlist():
         return jsonify({"status": "error", "message": "Not authenticated"}), 401
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT w.id, w.symbol, w.name, w.added_date, w.added_price,
-                   s.price as current_price, s.change
-            FROM watchlists w
-            LEFT JOIN stocks s ON w.symbol = s.symbol
-            WHERE w.user_id = ?
-            ORDER BY w.added_date DESC
-        ''', (session['user_id'],))
+        watchlist = cached_user_rows('watchlist')
 
-        watchlist = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        # Prix courants depuis le snapshot en mémoire (mêmes valeurs que /api/stocks)
+        attach_current_prices(watchlist, with_change=True)
 
         return jsonify({"status": "success", "watchlist": watchlist})
 
@@ -516,15 +1000,21 @@ def add_to_watchlist():
     if not data or not data.get('symbol'):
         return jsonify({"status": "error", "message": "Symbol is required"}), 400
 
+    # Seuls les symboles du snapshot reçoivent un instrument_id
+    if data['symbol'] not in get_stock_index():
+        return jsonify({"status": "error", "message": "Unknown symbol"}), 400
+
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
 
+        instrument_id = instrument_registry.id_for(conn, data['symbol'], data.get('name'))
+
         # Check if already in watchlist
         cursor.execute('''
             SELECT id FROM watchlists
-            WHERE user_id = ? AND symbol = ?
-        ''', (session['user_id'], data['symbol']))
+            WHERE user_id = ? AND instrument_id = ?
+        ''', (session['user_id'], instrument_id))
 
         if cursor.fetchone():
             conn.close()
@@ -532,12 +1022,13 @@ def add_to_watchlist():
 
         # Add to watchlist
         cursor.execute('''
-            INSERT INTO watchlists (user_id, symbol, name, added_price)
-            VALUES (?, ?, ?, ?)
-        ''', (session['user_id'], data['symbol'], data.get('name', ''), data.get('price', 0)))
+            INSERT INTO watchlists (user_id, symbol, instrument_id, name, added_price)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (session['user_id'], data['symbol'], instrument_id, data.get('name', ''), data.get('price', 0)))
 
         conn.commit()
         conn.close()
+        user_cache.invalidate(session['user_id'])
 
         return jsonify({"status": "success", "message": "Added to watchlist"})
 
@@ -545,6 +1036,56 @@ def add_to_watchlist():
         logger.error(f"Add to watchlist error: {e}")
         return jsonify({"status": "error", "message": "Failed to add to watchlist"}), 500
 
+def read_import_upload():
+    """DataFrame from a multipart 'file' field or a raw CSV/JSON body"""
+    upload = request.files.get('file')
+    if upload is not None:
+        return read_upload(upload.read(), upload.mimetype or '')
+    return read_upload(request.get_data(), request.content_type or '')
+
+def import_response(imported, errors):
+    status = 200 if imported else 400
+    return jsonify({
+        "status": "success" if imported else "error",
+        "message": f"{imported} rows imported, {len(errors)} rejected",
+        "imported": imported,
+        "errors": errors
+    }), status
+
+@app.route('/api/watchlist/import', methods=['POST'])
+def import_watchlist():
+    """Add many stocks to the watchlist from a CSV/JSON upload (column: symbol)"""
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    try:
+        df = read_import_upload()
+        stocks, _, _ = load_and_process_stocks()
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            # Doublons détectés sur instrument_id, comme dans add_to_watchlist
+            cursor.execute('''
+                SELECT i.symbol FROM watchlists w JOIN instruments i ON i.id = w.instrument_id
+                WHERE w.user_id = ?
+            ''', (session['user_id'],))
+            existing = {row['symbol'] for row in cursor.fetchall()}
+            rows, errors = validate_watchlist(df, symbol_lookup(stocks), existing)
+            instrument_ids = instrument_registry.ensure(conn, [(symbol, name) for symbol, name, _ in rows])
+            insert_watchlist(conn, session['user_id'], rows, instrument_ids, '%s' if IS_PRODUCTION else '?')
+        finally:
+            conn.close()
+        user_cache.invalidate(session['user_id'])
+
+        return import_response(len(rows), errors)
+
+    except UploadError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Watchlist import error: {e}")
+        return jsonify({"status": "error", "message": "Failed to import watchlist"}), 500
+
 @app.route('/api/watchlist/<symbol>', methods=['DELETE'])
 def remove_from_watchlist(symbol):
     """Remove stock from watchlist"""
@@ -556,11 +1097,12 @@ def remove_from_watchlist(symbol):
         cursor = conn.cursor()
         cursor.execute('''
             DELETE FROM watchlists
-            WHERE user_id = ? AND symbol = ?
+            WHERE user_id = ? AND instrument_id = (SELECT id FROM instruments WHERE symbol = ?)
         ''', (session['user_id'], symbol))
 
         conn.commit()
         conn.close()
+        user_cache.invalidate(session['user_id'])
 
         return jsonify({"status": "success", "message": "Removed from watchlist"})
 
@@ -577,19 +1119,9 @@ def get_portfolio():
         return jsonify({"status": "error", "message": "Not authenticated"}), 401
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT p.id, p.symbol, p.name, p.shares, p.buy_price, p.buy_date, p.total_investment,
-                   s.price as current_price
-            FROM portfolios p
-            LEFT JOIN stocks s ON p.symbol = s.symbol
-            WHERE p.user_id = ?
-            ORDER BY p.created_at DESC
-        ''', (session['user_id'],))
+        portfolio = cached_user_rows('portfolio')
 
-        portfolio = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        attach_current_prices(portfolio)
 
         return jsonify({"status": "success", "portfolio": portfolio})
 
@@ -597,6 +1129,24 @@ def get_portfolio():
         logger.error(f"Get portfolio error: {e}")
         return jsonify({"status": "error", "message": "Failed to fetch portfolio"}), 500
 
+@app.route('/api/portfolio/risk', methods=['GET'])
+def get_portfolio_risk():
+    """Get volatility, beta, risk contributions and correlations of the user's portfolio"""
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    try:
+        rows = cached_user_rows('portfolio')
+
+        prices = {symbol: stock['price'] for symbol, stock in get_stock_index().items()}
+        risk = risk_engine.portfolio_risk(holdings_market_values(rows, prices))
+
+        return jsonify({"status": "success", "risk": risk, "market": market_index.levels()[0]})
+
+    except Exception as e:
+        logger.error(f"Get portfolio risk error: {e}")
+        return jsonify({"status": "error", "message": "Failed to compute portfolio risk"}), 500
+
 @app.route('/api/portfolio', methods=['POST'])
 def add_to_portfolio():
     """Add holding to portfolio"""
@@ -608,6 +1158,9 @@ def add_to_portfolio():
     if not data or not all(data.get(field) for field in required_fields):
         return jsonify({"status": "error", "message": "Missing required fields"}), 400
 
+    if data['symbol'] not in get_stock_index():
+        return jsonify({"status": "error", "message": "Unknown symbol"}), 400
+
     try:
         shares = float(data['shares'])
         buy_price = float(data['buy_price'])
@@ -617,13 +1170,14 @@ def add_to_portfolio():
         cursor = conn.cursor()
 
         cursor.execute('''
-            INSERT INTO portfolios (user_id, symbol, name, shares, buy_price, buy_date, total_investment)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (session['user_id'], data['symbol'], data['name'], shares, buy_price,
-              data.get('buy_date', datetime.now().isoformat()), total_investment))
+            INSERT INTO portfolios (user_id, symbol, instrument_id, name, shares, buy_price, buy_date, total_investment)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (session['user_id'], data['symbol'], instrument_registry.id_for(conn, data['symbol'], data['name']),
+              data['name'], shares, buy_price, data.get('buy_date', datetime.now().isoformat()), total_investment))
 
         conn.commit()
         conn.close()
+        user_cache.invalidate(session['user_id'])
 
         return jsonify({"status": "success", "message": "Added to portfolio"})
 
@@ -631,6 +1185,33 @@ def add_to_portfolio():
         logger.error(f"Add to portfolio error: {e}")
         return jsonify({"status": "error", "message": "Failed to add to portfolio"}), 500
 
+@app.route('/api/portfolio/import', methods=['POST'])
+def import_portfolio():
+    """Add many lots to the portfolio from a CSV/JSON upload (columns: symbol, shares, buy_price[, buy_date])"""
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    try:
+        df = read_import_upload()
+        stocks, _, _ = load_and_process_stocks()
+        rows, errors = validate_portfolio(df, symbol_lookup(stocks))
+
+        conn = get_db_connection()
+        try:
+            instrument_ids = instrument_registry.ensure(conn, [(row[0], row[1]) for row in rows])
+            insert_portfolio(conn, session['user_id'], rows, instrument_ids, '%s' if IS_PRODUCTION else '?')
+        finally:
+            conn.close()
+        user_cache.invalidate(session['user_id'])
+
+        return import_response(len(rows), errors)
+
+    except UploadError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Portfolio import error: {e}")
+        return jsonify({"status": "error", "message": "Failed to import portfolio"}), 500
+
 @app.route('/api/portfolio/<int:holding_id>', methods=['DELETE'])
 def remove_from_portfolio(holding_id):
     """Remove holding from portfolio"""
@@ -647,6 +1228,7 @@ def remove_from_portfolio(holding_id):
 
         conn.commit()
         conn.close()
+        user_cache.invalidate(session['user_id'])
 
         return jsonify({"status": "success", "message": "Removed from portfolio"})
 
@@ -663,20 +1245,9 @@ def get_price_alerts():
         return jsonify({"status": "error", "message": "Not authenticated"}), 401
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT a.id, a.symbol, a.name, a.target_price, a.condition, a.triggered,
-                   a.created_date, a.triggered_date,
-                   s.price as current_price
-            FROM price_alerts a
-            LEFT JOIN stocks s ON a.symbol = s.symbol
-            WHERE a.user_id = ?
-            ORDER BY a.created_date DESC
-        ''', (session['user_id'],))
+        alerts = cached_user_rows('alerts')
 
-        alerts = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        attach_current_prices(alerts)
 
         return jsonify({"status": "success", "alerts": alerts})
 
@@ -695,18 +1266,22 @@ def add_price_alert():
     if not data or not all(data.get(field) for field in required_fields):
         return jsonify({"status": "error", "message": "Missing required fields"}), 400
 
+    if data['symbol'] not in get_stock_index():
+        return jsonify({"status": "error", "message": "Unknown symbol"}), 400
+
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
 
         cursor.execute('''
-            INSERT INTO price_alerts (user_id, symbol, name, target_price, condition)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (session['user_id'], data['symbol'], data['name'],
-              float(data['target_price']), data['condition']))
+            INSERT INTO price_alerts (user_id, symbol, instrument_id, name, target_price, condition)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (session['user_id'], data['symbol'], instrument_registry.id_for(conn, data['symbol'], data['name']),
+              data['name'], float(data['target_price']), data['condition']))
 
         conn.commit()
         conn.close()
+        user_cache.invalidate(session['user_id'])
 
         return jsonify({"status": "success", "message": "Price alert created"})
 
@@ -730,6 +1305,7 @@ def remove_price_alert(alert_id):
 
         conn.commit()
         conn.close()
+        user_cache.invalidate(session['user_id'])
 
         return jsonify({"status": "success", "message": "Alert removed"})
 
@@ -737,6 +1313,64 @@ def remove_price_alert(alert_id):
         logger.error(f"Remove alert error: {e}")
         return jsonify({"status": "error", "message": "Failed to remove alert"}), 500
 
+# ===== EXPORTS (streaming CSV / NDJSON) =====
+
+def stream_export(name, columns, query_builder):
+    """Stream the rows of query_builder(conn) as CSV or NDJSON without loading them in memory"""
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    # Requête exécutée et premier paquet lu avant la réponse: une erreur donne un vrai 500
+    conn = None
+    try:
+        conn = get_db_connection()
+        query, params = query_builder(conn)
+        batches = iter_batches(conn, query, params)
+    except Exception as e:
+        if conn is not None:
+            conn.close()
+        logger.error(f"Export {name} error: {e}")
+        return jsonify({"status": "error", "message": f"Failed to export {name}"}), 500
+
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    response = Response(
+        stream_with_context(stream_rows(fmt, columns, batches)),
+        content_type=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+    # Client parti avant la première ligne: la connexion est fermée quand même
+    response.call_on_close(batches.close)
+    return response
+
+@app.route('/api/export/portfolio', methods=['GET'])
+def export_portfolio():
+    """Export user's portfolio (?format=csv|ndjson)"""
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+    user_id = session['user_id']
+    return stream_export('portfolio', PORTFOLIO_COLUMNS, lambda conn: portfolio_query(conn, user_id))
+
+@app.route('/api/export/alerts', methods=['GET'])
+def export_alerts():
+    """Export user's price alerts (?format=csv|ndjson)"""
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+    user_id = session['user_id']
+    return stream_export('alerts', ALERT_COLUMNS, lambda conn: alerts_query(conn, user_id))
+
+@app.route('/api/export/history', methods=['GET'])
+def export_history():
+    """Export price history (?symbols=A,B&start=&end=&format=csv|ndjson)"""
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    symbols = [s.strip() for s in request.args.get('symbols', '').split(',') if s.strip()]
+    if len(symbols) > MAX_EXPORT_SYMBOLS:
+        return jsonify({"status": "error", "message": f"At most {MAX_EXPORT_SYMBOLS} symbols per export"}), 400
+    start, end = request.args.get('start'), request.args.get('end')
+    return stream_export('history', HISTORY_COLUMNS, lambda conn: history_query(conn, symbols, start, end))
+
 @app.route('/api/refresh', methods=['POST'])
 def refresh_data():
     """Endpoint pour forcer le rafraîchissement des données depuis BVC"""
@@ -744,14 +1378,16 @@ def refresh_data():
     success = scrape_and_save_data()
 
     if success:
-        # Clear cache to force reload
-        if hasattr(app, 'stock_data_cache'):
-            delattr(app, 'stock_data_cache')
-
+        # invalidate_stock_cache ne périme le cache que si des lignes ont changé; on le reconstruit
+        # tout de suite pour que la réponse suivante montre les nouvelles données. Une reconstruction
+        # déjà en cours a pu lire l'ancien CSV: on en lance une nouvelle après elle
+        if getattr(app, 'stock_data_cache', {}).get('fresh_for') == 0:
+            stock_cache_rebuild.rerun(rebuild_stock_cache)
         return jsonify({
             "status": "success",
             "message": "Data refreshed successfully from Casablanca Stock Exchange",
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "changes": last_scrape['changes']
         })
     else:
         return jsonify({
@@ -777,9 +1413,114 @@ def get_all_stocks():
         "timestamp": timestamp,
         "source": source,
         "stocks": stocks,
-        "sectors": sectors
+        "sectors": sectors,
+        "anomalies": anomaly_detector.flags_by_symbol(),
+        "indices": market_index.levels()
+    })
+
+@app.route('/api/anomalies', methods=['GET'])
+def get_anomalies():
+    """Unusual price / volume moves of the latest snapshot, strongest first"""
+    metric = request.args.get('metric')
+    if metric and metric not in ANOMALY_METRICS:
+        return jsonify({"status": "error", "message": f"metric must be one of: {', '.join(ANOMALY_METRICS)}"}), 400
+
+    load_and_process_stocks()  # publie le dernier snapshot s'il est nouveau
+    anomalies = [a for a in anomaly_detector.latest if not metric or a['metric'] == metric]
+    return jsonify({
+        "status": "success",
+        "timestamp": anomaly_detector.last_timestamp,
+        "threshold": anomaly_detector.threshold,
+        "anomalies": anomalies
+    })
+
+@app.route('/api/screen', methods=['GET'])
+def screen_stocks():
+    """Screener: filtres (prix, variation, volume, capitalisation, secteurs, statut), tri et pagination."""
+    try:
+        filters, sort, order, page, limit = parse_screen_params(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    screener = get_screener()
+    stocks, total = screener.screen(filters, sort=sort, order=order, page=page, limit=limit)
+    cache = app.stock_data_cache
+
+    return jsonify({
+        "status": "success",
+        "timestamp": cache['timestamp'],
+        "source": cache['source'],
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "pages": (total + limit - 1) // limit,
+        "sort": sort,
+        "order": order,
+        "stocks": stocks
     })
 
+@app.route('/api/search', methods=['GET'])
+def search_stocks():
+    """Recherche typeahead par symbole ou nom d'instrument (accents et casse ignorés)."""
+    query = request.args.get('q', '').strip()
+    if len(query) > 100:
+        return jsonify({"status": "error", "message": "Query too long"}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 50)
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit must be an integer"}), 400
+
+    index = get_stock_index()
+    results = []
+    for symbol, name, score in get_search_index().search(query, limit):
+        stock = index.get(symbol, {})
+        results.append({
+            "symbol": symbol,
+            "name": name,
+            "sector": stock.get('sector'),
+            "price": stock.get('price'),
+            "change": stock.get('change'),
+            "score": score
+        })
+
+    return jsonify({"status": "success", "query": query, "results": results})
+
+# Matrice temps × symboles de price_history, rechargée quand l'historique grandit
+price_matrix_cache = PriceMatrixCache('%s' if IS_PRODUCTION else '?')
+
+@app.route('/api/backtest', methods=['POST'])
+def backtest_rules():
+    """Backtest alert / price rules over the stored price history"""
+    if 'user_id' not in session:
+        return jsonify({"status": "error", "message": "Not authenticated"}), 401
+
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"status": "error", "message": "JSON body with rules is required"}), 400
+
+    try:
+        rules = parse_rules(data.get('rules'), max_rules=MAX_API_RULES)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        conn = get_db_connection()
+        matrix = price_matrix_cache.get(conn)
+        conn.close()
+
+        matrix = matrix.between(data.get('start'), data.get('end'))
+        return jsonify({
+            "status": "success",
+            "snapshots": len(matrix),
+            "period": [matrix.times[0], matrix.times[-1]] if len(matrix) else None,
+            "results": run_backtest(matrix, rules)
+        })
+
+    except Exception as e:
+        logger.error(f"Backtest error: {e}")
+        return jsonify({"status": "error", "message": "Failed to run backtest"}), 500
+
 @app.route('/api/stocks/<symbol>', methods=['GET'])
 def get_stock_details(symbol):
     """Endpoint pour obtenir les détails d'une seule action (y compris les données de graphique simulées)."""
@@ -825,19 +1566,114 @@ def get_stock_details(symbol):
     return jsonify({
         "status": "success",
         "details": stock['details'], # Retourne tous les détails
+        "metrics": stock.get('metrics'),
         "chart_data": {
             "labels": chart_labels,
             "prices": chart_prices
         }
     })
 
-# Endpoint pour servir les fichiers statiques (inchangé)
+@app.route('/api/stocks/<symbol>/intraday', methods=['GET'])
+def get_stock_intraday(symbol):
+    """Today's ticks of one stock from the in-memory intraday buffer"""
+    if not re.match(r'^[a-zA-Z0-9\s\-\.]+$', symbol) or len(symbol) > 50:
+        abort(400, description="Invalid symbol format")
+
+    load_and_process_stocks()  # publie le dernier snapshot s'il est nouveau
+    symbol = next((s for s in intraday_buffer.index if s.upper() == symbol.upper()), None)
+    if symbol is None:
+        abort(404, description="No intraday data for this symbol.")
+
+    try:
+        sma_window = min(max(int(request.args.get('sma', 0)), 0), intraday_buffer.ticks)
+    except ValueError:
+        return jsonify({"status": "error", "message": "sma must be an integer"}), 400
+
+    times, series = intraday_buffer.series(symbol)
+    result = {
+        "status": "success",
+        "symbol": symbol,
+        "times": list(pd.to_datetime(times, unit='s').strftime("%Y-%m-%d %H:%M:%S")),
+        **{field: json_values(values) for field, values in series.items()},
+    }
+    if sma_window:
+        result["sma"] = json_values(moving_average(series['price'], sma_window))
+    return jsonify(result)
+
+@app.route('/api/intraday/movers', methods=['GET'])
+def get_intraday_movers():
+    """Biggest price moves over the last N minutes, from the intraday buffer"""
+    try:
+        minutes = min(max(int(request.args.get('minutes', 30)), 1), 24 * 60)
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+    except ValueError:
+        return jsonify({"status": "error", "message": "minutes and limit must be integers"}), 400
+
+    load_and_process_stocks()
+    moves = [
+        {"symbol": symbol, "price": round(float(now), 2), "reference_price": round(float(before), 2),
+         "change": round(float(change), 2)}
+        for symbol, (now, before, change) in intraday_buffer.deltas(minutes).items()
+        if np.isfinite(change)
+    ]
+    moves.sort(key=lambda m: abs(m['change']), reverse=True)
+    return jsonify({"status": "success", "minutes": minutes, "ticks": len(intraday_buffer), "movers": moves[:limit]})
+
+@app.route('/api/indices', methods=['GET'])
+def get_indices():
+    """Current cap-weighted and equal-weighted levels of the market and sector indices"""
+    load_and_process_stocks()  # publie le dernier snapshot s'il est nouveau
+    return jsonify({
+        "status": "success",
+        "timestamp": market_index.last_timestamp,
+        "base": market_index.base,
+        "indices": market_index.levels()
+    })
+
+@app.route('/api/indices/<name>/intraday', methods=['GET'])
+def get_index_intraday(name):
+    """Today's levels of one index (MARKET or a sector name)"""
+    load_and_process_stocks()
+    name = next((g for g in market_index.groups if g.upper() == name.upper()), None)
+    if name is None:
+        abort(404, description="Unknown index.")
+
+    times, cap_weighted, equal_weighted = market_index.intraday(name)
+    return jsonify({
+        "status": "success",
+        "index": name,
+        "times": times,
+        "cap_weighted": cap_weighted,
+        "equal_weighted": equal_weighted
+    })
+
+# Assets fingerprintés et précompressés (python build_assets.py); sinon fichiers sources
+ASSETS_DIR = os.getenv('ASSETS_DIR', 'dist')
+asset_manifest = load_manifest(ASSETS_DIR)
+if asset_manifest:
+    logger.info(f"Serving {len(asset_manifest['assets'])} built assets from {ASSETS_DIR}/")
+
+def send_built_asset(path):
+    """Send a built page or asset, precompressed when the client accepts it"""
+    filename, encoding = pick_variant(asset_manifest, path, request.headers.get('Accept-Encoding'))
+    response = send_from_directory(ASSETS_DIR, filename, mimetype=mimetypes.guess_type(path)[0])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE if path in asset_manifest['immutable'] else PAGE_CACHE
+    return response
+
+# Endpoint pour servir les fichiers statiques
 @app.route('/')
 def serve_index():
+    if asset_manifest:
+        return send_built_asset('index.html')
     return send_from_directory('.', 'index.html')
 
 @app.route('/<path:path>')
 def serve_static(path):
+    if asset_manifest and (path in asset_manifest['immutable'] or path in asset_manifest['pages']):
+        return send_built_asset(path)
     if path.endswith('.html') or path.endswith('.js') or path.endswith('.css') or path.endswith('.ico'):
         return send_from_directory('.', path)
     abort(404)
@@ -851,4 +1687,7 @@ if __name__ == '__main__':
     print(f"Debug mode: {debug_mode}")
     print(f"Running on port: {port}")
 
+    # Serveur de développement: créer ou mettre à jour le schéma local
+    init_database()
+
     app.run(debug=debug_mode, port=port, host='0.0.0.0')
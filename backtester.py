@@ -0,0 +1,380 @@
+"""
+Backtest vectorisé de règles d'alerte et de prix sur price_history.
+
+L'historique est pivoté en une matrice temps × symboles (dernières valeurs
+reportées), puis toutes les règles d'un même type sont évaluées d'un coup
+sous forme de tableaux règles × temps × symboles. Les règles sont traitées
+par blocs pour borner la mémoire, et peuvent être réparties sur un pool de
+processus pour les très gros jeux de règles.
+
+Types de règles (mêmes sémantiques que price_alerts pour above/below):
+    {"type": "above", "target_price": 120}
+    {"type": "below", "target_price": 95.5, "symbols": ["IAM"]}
+    {"type": "change_above", "threshold": 3}        # variation du jour en %
+    {"type": "change_below", "threshold": -3}
+    {"type": "cross_above", "fast": 5, "slow": 20}  # croisement de moyennes mobiles
+    {"type": "cross_below", "fast": 5, "slow": 20}
+
+Usage:
+    python backtester.py --rules rules.json [--start 2025-01-01] [--workers 4]
+    python backtester.py --benchmark --symbols 80 --steps 21000 --rule-count 500
+"""
+import argparse
+import bisect
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+THRESHOLD_RULES = {
+    "above": ("price", np.greater_equal, "target_price"),
+    "below": ("price", np.less_equal, "target_price"),
+    "change_above": ("change", np.greater_equal, "threshold"),
+    "change_below": ("change", np.less_equal, "threshold"),
+}
+CROSSOVER_RULES = ("cross_above", "cross_below")
+RULE_TYPES = tuple(THRESHOLD_RULES) + CROSSOVER_RULES
+
+# Nombre max de cellules règles × temps × symboles évaluées en une fois
+CHUNK_CELLS = 20_000_000
+MAX_WINDOW = 500
+# Moyennes mobiles gardées en mémoire (une matrice temps × symboles chacune)
+AVERAGE_CACHE_SIZE = 8
+MAX_API_RULES = 50
+TOP_SYMBOLS = 10
+
+def _end_bound(end):
+    """(inclusive, bound) for an end filter: a bare YYYY-MM-DD covers the whole day (< next day)"""
+    try:
+        if len(end) == 10:
+            return False, (date.fromisoformat(end) + timedelta(days=1)).isoformat()
+    except ValueError:
+        pass
+    return True, end
+
+class PriceMatrix:
+    """Time × symbol arrays of prices and daily changes"""
+
+    def __init__(self, times, symbols, prices, changes):
+        self.times = list(times)
+        self.symbols = list(symbols)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.changes = np.asarray(changes, dtype=np.float64)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def __len__(self):
+        return len(self.times)
+
+    def between(self, start=None, end=None):
+        """Rows with start <= time <= end (times are sorted snapshot_time strings)"""
+        lo = bisect.bisect_left(self.times, start) if start else 0
+        hi = len(self.times)
+        if end:
+            inclusive, bound = _end_bound(end)
+            hi = (bisect.bisect_right if inclusive else bisect.bisect_left)(self.times, bound)
+        if (lo, hi) == (0, len(self.times)):
+            return self
+        return PriceMatrix(self.times[lo:hi], self.symbols, self.prices[lo:hi], self.changes[lo:hi])
+
+    def extend(self, later):
+        """This matrix followed by `later` (snapshots after the last one), forward-filled across the seam"""
+        if not len(later):
+            return self
+        if not len(self):
+            return later
+        symbols = self.symbols + [s for s in later.symbols if s not in self.index]
+        position = {s: i for i, s in enumerate(symbols)}
+        columns = [position[s] for s in later.symbols]
+
+        def stack(old, new):
+            rows = np.full((len(self) + len(later), len(symbols)), np.nan)
+            rows[:len(self), :len(self.symbols)] = old
+            rows[len(self):, columns] = new
+            # Les symboles qui n'ont pas bougé depuis gardent leur dernière valeur
+            rows[len(self) - 1:] = pd.DataFrame(rows[len(self) - 1:]).ffill().to_numpy()
+            return rows
+
+        return PriceMatrix(self.times + later.times, symbols, stack(self.prices, later.prices),
+                           stack(self.changes, later.changes))
+
+    @classmethod
+    def from_history(cls, conn, start=None, end=None, placeholder="?", after=None):
+        """Pivot price_history (only changed rows are stored) into forward-filled matrices"""
+        query = "SELECT symbol, price, change, snapshot_time FROM price_history"
+        clauses, params = [], []
+        if start:
+            clauses.append(f"snapshot_time >= {placeholder}")
+            params.append(start)
+        if after:
+            clauses.append(f"snapshot_time > {placeholder}")
+            params.append(after)
+        if end:
+            inclusive, bound = _end_bound(end)
+            clauses.append(f"snapshot_time {'<=' if inclusive else '<'} {placeholder}")
+            params.append(bound)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+
+        cursor = conn.cursor()
+        cursor.execute(query + " ORDER BY snapshot_time", tuple(params))
+        rows = [dict(r) for r in cursor.fetchall()]
+        if not rows:
+            return cls([], [], np.empty((0, 0)), np.empty((0, 0)))
+
+        history = pd.DataFrame(rows)
+        history["snapshot_time"] = history["snapshot_time"].astype(str)
+        prices = history.pivot_table(index="snapshot_time", columns="symbol", values="price", aggfunc="last").ffill()
+        changes = history.pivot_table(index="snapshot_time", columns="symbol", values="change", aggfunc="last")
+        changes = changes.reindex(index=prices.index, columns=prices.columns).ffill()
+        return cls(prices.index, prices.columns, prices.to_numpy(), changes.to_numpy())
+
+class PriceMatrixCache:
+    """Keep one PriceMatrix; only the snapshots stored since the last call are read and appended"""
+
+    def __init__(self, placeholder="?"):
+        self.placeholder = placeholder
+        self._matrix = None
+
+    def get(self, conn):
+        if self._matrix is None:
+            self._matrix = PriceMatrix.from_history(conn, placeholder=self.placeholder)
+            return self._matrix
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(snapshot_time) AS last_time FROM price_history")
+        row = cursor.fetchone()
+        last_time = row["last_time"] if hasattr(row, "keys") else row[0]
+        if last_time is not None and (not len(self._matrix) or str(last_time) > self._matrix.times[-1]):
+            after = self._matrix.times[-1] if len(self._matrix) else None
+            later = PriceMatrix.from_history(conn, placeholder=self.placeholder, after=after)
+            self._matrix = self._matrix.extend(later)
+        return self._matrix
+
+def parse_rules(raw_rules, max_rules=None):
+    """Validate a list of rule dicts; raises ValueError with a user-facing message"""
+    if not isinstance(raw_rules, list) or not raw_rules:
+        raise ValueError("rules must be a non-empty list")
+    if max_rules and len(raw_rules) > max_rules:
+        raise ValueError(f"At most {max_rules} rules per backtest")
+
+    rules = []
+    for position, raw in enumerate(raw_rules):
+        if not isinstance(raw, dict) or raw.get("type") not in RULE_TYPES:
+            raise ValueError(f"rule {position}: type must be one of: {', '.join(RULE_TYPES)}")
+        rule = {"type": raw["type"]}
+        try:
+            if rule["type"] in THRESHOLD_RULES:
+                field = THRESHOLD_RULES[rule["type"]][2]
+                rule[field] = float(raw[field])
+            else:
+                rule["fast"], rule["slow"] = int(raw["fast"]), int(raw["slow"])
+                if not 1 <= rule["fast"] < rule["slow"] <= MAX_WINDOW:
+                    raise ValueError
+        except (KeyError, TypeError, ValueError):
+            if rule["type"] in THRESHOLD_RULES:
+                raise ValueError(f"rule {position}: {THRESHOLD_RULES[rule['type']][2]} must be a number")
+            raise ValueError(f"rule {position}: fast and slow must be integers with 1 <= fast < slow <= {MAX_WINDOW}")
+        if raw.get("symbols"):
+            if not isinstance(raw["symbols"], list):
+                raise ValueError(f"rule {position}: symbols must be a list")
+            rule["symbols"] = [str(s) for s in raw["symbols"]]
+        rules.append(rule)
+    return rules
+
+class _MovingAverages:
+    """Trailing means per window from shared cumulative sums, with a small LRU of results"""
+
+    def __init__(self, prices, capacity=AVERAGE_CACHE_SIZE):
+        # Sommes cumulées précédées d'une ligne de zéros: somme d'une fenêtre = une soustraction
+        self.csum = np.zeros((len(prices) + 1,) + prices.shape[1:])
+        np.cumsum(np.nan_to_num(prices), axis=0, out=self.csum[1:])
+        self.ccount = np.zeros(self.csum.shape, dtype=np.int64)
+        np.cumsum(np.isfinite(prices), axis=0, out=self.ccount[1:])
+        self.capacity = capacity
+        self.cache = OrderedDict()
+
+    def __getitem__(self, window):
+        if window in self.cache:
+            self.cache.move_to_end(window)
+            return self.cache[window]
+        # NaN tant que la fenêtre n'est pas pleine de prix connus
+        mean = np.full((len(self.csum) - 1,) + self.csum.shape[1:], np.nan)
+        total = self.csum[window:] - self.csum[:-window]
+        full = (self.ccount[window:] - self.ccount[:-window]) == window
+        np.divide(total, window, out=mean[window - 1:], where=full)
+        self.cache[window] = mean
+        if len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+        return mean
+
+def _fire_stats(signal, count_first_row):
+    """
+    Per rule and symbol: number of times the condition became true, index of
+    the first time, and fraction of time spent in the condition.
+    signal is a (rules, time, symbols) boolean array.
+    """
+    edges = np.empty_like(signal)
+    edges[:, 0, :] = signal[:, 0, :] if count_first_row else False
+    np.greater(signal[:, 1:, :], signal[:, :-1, :], out=edges[:, 1:, :])
+    fires = edges.sum(axis=1)
+    first = np.where(fires > 0, edges.argmax(axis=1), -1)
+    in_condition = signal.mean(axis=1) if signal.shape[1] else np.zeros(fires.shape)
+    return fires, first, in_condition
+
+def _rule_chunks(count, steps, symbols):
+    size = max(1, CHUNK_CELLS // max(steps * symbols, 1))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+def evaluate_rules(matrix, rules):
+    """Evaluate rules on a PriceMatrix; returns (fires, first, in_condition) as (rules, symbols) arrays"""
+    n_rules, steps, n_symbols = len(rules), len(matrix), len(matrix.symbols)
+    fires = np.zeros((n_rules, n_symbols), dtype=np.int64)
+    first = np.full((n_rules, n_symbols), -1, dtype=np.int64)
+    in_condition = np.zeros((n_rules, n_symbols))
+    if not steps or not n_symbols:
+        return fires, first, in_condition
+
+    # Règles à seuil: une comparaison diffusée par type de règle
+    for rule_type, (column, compare, field) in THRESHOLD_RULES.items():
+        positions = np.array([k for k, r in enumerate(rules) if r["type"] == rule_type], dtype=np.int64)
+        if not len(positions):
+            continue
+        values = getattr(matrix, column + "s")
+        thresholds = np.array([rules[k][field] for k in positions])
+        for lo, hi in _rule_chunks(len(positions), steps, n_symbols):
+            with np.errstate(invalid="ignore"):
+                signal = compare(values[None, :, :], thresholds[lo:hi, None, None])
+            block = positions[lo:hi]
+            fires[block], first[block], in_condition[block] = _fire_stats(signal, count_first_row=True)
+
+    # Croisements: règles triées par fenêtres pour réutiliser les moyennes mobiles en cache
+    positions = sorted((k for k, r in enumerate(rules) if r["type"] in CROSSOVER_RULES),
+                       key=lambda k: (rules[k]["fast"], rules[k]["slow"]))
+    if positions:
+        positions = np.array(positions, dtype=np.int64)
+        averages = _MovingAverages(matrix.prices)
+        for lo, hi in _rule_chunks(len(positions), steps, n_symbols):
+            block = positions[lo:hi]
+            signal = np.empty((len(block), steps, n_symbols), dtype=bool)
+            for j, k in enumerate(block):
+                fast, slow = averages[rules[k]["fast"]], averages[rules[k]["slow"]]
+                # cross_below = la lente passe au-dessus de la rapide
+                upper, lower = (fast, slow) if rules[k]["type"] == "cross_above" else (slow, fast)
+                with np.errstate(invalid="ignore"):
+                    np.greater(upper, lower, out=signal[j])
+            # Un croisement suppose un état précédent connu: la première ligne ne compte pas
+            fires[block], first[block], in_condition[block] = _fire_stats(signal, count_first_row=False)
+
+    # Restriction éventuelle des règles à certains symboles
+    for k, rule in enumerate(rules):
+        if rule.get("symbols"):
+            keep = np.zeros(n_symbols, dtype=bool)
+            keep[[matrix.index[s] for s in rule["symbols"] if s in matrix.index]] = True
+            fires[k, ~keep] = 0
+            first[k, ~keep] = -1
+            in_condition[k, ~keep] = 0.0
+    return fires, first, in_condition
+
+def _evaluate_chunk(args):
+    matrix, rules = args
+    return evaluate_rules(matrix, rules)
+
+def run_backtest(matrix, rules, workers=0, top=TOP_SYMBOLS):
+    """Backtest rules (optionally across a process pool) and summarize each rule"""
+    if workers and workers > 1 and len(rules) > workers:
+        size = -(-len(rules) // workers)
+        chunks = [rules[i:i + size] for i in range(0, len(rules), size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_evaluate_chunk, [(matrix, chunk) for chunk in chunks]))
+        fires, first, in_condition = (np.concatenate([p[i] for p in parts]) for i in range(3))
+    else:
+        fires, first, in_condition = evaluate_rules(matrix, rules)
+
+    results = []
+    for k, rule in enumerate(rules):
+        fired = np.flatnonzero(fires[k])
+        ranked = fired[np.argsort(-fires[k, fired], kind="stable")][:top]
+        first_fire = first[k, fired].min() if len(fired) else -1
+        results.append({
+            "rule": rule,
+            "fires": int(fires[k].sum()),
+            "symbols_fired": int(len(fired)),
+            "first_fire": matrix.times[first_fire] if first_fire >= 0 else None,
+            "top_symbols": [
+                {
+                    "symbol": matrix.symbols[i],
+                    "fires": int(fires[k, i]),
+                    "first_fire": matrix.times[first[k, i]],
+                    "time_in_condition": round(float(in_condition[k, i]), 4),
+                }
+                for i in ranked
+            ],
+        })
+    return results
+
+# ===== BENCHMARK =====
+
+def synthetic_matrix(symbols, steps, seed=42):
+    """Random-walk prices with intraday changes, for benchmarks"""
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0, 0.002, (steps, symbols))
+    prices = 100 * np.exp(np.cumsum(returns, axis=0))
+    changes = (prices / prices[0] - 1) * 100
+    times = [f"t{i:06d}" for i in range(steps)]
+    return PriceMatrix(times, [f"SYM{j:03d}" for j in range(symbols)], prices, changes)
+
+def synthetic_rules(count, seed=7):
+    rng = np.random.default_rng(seed)
+    rules = []
+    for k in range(count):
+        kind = RULE_TYPES[k % len(RULE_TYPES)]
+        if kind in ("above", "below"):
+            rules.append({"type": kind, "target_price": float(rng.uniform(80, 120))})
+        elif kind in ("change_above", "change_below"):
+            rules.append({"type": kind, "threshold": float(rng.uniform(-5, 5))})
+        else:
+            fast = int(rng.integers(2, 20))
+            rules.append({"type": kind, "fast": fast, "slow": fast + int(rng.integers(5, 60))})
+    return rules
+
+def run_benchmark(symbols, steps, rule_count, workers):
+    matrix = synthetic_matrix(symbols, steps)
+    rules = parse_rules(synthetic_rules(rule_count))
+    started = time.perf_counter()
+    results = run_backtest(matrix, rules, workers=workers)
+    elapsed = time.perf_counter() - started
+    cells = steps * symbols * rule_count
+    print(f"[INFO] {rule_count} rules × {steps} steps × {symbols} symbols "
+          f"({cells / 1e6:.0f}M cells) in {elapsed:.2f}s with {workers or 1} worker(s)")
+    print(f"[INFO] Total fires: {sum(r['fires'] for r in results)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest alert and price rules on price_history")
+    parser.add_argument("--rules", help="JSON file containing a list of rules")
+    parser.add_argument("--start", help="First snapshot_time (inclusive)")
+    parser.add_argument("--end", help="Last snapshot_time (inclusive; a date includes the whole day)")
+    parser.add_argument("--workers", type=int, default=0, help="Process pool size (0 = in-process)")
+    parser.add_argument("--benchmark", action="store_true", help="Run on synthetic data instead of the database")
+    parser.add_argument("--symbols", type=int, default=80)
+    parser.add_argument("--steps", type=int, default=21000, help="About a year of 5-minute bars")
+    parser.add_argument("--rule-count", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.symbols, args.steps, args.rule_count, args.workers)
+    elif not args.rules:
+        parser.error("--rules is required (or use --benchmark)")
+    else:
+        from init_db import get_db_connection, IS_PRODUCTION
+
+        with open(args.rules, encoding="utf-8") as f:
+            rules = parse_rules(json.load(f))
+        conn = get_db_connection()
+        matrix = PriceMatrix.from_history(conn, args.start, args.end, "%s" if IS_PRODUCTION else "?")
+        conn.close()
+        print(f"[INFO] Price history: {len(matrix)} snapshots × {len(matrix.symbols)} symbols")
+        print(json.dumps(run_backtest(matrix, rules, workers=args.workers), indent=2, ensure_ascii=False))
@@ -0,0 +1,147 @@
+"""
+Build des assets statiques: empreinte de contenu, précompression, réécriture HTML.
+
+Chaque fichier .js/.css/.ico référencé par les pages est copié dans dist/
+sous un nom contenant le hash de son contenu (script.js -> script.3f2a9c1b.js),
+avec ses variantes .gz et .br. Les pages HTML sont réécrites pour pointer vers
+ces noms et précompressées elles aussi. Le serveur sert alors les variantes
+précompressées, avec Cache-Control immutable pour les fichiers fingerprintés:
+une visite répétée ne refait aucune requête statique.
+
+Usage:
+    python build_assets.py [--out dist]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:  # variantes .br ignorées si le module n'est pas installé
+    brotli = None
+
+ASSETS_DIR = "dist"
+MANIFEST_FILE = "manifest.json"
+HASH_LENGTH = 8
+
+PAGES = [
+    "index.html", "stocks.html", "stock-details.html", "dashboard.html",
+    "watchlist.html", "alerts.html", "login.html", "register.html",
+]
+ASSET_EXTENSIONS = (".js", ".css", ".ico")
+
+# Encodages servis, par ordre de préférence
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+PAGE_CACHE = "no-cache"
+
+# Attributs src/href locaux (pas d'URL absolue, d'ancre ni de query string)
+_REFERENCE = re.compile(r'(?P<attr>\b(?:src|href))="(?P<path>(?!https?:|//|#|mailto:)[^"?#]+)"')
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+def fingerprinted_name(path, data):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{content_hash(data)}{ext}"
+
+def _write_variants(out_dir, name, data):
+    """Write the file plus its .gz / .br variants when they are smaller"""
+    target = os.path.join(out_dir, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as f:
+        f.write(data)
+
+    encodings = []
+    compressors = {"gzip": lambda d: gzip.compress(d, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressors["br"] = lambda d: brotli.compress(d, quality=11)
+    for encoding, suffix in ENCODINGS:
+        if encoding not in compressors:
+            continue
+        compressed = compressors[encoding](data)
+        if len(compressed) < len(data):
+            with open(target + suffix, "wb") as f:
+                f.write(compressed)
+            encodings.append(encoding)
+    return encodings
+
+def build_assets(source_dir=".", out_dir=ASSETS_DIR, pages=PAGES):
+    """Build fingerprinted, precompressed assets and rewritten pages; returns the manifest"""
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    manifest = {"assets": {}, "pages": [], "encodings": {}}
+
+    def fingerprint(reference):
+        # Les références sont relatives à la racine du site ("/static/x" ou "style.css")
+        path = reference.lstrip("/")
+        if not path.endswith(ASSET_EXTENSIONS):
+            return None
+        if path not in manifest["assets"]:
+            source = os.path.join(source_dir, path)
+            if not os.path.isfile(source):
+                return None
+            with open(source, "rb") as f:
+                data = f.read()
+            hashed = fingerprinted_name(path, data)
+            manifest["encodings"][hashed] = _write_variants(out_dir, hashed, data)
+            manifest["assets"][path] = hashed
+        return "/" + manifest["assets"][path]
+
+    for page in pages:
+        source = os.path.join(source_dir, page)
+        if not os.path.isfile(source):
+            continue
+        with open(source, encoding="utf-8", newline="") as f:
+            html = f.read()
+
+        def rewrite(match):
+            hashed = fingerprint(match.group("path"))
+            return f'{match.group("attr")}="{hashed}"' if hashed else match.group(0)
+
+        html = _REFERENCE.sub(rewrite, html)
+        manifest["encodings"][page] = _write_variants(out_dir, page, html.encode("utf-8"))
+        manifest["pages"].append(page)
+
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+def load_manifest(out_dir=ASSETS_DIR):
+    """Manifest of a previous build, or None when assets were not built"""
+    try:
+        with open(os.path.join(out_dir, MANIFEST_FILE), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    manifest["immutable"] = set(manifest["assets"].values())
+    return manifest
+
+def pick_variant(manifest, path, accept_encoding):
+    """Return (filename, content encoding) of the best variant the client accepts"""
+    accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+    available = manifest["encodings"].get(path, [])
+    for encoding, suffix in ENCODINGS:
+        if encoding in available and encoding in accepted:
+            return path + suffix, encoding
+    return path, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static assets")
+    parser.add_argument("--out", default=ASSETS_DIR)
+    args = parser.parse_args()
+
+    manifest = build_assets(out_dir=args.out)
+    if brotli is None:
+        print("[INFO] brotli not installed: only gzip variants were written")
+    for path, hashed in sorted(manifest["assets"].items()):
+        print(f"  {path} -> {hashed} ({', '.join(manifest['encodings'][hashed]) or 'identity'})")
+    print(f"[SUCCESS] {len(manifest['assets'])} assets and {len(manifest['pages'])} pages built in {args.out}/")
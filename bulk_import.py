@@ -0,0 +1,236 @@
+"""
+Import en masse de la watchlist et du portefeuille (export courtier CSV ou JSON).
+
+Toutes les lignes sont validées d'un coup avec pandas contre l'index des
+symboles du snapshot (symbole ou nom d'instrument, sans tenir compte de
+la casse), puis les lignes valides sont écrites avec un seul executemany
+dans une transaction. Chaque ligne rejetée est renvoyée avec son numéro
+et la raison du rejet.
+
+Benchmark (base SQLite temporaire, import de 500 lots contre 500 POST unitaires):
+    python bulk_import.py --rows 500
+"""
+import argparse
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+MAX_IMPORT_ROWS = 5000
+CSV_SEPARATORS = (",", ";", "\t")
+# Formats essayés valeur par valeur: jour en premier (exports français), puis ISO
+BUY_DATE_FORMATS = ("%d/%m/%Y", "%d/%m/%Y %H:%M", "%d/%m/%y", "%d-%m-%Y", "%d.%m.%Y", "ISO8601")
+
+WATCHLIST_FIELDS = ["symbol"]
+PORTFOLIO_FIELDS = ["symbol", "shares", "buy_price"]
+
+class UploadError(ValueError):
+    """The upload itself is unreadable (as opposed to individual bad rows)"""
+
+def read_upload(raw, content_type=""):
+    """DataFrame of strings from a CSV or JSON upload (list of objects or {"items": [...]})"""
+    text = raw.decode("utf-8-sig") if isinstance(raw, bytes) else raw
+    if not text.strip():
+        raise UploadError("Empty upload")
+    if "json" in content_type or text.lstrip()[:1] in "[{":
+        try:
+            items = json.loads(text)
+        except ValueError as e:
+            raise UploadError(f"Invalid JSON: {e}")
+        if isinstance(items, dict):
+            items = items.get("items")
+        if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+            raise UploadError("JSON upload must be a list of objects or {\"items\": [...]}")
+        df = pd.DataFrame(items, dtype=object)
+        first_row = 1
+    else:
+        try:
+            header = text.lstrip().splitlines()[0]
+            sep = max(CSV_SEPARATORS, key=header.count)  # exports Excel français: ';'
+            df = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False, sep=sep)
+        except (ValueError, pd.errors.ParserError) as e:
+            raise UploadError(f"Unreadable CSV: {e}")
+        first_row = 2  # la ligne 1 est l'en-tête
+
+    if len(df) > MAX_IMPORT_ROWS:
+        raise UploadError(f"Too many rows ({len(df)}), maximum is {MAX_IMPORT_ROWS}")
+    df.columns = [str(c).strip().lower().replace(" ", "_") for c in df.columns]
+    df = df.astype(object).where(df.notna(), "").astype(str).apply(lambda col: col.str.strip())
+    df.attrs["first_row"] = first_row
+    return df
+
+def parse_dates(values):
+    """Datetimes (NaT when unreadable), each value tried against BUY_DATE_FORMATS in order"""
+    values = values.replace("", None)
+    dates = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    for fmt in BUY_DATE_FORMATS:
+        missing = dates.isna() & values.notna()
+        if not missing.any():
+            break
+        dates[missing] = pd.to_datetime(values[missing], format=fmt, errors="coerce")
+    return dates
+
+def symbol_lookup(stocks):
+    """{UPPERCASE symbol or name: stock} for the snapshot's stocks"""
+    lookup = {}
+    for stock in stocks:
+        lookup.setdefault(stock["name"].upper(), stock)
+    for stock in stocks:
+        lookup[stock["symbol"].upper()] = stock
+    return lookup
+
+class _Errors:
+    """Per-row errors, first error per row wins"""
+
+    def __init__(self, df):
+        self.rows = pd.Series("", index=df.index)
+        self.first_row = df.attrs.get("first_row", 1)
+
+    def add(self, mask, message):
+        self.rows[mask & (self.rows == "")] = message
+
+    @property
+    def valid(self):
+        return self.rows == ""
+
+    def report(self):
+        """Row numbers as the user sees them: CSV line, or 1-based position in the JSON list"""
+        bad = self.rows[self.rows != ""]
+        return [{"row": int(i) + self.first_row, "message": message} for i, message in bad.items()]
+
+def _missing_columns(df, required):
+    return [c for c in required if c not in df.columns]
+
+def _resolve_symbols(df, lookup, errors):
+    stocks = df["symbol"].str.upper().map(lookup)
+    errors.add(df["symbol"] == "", "Symbol is required")
+    errors.add(stocks.isna(), "Unknown symbol")
+    return stocks
+
+def validate_watchlist(df, lookup, existing=()):
+    """(rows to insert, errors) for a watchlist upload; existing = symbols of the instruments already watched"""
+    missing = _missing_columns(df, WATCHLIST_FIELDS)
+    if missing:
+        raise UploadError(f"Missing column(s): {', '.join(missing)}")
+
+    errors = _Errors(df)
+    stocks = _resolve_symbols(df, lookup, errors)
+    symbols = stocks.map(lambda s: s["symbol"] if isinstance(s, dict) else None)
+    errors.add(symbols.isin(set(existing)), "Already in watchlist")
+    errors.add(symbols.duplicated() & symbols.notna(), "Duplicate symbol in upload")
+
+    valid = errors.valid
+    rows = [(s["symbol"], s["name"], s["price"]) for s in stocks[valid]]
+    return rows, errors.report()
+
+def validate_portfolio(df, lookup, now=None):
+    """(rows to insert, errors) for a portfolio upload (one row per lot)"""
+    missing = _missing_columns(df, PORTFOLIO_FIELDS)
+    if missing:
+        raise UploadError(f"Missing column(s): {', '.join(missing)}")
+
+    errors = _Errors(df)
+    stocks = _resolve_symbols(df, lookup, errors)
+    shares = pd.to_numeric(df["shares"].str.replace(",", ".", regex=False), errors="coerce")
+    prices = pd.to_numeric(df["buy_price"].str.replace(",", ".", regex=False), errors="coerce")
+    errors.add(~(shares > 0) | ~np.isfinite(shares), "shares must be a positive number")
+    errors.add(~(prices > 0) | ~np.isfinite(prices), "buy_price must be a positive number")
+
+    now = now or datetime.now().isoformat()
+    if "buy_date" in df.columns:
+        dates = parse_dates(df["buy_date"])
+        errors.add(dates.isna() & (df["buy_date"] != ""), "buy_date is not a valid date")
+        buy_dates = dates.map(lambda d: d.isoformat() if pd.notna(d) else now)
+    else:
+        buy_dates = pd.Series(now, index=df.index)
+
+    valid = errors.valid
+    rows = [
+        (stock["symbol"], stock["name"], float(n), float(p), date, float(n) * float(p))
+        for stock, n, p, date in zip(stocks[valid], shares[valid], prices[valid], buy_dates[valid])
+    ]
+    return rows, errors.report()
+
+def insert_watchlist(conn, user_id, rows, instrument_ids, placeholder="?"):
+    """Insert validated watchlist rows in one transaction; instrument_ids = {symbol: instruments.id}"""
+    p = placeholder
+    cursor = conn.cursor()
+    # Même clé de doublon que POST /api/watchlist: (user_id, instrument_id)
+    cursor.executemany(
+        "INSERT INTO watchlists (user_id, symbol, instrument_id, name, added_price) "
+        f"SELECT {p}, {p}, {p}, {p}, {p} WHERE NOT EXISTS "
+        f"(SELECT 1 FROM watchlists WHERE user_id = {p} AND instrument_id = {p})",
+        [(user_id, symbol, instrument_ids[symbol], name, price, user_id, instrument_ids[symbol])
+         for symbol, name, price in rows])
+    conn.commit()
+
+def insert_portfolio(conn, user_id, rows, instrument_ids, placeholder="?"):
+    """Insert validated portfolio lots in one transaction; instrument_ids = {symbol: instruments.id}"""
+    p = placeholder
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO portfolios (user_id, symbol, instrument_id, name, shares, buy_price, buy_date, total_investment) "
+        f"VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p}, {p})",
+        [(user_id, symbol, instrument_ids[symbol], *rest) for symbol, *rest in rows])
+    conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bulk portfolio import against one request per lot")
+    parser.add_argument("--rows", type=int, default=500)
+    args = parser.parse_args()
+
+    stocks = [{"symbol": f"SYM{i:03d}", "name": f"Company {i}", "price": 100.0 + i} for i in range(80)]
+    lines = ["symbol,shares,buy_price,buy_date"] + [
+        f"SYM{i % 80:03d},{10 + i % 7},{90 + i % 25}.5,2024-0{1 + i % 9}-15" for i in range(args.rows)]
+    upload = "\n".join(lines)
+
+    # Dates mixtes d'un export Excel français: chaque valeur est lue avec son propre format
+    mixed = read_upload("symbol;shares;buy_price;buy_date\nSYM001;1;10;05/01/2024\nSYM001;1;10;15/01/2024\n"
+                        "SYM001;1;10;2024-02-03\nSYM001;1;10;31/02/2024\nSYM001;1;10;\n", "text/csv")
+    rows, errors = validate_portfolio(mixed, symbol_lookup(stocks), now="now")
+    parsed = [row[4] for row in rows]
+    expected = ["2024-01-05T00:00:00", "2024-01-15T00:00:00", "2024-02-03T00:00:00", "now"]
+    ok = parsed == expected and [e["row"] for e in errors] == [5]
+    print(f"[{'SUCCESS' if ok else 'ERROR'}] Mixed buy_date formats: {parsed}, rejected rows {[e['row'] for e in errors]}")
+    if not ok:
+        raise SystemExit(1)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "import.db")
+        conn = sqlite3.connect(path)
+        conn.execute("""CREATE TABLE portfolios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, symbol TEXT NOT NULL,
+            instrument_id INTEGER, name TEXT, shares REAL NOT NULL, buy_price REAL NOT NULL, buy_date TIMESTAMP, total_investment REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+        conn.commit()
+        conn.close()
+
+        # Référence: une connexion et un commit par lot, comme POST /api/portfolio
+        started = time.perf_counter()
+        for line in lines[1:]:
+            symbol, shares, price, date = line.split(",")
+            conn = sqlite3.connect(path)
+            conn.execute("INSERT INTO portfolios (user_id, symbol, name, shares, buy_price, buy_date, total_investment) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", (1, symbol, symbol, float(shares), float(price), date,
+                                                          float(shares) * float(price)))
+            conn.commit()
+            conn.close()
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        rows, errors = validate_portfolio(read_upload(upload, "text/csv"), symbol_lookup(stocks))
+        conn = sqlite3.connect(path)
+        insert_portfolio(conn, 2, rows, {s["symbol"]: i for i, s in enumerate(stocks, 1)})
+        conn.close()
+        bulk = time.perf_counter() - started
+
+        print(f"[INFO] {args.rows} lots one by one: {single * 1e3:.0f} ms")
+        print(f"[INFO] {len(rows)} lots in one upload ({len(errors)} rejected): {bulk * 1e3:.0f} ms "
+              f"({single / bulk:.0f}x faster)")
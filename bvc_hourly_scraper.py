@@ -1,33 +1,50 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
+# selenium et bs4 sont importés à l'usage: les workers web qui n'ouvrent
+# jamais de navigateur ne paient pas leur coût d'import
 import pandas as pd
 from datetime import datetime
+from bvc_table_parser import extract_market_columns, columns_to_dataframe
 
 BVC_URL = "https://www.casablanca-bourse.com/fr/live-market/marche-actions-groupement"
 
-def fetch_bvc_prices():
+def fetch_page_source(url=BVC_URL, timeout=15):
+    """Load a BVC page in headless Chrome and return the rendered HTML"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     options = Options()
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")
     options.add_argument("--no-sandbox")
     driver = webdriver.Chrome(options=options)
-    driver.get(BVC_URL)
 
     try:
-        # wait until table is present (max 15 seconds)
-        WebDriverWait(driver, 15).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, "table tbody tr"))
-        )
-    except Exception:
-        print("[WARNING] Table not found - maybe page structure changed or needs more wait.")
-    
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    driver.quit()
+        driver.set_page_load_timeout(timeout)
+        driver.get(url)
+
+        try:
+            # wait until table is present (max `timeout` seconds)
+            WebDriverWait(driver, timeout).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, "table tbody tr"))
+            )
+        except Exception:
+            print(f"[WARNING] Table not found on {url} - maybe page structure changed or needs more wait.")
+
+        return driver.page_source
+    finally:
+        driver.quit()
 
+def parse_market_table(html):
+    """Parse the 'marché actions' table into a DataFrame (without Timestamp)"""
+    return columns_to_dataframe(extract_market_columns(html))
+
+def parse_market_table_soup(html):
+    """Reference BeautifulSoup implementation of parse_market_table (used by the benchmark)"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
     rows = soup.select("table tbody tr")
     data = []
 
@@ -83,7 +100,32 @@ def fetch_bvc_prices():
                 "Nombre_Transactions": "N/A"
             })
 
-    df = pd.DataFrame(data)
+    return pd.DataFrame(data)
+
+def parse_generic_table(html):
+    """Parse the first table of a page using its header cells as column names"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.select_one("table")
+    if table is None:
+        return pd.DataFrame()
+
+    headers = [th.text.strip() for th in table.select("thead th")]
+    data = []
+    for row in table.select("tbody tr"):
+        cells = [c.text.strip() for c in row.find_all("td")]
+        if not cells:
+            continue
+        if len(headers) == len(cells):
+            data.append(dict(zip(headers, cells)))
+        else:
+            data.append({f"col_{i}": value for i, value in enumerate(cells)})
+
+    return pd.DataFrame(data)
+
+def fetch_bvc_prices():
+    df = parse_market_table(fetch_page_source(BVC_URL))
     df["Timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     if df.empty:
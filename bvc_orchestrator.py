@@ -0,0 +1,294 @@
+"""
+Orchestrateur de scraping multi-pages pour la Bourse de Casablanca.
+
+Récupère en parallèle un ensemble configurable de pages BVC (actions, indices,
+obligations, carnets d'ordres par instrument) avec un pool de workers borné,
+un timeout et des retries par page, puis fusionne le tout en un seul snapshot
+horodaté.
+
+Usage hors-ligne (pages sauvegardées servies par un serveur HTTP local):
+    python bvc_orchestrator.py --save-html fixtures/bvc          # enregistrer
+    python bvc_orchestrator.py --fixtures fixtures/bvc            # rejouer
+    python bvc_orchestrator.py --check                            # contrôle sur une page générée
+"""
+import argparse
+import functools
+import math
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from datetime import datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from bvc_hourly_scraper import fetch_page_source, parse_market_table, parse_generic_table
+from bvc_table_parser import MARKET_COLUMNS, render_market_html
+
+BVC_BASE_URL = "https://www.casablanca-bourse.com/fr/live-market"
+
+# Pages connues: nom -> chemin relatif à BVC_BASE_URL et parser à utiliser
+BVC_PAGES = {
+    "actions": {"path": "marche-actions-groupement", "parser": "market"},
+    "indices": {"path": "marche-indices", "parser": "generic"},
+    "obligations": {"path": "marche-obligataire", "parser": "generic"},
+}
+
+ORDER_BOOK_PATH = "instruments/{instrument}"
+
+# Page principale: sans elle le snapshot est considéré comme incomplet
+PRIMARY_PAGE = "actions"
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_PAGE_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 1.0
+
+PARSERS = {
+    "market": parse_market_table,
+    "generic": parse_generic_table,
+}
+
+def order_book_pages(instruments):
+    """Build page definitions for per-instrument order-book pages"""
+    return {
+        f"orderbook:{instrument}": {
+            "path": ORDER_BOOK_PATH.format(instrument=instrument),
+            "parser": "generic",
+        }
+        for instrument in instruments
+    }
+
+def resolve_pages(names, instruments=None):
+    """Turn a list of page names (and optional instruments) into page definitions"""
+    pages = {}
+    for name in names:
+        if name not in BVC_PAGES:
+            raise ValueError(f"Unknown BVC page: {name}")
+        pages[name] = BVC_PAGES[name]
+    if instruments:
+        pages.update(order_book_pages(instruments))
+    return pages
+
+# ===== FETCH BACKENDS =====
+
+def fetch_with_selenium(url, timeout):
+    """Fetch a JavaScript-rendered page with headless Chrome"""
+    return fetch_page_source(url, timeout=timeout)
+
+def fetch_with_http(url, timeout):
+    """Fetch a static page over plain HTTP (fixture server, saved pages)"""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        charset = response.headers.get_content_charset() or "utf-8"
+        return response.read().decode(charset)
+
+BACKENDS = {
+    "selenium": fetch_with_selenium,
+    "http": fetch_with_http,
+}
+
+def page_deadline(page_timeout, retries, retry_backoff):
+    """Seconds one page may take: every attempt and backoff, plus a margin"""
+    return (page_timeout + retry_backoff * (retries + 1)) * (retries + 1) + 5
+
+def _fetch_page(name, url, fetcher, timeout, retries, retry_backoff, stop=None):
+    """
+    Fetch one page, retrying with linear backoff; returns (html, attempts, seconds).
+    Once `stop` is set no new attempt is started and the backoff wait is cut short.
+    """
+    stop = stop or threading.Event()
+    started = time.perf_counter()
+    last_error = None
+    for attempt in range(1, retries + 2):
+        if stop.is_set():
+            break
+        try:
+            html = fetcher(url, timeout)
+            return html, attempt, time.perf_counter() - started
+        except Exception as e:
+            last_error = e
+            print(f"[WARNING] {name}: attempt {attempt} failed ({e})")
+            if attempt <= retries:
+                stop.wait(retry_backoff * attempt)
+    raise last_error or TimeoutError(f"{name}: stopped before the first attempt")
+
+def _save_html(directory, path, html):
+    file_path = os.path.join(directory, f"{path}.html")
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(html)
+
+def fetch_market_snapshot(pages=None, base_url=BVC_BASE_URL, backend="selenium",
+                          max_workers=DEFAULT_MAX_WORKERS, page_timeout=DEFAULT_PAGE_TIMEOUT,
+                          retries=DEFAULT_RETRIES, retry_backoff=DEFAULT_RETRY_BACKOFF,
+                          save_html_dir=None):
+    """
+    Fetch several BVC pages concurrently and merge them into one snapshot.
+
+    Returns a dict with the shared snapshot timestamp, one DataFrame per page
+    (each stamped with that timestamp), per-page errors and fetch statistics.
+    """
+    if pages is None:
+        pages = {PRIMARY_PAGE: BVC_PAGES[PRIMARY_PAGE]}
+    fetcher = BACKENDS[backend] if isinstance(backend, str) else backend
+
+    frames, errors, stats = {}, {}, {}
+    started_at = datetime.now()
+
+    # Délai global: chaque vague de `workers` pages a droit à tous ses essais,
+    # sinon les pages encore en file seraient déclarées en timeout sans avoir démarré
+    workers = max(1, min(max_workers, len(pages)))
+    deadline = page_deadline(page_timeout, retries, retry_backoff) * math.ceil(len(pages) / workers)
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bvc-scrape")
+    futures = {
+        pool.submit(_fetch_page, name, f"{base_url.rstrip('/')}/{page['path']}",
+                    fetcher, page_timeout, retries, retry_backoff, stop): name
+        for name, page in pages.items()
+    }
+
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            name = futures[future]
+            page = pages[name]
+            try:
+                html, attempts, seconds = future.result()
+                if save_html_dir:
+                    _save_html(save_html_dir, page["path"], html)
+                frames[name] = PARSERS[page["parser"]](html)
+                stats[name] = {"attempts": attempts, "seconds": round(seconds, 3), "rows": len(frames[name])}
+            except Exception as e:
+                errors[name] = str(e)
+    except FuturesTimeoutError:
+        for future, name in futures.items():
+            if not future.done():
+                errors[name] = f"timed out after {deadline:.0f}s"
+    finally:
+        # Plus de nouvel essai; on attend la fin de l'essai en cours (borné par
+        # page_timeout) pour que chaque navigateur Selenium soit bien fermé
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    # Un seul horodatage pour toutes les pages du snapshot
+    finished_at = datetime.now()
+    timestamp = finished_at.strftime("%Y-%m-%d %H:%M:%S")
+    for df in frames.values():
+        df["Timestamp"] = timestamp
+
+    complete = PRIMARY_PAGE not in pages or (PRIMARY_PAGE in frames and not frames[PRIMARY_PAGE].empty)
+    print(f"[INFO] Snapshot {timestamp}: {len(frames)}/{len(pages)} pages in "
+          f"{(finished_at - started_at).total_seconds():.1f}s, {len(errors)} errors")
+
+    return {
+        "timestamp": timestamp,
+        "started_at": started_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "frames": frames,
+        "errors": errors,
+        "stats": stats,
+        "complete": complete,
+    }
+
+def snapshot_csv_path(name):
+    """CSV file used to persist one page of a snapshot"""
+    if name == PRIMARY_PAGE:
+        return "bvc_prices_latest_new.csv"
+    return f"bvc_{name.replace(':', '_').replace(' ', '_')}_latest.csv"
+
+def save_snapshot(snapshot, names=None):
+    """Write the pages of a snapshot (all of them by default) to their CSV files"""
+    for name, df in snapshot["frames"].items():
+        if names is not None and name not in names:
+            continue
+        if not df.empty:
+            df.to_csv(snapshot_csv_path(name), index=False)
+
+# ===== OFFLINE FIXTURES =====
+
+class FixtureRequestHandler(SimpleHTTPRequestHandler):
+    """Serve saved pages, mapping /<path> to <path>.html"""
+
+    def translate_path(self, path):
+        file_path = super().translate_path(path)
+        if not os.path.exists(file_path) and os.path.exists(file_path + ".html"):
+            return file_path + ".html"
+        return file_path
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_fixtures(directory, host="127.0.0.1", port=0):
+    """Start a local HTTP server for saved pages; returns (server, base_url)"""
+    handler = functools.partial(FixtureRequestHandler, directory=directory)
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def check_fixtures():
+    """Fetch a generated actions page through serve_fixtures and check the parsed table"""
+    rows = [
+        dict(zip(MARKET_COLUMNS, ("ATTIJARIWAFA BANK", "T", "768,30", "770,00", "780,00", "86 343", "67 334 876,80",
+                                  "1,52 %", "784,90", "770,00", "772,00", "781,90", "450", "150",
+                                  "167 810 000 000,00", "148"))),
+        dict(zip(MARKET_COLUMNS, ("COSUMAR", "N.T", "213,00", "-", "-", "0", "0", "0,00 %", "-", "-", "-", "-",
+                                  "0", "0", "20 030 000 000,00", "0"))),
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        _save_html(directory, BVC_PAGES[PRIMARY_PAGE]["path"], render_market_html(rows))
+        server, base_url = serve_fixtures(directory)
+        try:
+            # La page indices n'est pas enregistrée: erreur de page, snapshot quand même complet
+            snapshot = fetch_market_snapshot(resolve_pages([PRIMARY_PAGE, "indices"]), base_url=base_url,
+                                             backend="http", retries=0)
+        finally:
+            server.shutdown()
+
+    df = snapshot["frames"][PRIMARY_PAGE]
+    assert snapshot["complete"], snapshot["errors"]
+    assert list(snapshot["errors"]) == ["indices"], snapshot["errors"]
+    assert list(df["Instrument"]) == ["ATTIJARIWAFA BANK", "COSUMAR"], list(df["Instrument"])
+    for row, expected in zip(df.to_dict("records"), rows):
+        assert all(row[c] == expected[c] for c in MARKET_COLUMNS), row
+    assert (df["Timestamp"] == snapshot["timestamp"]).all()
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch several BVC pages into one snapshot")
+    parser.add_argument("--pages", default=PRIMARY_PAGE, help="Comma-separated page names: " + ", ".join(BVC_PAGES))
+    parser.add_argument("--instruments", default="", help="Comma-separated instruments for order-book pages")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--timeout", type=int, default=DEFAULT_PAGE_TIMEOUT)
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES)
+    parser.add_argument("--fixtures", help="Serve saved pages from this directory instead of the live site")
+    parser.add_argument("--save-html", help="Save fetched pages into this directory for offline replay")
+    parser.add_argument("--check", action="store_true", help="Parse a generated page served locally, then exit")
+    args = parser.parse_args()
+
+    if args.check:
+        print(f"[SUCCESS] Fixture snapshot parsed: {check_fixtures()} rows")
+        raise SystemExit(0)
+
+    pages = resolve_pages([p for p in args.pages.split(",") if p],
+                          [i for i in args.instruments.split(",") if i])
+
+    server = None
+    base_url, backend = BVC_BASE_URL, "selenium"
+    if args.fixtures:
+        server, base_url = serve_fixtures(args.fixtures)
+        backend = "http"
+
+    try:
+        snapshot = fetch_market_snapshot(pages, base_url=base_url, backend=backend,
+                                         max_workers=args.workers, page_timeout=args.timeout,
+                                         retries=args.retries, save_html_dir=args.save_html)
+    finally:
+        if server:
+            server.shutdown()
+
+    save_snapshot(snapshot)
+    for name, df in snapshot["frames"].items():
+        print(f"[SUCCESS] {name}: {len(df)} rows -> {snapshot_csv_path(name)}")
+    for name, error in snapshot["errors"].items():
+        print(f"[ERROR] {name}: {error}")
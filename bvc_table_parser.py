@@ -0,0 +1,203 @@
+"""
+Extraction rapide de la table du marché actions BVC.
+
+Au lieu de construire un arbre BeautifulSoup de toute la page puis un dict par
+ligne, on cible directement les lignes de la table et on remplit des tableaux
+par colonne. lxml est utilisé s'il est installé, sinon un tokenizer HTML en
+streaming (html.parser de la bibliothèque standard).
+
+Benchmark sur des fixtures HTML de taille croissante:
+    python bvc_table_parser.py --sizes 100,1000,5000,20000
+"""
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+from html import escape
+from html.parser import HTMLParser
+
+import pandas as pd
+
+# lxml n'est importé qu'au premier parsing (les workers web n'en ont pas besoin)
+LXML_AVAILABLE = importlib.util.find_spec("lxml") is not None
+
+# Colonnes de la table, dans l'ordre des cellules <td>
+MARKET_COLUMNS = [
+    "Instrument", "Statut", "Cours_Reference", "Ouverture", "Dernier_Cours",
+    "Quantite_Echangee", "Volume", "Variation_Pourcentage", "Plus_Haut_Jour",
+    "Plus_Bas_Jour", "Meilleur_Prix_Achat", "Meilleur_Prix_Vente",
+    "Quantite_Meilleur_Prix_Achat", "Quantite_Meilleur_Prix_Vente",
+    "Capitalisation", "Nombre_Transactions",
+]
+
+# Champs de l'ancien format conservés pour la rétrocompatibilité
+LEGACY_COLUMNS = ["Ticker", "Company", "Last Price"]
+
+OUTPUT_COLUMNS = MARKET_COLUMNS + LEGACY_COLUMNS
+
+FULL_ROW_MIN_CELLS = 15
+LEGACY_ROW_MIN_CELLS = 3
+
+def _iter_rows_lxml(html):
+    import lxml.html
+
+    root = lxml.html.document_fromstring(html)
+    for row in root.iterfind(".//table//tbody/tr"):
+        yield [td.text_content().strip() for td in row.iterchildren("td")]
+
+class _TableRowTokenizer(HTMLParser):
+    """Streaming tokenizer collecting the <td> texts of every <tbody> row"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self._tbody_depth = 0
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tbody":
+            self._tbody_depth += 1
+        elif self._tbody_depth:
+            if tag == "tr":
+                self._row = []
+            elif tag == "td" and self._row is not None:
+                self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag == "td" and self._cell is not None:
+            self._row.append("".join(self._cell).strip())
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+        elif tag == "tbody" and self._tbody_depth:
+            self._tbody_depth -= 1
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+def _iter_rows_stream(html):
+    tokenizer = _TableRowTokenizer()
+    tokenizer.feed(html)
+    tokenizer.close()
+    return tokenizer.rows
+
+def iter_table_rows(html, engine=None):
+    """Yield the stripped <td> texts of every table body row"""
+    engine = engine or ("lxml" if LXML_AVAILABLE else "stream")
+    if engine == "lxml":
+        return _iter_rows_lxml(html)
+    return _iter_rows_stream(html)
+
+def extract_market_columns(html, engine=None):
+    """Extract the market table as a dict of column name -> list of strings"""
+    columns = {name: [] for name in OUTPUT_COLUMNS}
+    appenders = [columns[name].append for name in MARKET_COLUMNS]
+    ticker, company, last_price = (columns[name].append for name in LEGACY_COLUMNS)
+
+    for cells in iter_table_rows(html, engine):
+        n = len(cells)
+        if n >= FULL_ROW_MIN_CELLS:
+            if n == FULL_ROW_MIN_CELLS:
+                cells = cells + ["N/A"]
+            for append, value in zip(appenders, cells):
+                append(value)
+            ticker(cells[0])
+            company(cells[0])  # Utiliser l'instrument comme nom de société
+            last_price(cells[4])  # Dernier cours
+        elif n >= LEGACY_ROW_MIN_CELLS:
+            # Format de secours si la structure de la table change
+            for append in appenders:
+                append("N/A")
+            columns["Instrument"][-1] = cells[0]
+            columns["Dernier_Cours"][-1] = cells[2]
+            ticker(cells[0])
+            company(cells[1])
+            last_price(cells[2])
+
+    return columns
+
+def columns_to_dataframe(columns):
+    """Build a DataFrame from column arrays (empty frame if there are no rows)"""
+    if not columns or not columns[OUTPUT_COLUMNS[0]]:
+        return pd.DataFrame()
+    return pd.DataFrame(columns, columns=OUTPUT_COLUMNS)
+
+def render_market_html(rows, columns=MARKET_COLUMNS):
+    """Render market rows (list of dicts) as a BVC-like page, for fixtures"""
+    header = "".join(f"<th>{escape(c)}</th>" for c in columns)
+    body = "".join(
+        "<tr>" + "".join(f"<td><span> {escape(str(row.get(c, '')))} </span></td>" for c in columns) + "</tr>"
+        for row in rows
+    )
+    return (
+        "<!DOCTYPE html><html><head><title>Marché actions - Bourse de Casablanca</title>"
+        "<script>window.__state = {};</script></head><body>"
+        "<nav><ul><li><a href='/fr'>Accueil</a></li><li><a href='/fr/live-market'>Live market</a></li></ul></nav>"
+        f"<main><table class='market'><thead><tr>{header}</tr></thead><tbody>{body}</tbody></table></main>"
+        "<footer><p>Bourse de Casablanca</p></footer></body></html>"
+    )
+
+def build_fixtures(csv_path, sizes, directory):
+    """Write HTML fixtures of increasing row counts by cycling the rows of a saved CSV"""
+    base = pd.read_csv(csv_path, keep_default_na=False).to_dict("records")
+    paths = {}
+    for size in sizes:
+        rows = [dict(base[i % len(base)]) for i in range(size)]
+        for i, row in enumerate(rows):
+            if i >= len(base):
+                row["Instrument"] = f"{row['Instrument']} #{i // len(base)}"
+        path = os.path.join(directory, f"marche-actions-{size}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(render_market_html(rows))
+        paths[size] = path
+    return paths
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def run_benchmark(csv_path, sizes, repeat=3, directory=None):
+    """Compare BeautifulSoup row dicts against column extraction on each fixture"""
+    from bvc_hourly_scraper import parse_market_table_soup
+
+    directory = directory or tempfile.mkdtemp(prefix="bvc_fixtures_")
+    fixtures = build_fixtures(csv_path, sizes, directory)
+    engines = (["lxml"] if LXML_AVAILABLE else []) + ["stream"]
+
+    print(f"{'rows':>8} {'size':>9} {'soup':>10} " + " ".join(f"{e:>10}" for e in engines) + "  speedup")
+    for size, path in fixtures.items():
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+
+        expected = parse_market_table_soup(html)
+        for engine in engines:
+            got = columns_to_dataframe(extract_market_columns(html, engine))
+            if not got[expected.columns].equals(expected):
+                raise AssertionError(f"{engine} extraction differs from BeautifulSoup on {size} rows")
+
+        soup_time = _best_of(lambda: parse_market_table_soup(html), repeat)
+        times = [_best_of(lambda: columns_to_dataframe(extract_market_columns(html, e)), repeat) for e in engines]
+        print(f"{size:>8} {len(html) / 1024:>7.0f}KB {soup_time * 1000:>8.1f}ms "
+              + " ".join(f"{t * 1000:>8.1f}ms" for t in times)
+              + f"  x{soup_time / min(times):.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark BVC market table extraction")
+    parser.add_argument("--csv", default="bvc_prices_latest_new.csv", help="Saved snapshot used to build fixtures")
+    parser.add_argument("--sizes", default="100,1000,5000,20000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fixtures-dir", help="Keep generated fixtures in this directory")
+    args = parser.parse_args()
+
+    if args.fixtures_dir:
+        os.makedirs(args.fixtures_dir, exist_ok=True)
+    run_benchmark(args.csv, [int(s) for s in args.sizes.split(",")], args.repeat, args.fixtures_dir)
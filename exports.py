@@ -0,0 +1,201 @@
+"""
+Exports CSV / NDJSON en streaming, à mémoire constante.
+
+Les lignes sont lues par paquets (curseur nommé côté serveur sous
+PostgreSQL, fetchmany sous SQLite) et chaque paquet est sérialisé puis
+envoyé aussitôt: la mémoire du worker ne dépend pas du nombre de lignes.
+
+Benchmark (base SQLite temporaire):
+    python exports.py --rows 2000000
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows: pas de RSS dans les benchmarks
+    resource = None
+
+FETCH_SIZE = 2000
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+MAX_EXPORT_SYMBOLS = 200
+
+PORTFOLIO_COLUMNS = ["id", "symbol", "name", "shares", "buy_price", "buy_date", "total_investment"]
+ALERT_COLUMNS = ["id", "symbol", "name", "target_price", "condition", "triggered", "created_date", "triggered_date"]
+HISTORY_COLUMNS = ["snapshot_time", "symbol", "price", "change", "volume", "market_cap"]
+
+def _is_postgres(conn):
+    return type(conn).__module__.startswith("psycopg2")
+
+def placeholder_for(conn):
+    return "%s" if _is_postgres(conn) else "?"
+
+class BatchReader:
+    """
+    Row tuples of a query, fetch_size at a time; owns the connection.
+
+    The query runs and the first batch is read in the constructor, so a
+    failing query raises before any response is sent. PostgreSQL uses a
+    named (server-side) cursor so the result set stays in the database;
+    SQLite already steps through results lazily. close() is idempotent and
+    also called once iteration ends.
+    """
+
+    def __init__(self, conn, query, params=(), fetch_size=FETCH_SIZE):
+        self.conn = conn
+        self.fetch_size = fetch_size
+        try:
+            if _is_postgres(conn):
+                import psycopg2.extensions
+                self.cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=psycopg2.extensions.cursor)
+                self.cursor.itersize = fetch_size
+            else:
+                self.cursor = conn.cursor()
+                self.cursor.row_factory = None  # tuples plutôt que sqlite3.Row
+            self.cursor.execute(query, params)
+            self.first = self.cursor.fetchmany(fetch_size)
+        except Exception:
+            self.close()
+            raise
+
+    def __iter__(self):
+        try:
+            batch = self.first
+            self.first = None
+            while batch:
+                yield batch
+                batch = self.cursor.fetchmany(self.fetch_size)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            conn.close()
+
+def iter_batches(conn, query, params=(), fetch_size=FETCH_SIZE):
+    """Run the query now and return a BatchReader over its rows"""
+    return BatchReader(conn, query, params, fetch_size)
+
+def stream_csv(columns, batches):
+    """CSV chunks: header, then one chunk per batch of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+def stream_ndjson(columns, batches):
+    """NDJSON chunks: one JSON object per line, one chunk per batch of rows"""
+    for batch in batches:
+        yield "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + "\n" for row in batch)
+
+def stream_rows(fmt, columns, batches):
+    return stream_csv(columns, batches) if fmt == "csv" else stream_ndjson(columns, batches)
+
+def portfolio_query(conn, user_id):
+    p = placeholder_for(conn)
+    return (f"SELECT {', '.join(PORTFOLIO_COLUMNS)} FROM portfolios "
+            f"WHERE user_id = {p} ORDER BY created_at DESC", (user_id,))
+
+def alerts_query(conn, user_id):
+    p = placeholder_for(conn)
+    return (f"SELECT {', '.join(ALERT_COLUMNS)} FROM price_alerts "
+            f"WHERE user_id = {p} ORDER BY created_date DESC", (user_id,))
+
+def history_query(conn, symbols=None, start=None, end=None):
+    """Price history grouped by instrument, in time order, served by idx_history_instrument_time"""
+    p = placeholder_for(conn)
+    clauses, params = [], []
+    if symbols:
+        clauses.append(f"instrument_id IN (SELECT id FROM instruments WHERE symbol IN ({', '.join([p] * len(symbols))}))")
+        params.extend(symbols)
+    if start:
+        clauses.append(f"snapshot_time >= {p}")
+        params.append(start)
+    if end:
+        clauses.append(f"snapshot_time <= {p}")
+        params.append(end)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return (f"SELECT {', '.join(HISTORY_COLUMNS)} FROM price_history{where} "
+            f"ORDER BY instrument_id, snapshot_time", tuple(params))
+
+# ===== BENCHMARK =====
+
+def _rss_mb():
+    if resource is None:
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _build_history_db(path, rows, symbols=80):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE instruments (id INTEGER PRIMARY KEY, symbol TEXT NOT NULL UNIQUE)")
+    conn.executemany("INSERT INTO instruments (id, symbol) VALUES (?, ?)",
+                     [(s + 1, f"SYM{s:03d}") for s in range(symbols)])
+    conn.execute("""CREATE TABLE price_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, symbol TEXT NOT NULL, instrument_id INTEGER, price REAL, change REAL,
+        volume INTEGER, market_cap REAL, snapshot_time TIMESTAMP NOT NULL)""")
+    start = datetime(2025, 1, 1, 9, 30)
+
+    def generate():
+        for i in range(rows):
+            step, s = divmod(i, symbols)
+            yield (f"SYM{s:03d}", s + 1, 100 + (i % 997) / 10, (i % 21) - 10.0, i % 5000, 1e9 + i,
+                   (start + timedelta(minutes=5 * step)).strftime("%Y-%m-%d %H:%M:%S"))
+
+    conn.executemany("INSERT INTO price_history (symbol, instrument_id, price, change, volume, market_cap, snapshot_time) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)", generate())
+    conn.execute("CREATE INDEX idx_history_instrument_time ON price_history (instrument_id, snapshot_time)")
+    conn.commit()
+    conn.close()
+
+def run_benchmark(rows, fmt):
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "history.db")
+        started = time.perf_counter()
+        _build_history_db(path, rows)
+        print(f"[INFO] Built {rows} history rows in {time.perf_counter() - started:.1f}s (RSS {_rss_mb():.0f} MB)")
+
+        conn = sqlite3.connect(path)
+        query, params = history_query(conn)
+        started = time.perf_counter()
+        size = 0
+        for chunk in stream_rows(fmt, HISTORY_COLUMNS, iter_batches(conn, query, params)):
+            size += len(chunk)
+        elapsed = time.perf_counter() - started
+        print(f"[INFO] Streamed {fmt}: {size / 1e6:.0f} MB in {elapsed:.1f}s "
+              f"({rows / elapsed / 1e3:.0f}k rows/s), peak RSS {_rss_mb():.0f} MB")
+
+        # Référence: l'approche des routes actuelles (tout en mémoire avant de répondre)
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        started = time.perf_counter()
+        cursor = conn.execute(query, params)
+        materialized = [dict(row) for row in cursor.fetchall()]
+        body = json.dumps(materialized)
+        conn.close()
+        print(f"[INFO] fetchall + list of dicts: {len(body) / 1e6:.0f} MB in {time.perf_counter() - started:.1f}s, "
+              f"peak RSS {_rss_mb():.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark streaming exports of price history")
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    args = parser.parse_args()
+    run_benchmark(args.rows, args.format)
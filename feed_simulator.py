@@ -0,0 +1,304 @@
+"""
+Simulateur de flux BVC pour les tests de bout en bout.
+
+Génère des snapshots réalistes de la page marché actions: mêmes colonnes et
+même format de nombres français que bvc_prices_latest_new.csv ("2 449,00",
+"5 343", "-0,04 %"), cours en marche aléatoire autour des cours réels du
+CSV, taille de l'univers et cadence des ticks configurables. Les lignes non
+cotées (N.T, S) restent figées.
+
+Le simulateur se branche sur l'orchestrateur comme backend (MarketSimulator.fetch)
+ou sert la page en HTTP (serve_feed), à la place du site:
+    python feed_simulator.py --serve --rate 10 --port 8765
+    BVC_SCRAPE_BACKEND=http BVC_BASE_URL=http://127.0.0.1:8765 python app.py
+
+Mesure de latence de bout en bout sur une instance locale (tick -> /api/stocks
+à jour, tick -> alerte déclenchée), ingestion par POST /api/refresh:
+    python feed_simulator.py --latency --rates 1,10,100 --duration 20
+"""
+import argparse
+import functools
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from bvc_orchestrator import BVC_PAGES, PRIMARY_PAGE
+from bvc_table_parser import MARKET_COLUMNS, render_market_html
+
+SEED_CSV = "bvc_prices_latest_new.csv"
+TRADED = "T"
+DEFAULT_VOLATILITY = 0.002
+DEFAULT_MOVING = 0.3
+# Ticks récents gardés pour la mesure de latence (40 s à 100 ticks/s)
+TICK_HISTORY = 4096
+
+def french_number(value, decimals=2):
+    """1234.5 -> '1 234,50' (format of the BVC page)"""
+    if value is None or not np.isfinite(value):
+        return "-"
+    return f"{value:,.{decimals}f}".replace(",", " ").replace(".", ",")
+
+def parse_french_number(text):
+    text = str(text).replace(" ", "").replace("%", "").replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+class MarketSimulator:
+    """Random-walk BVC market seeded from a saved snapshot"""
+
+    def __init__(self, size=None, csv_path=SEED_CSV, volatility=DEFAULT_VOLATILITY, moving=DEFAULT_MOVING, seed=1,
+                 history=TICK_HISTORY):
+        base = pd.read_csv(csv_path, keep_default_na=False, dtype=str).to_dict("records")
+        size = size or len(base)
+        rows = [dict(base[i % len(base)]) for i in range(size)]
+        for i, row in enumerate(rows):
+            if i >= len(base):
+                row["Instrument"] = f"{row['Instrument']} #{i // len(base)}"
+
+        def column(name):
+            return np.array([parse_french_number(r.get(name, "")) for r in rows])
+
+        self.instruments = [r["Instrument"].strip() for r in rows]
+        self.status = [r.get("Statut", TRADED) for r in rows]
+        self.traded = np.array([s == TRADED for s in self.status])
+        self.reference = column("Cours_Reference")
+        self.last = np.where(np.isfinite(column("Dernier_Cours")), column("Dernier_Cours"), self.reference)
+        self.open = np.where(np.isfinite(column("Ouverture")), column("Ouverture"), self.last)
+        self.high = np.fmax(column("Plus_Haut_Jour"), self.last)
+        self.low = np.fmin(column("Plus_Bas_Jour"), self.last)
+        self.quantity = np.nan_to_num(column("Quantite_Echangee"))
+        self.value = np.nan_to_num(column("Volume"))
+        self.trades = np.nan_to_num(column("Nombre_Transactions"))
+        self.bid_size = np.nan_to_num(column("Quantite_Meilleur_Prix_Achat"), nan=1)
+        self.ask_size = np.nan_to_num(column("Quantite_Meilleur_Prix_Vente"), nan=1)
+        self.shares = column("Capitalisation") / self.last
+        self.volatility = volatility
+        self.moving = moving
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.history = history
+        # sequence -> (perf_counter, quantité du témoin), pour les `history` derniers ticks
+        self.tick_times = {}
+        # Instrument témoin: bouge et traite à chaque tick, sa quantité cumulée identifie le tick
+        self.probe = int(np.argmax(self.traded)) if self.traded.any() else 0
+        self.probe_ticks = {}
+
+    def __len__(self):
+        return len(self.instruments)
+
+    @property
+    def probe_symbol(self):
+        return self.instruments[self.probe]
+
+    def tick(self):
+        """Move a random subset of the traded instruments; returns the tick sequence number"""
+        with self.lock:
+            moving = self.traded & (self.rng.random(len(self)) < self.moving)
+            moving[self.probe] = True
+            n = int(moving.sum())
+            steps = np.exp(self.volatility * self.rng.standard_normal(n))
+            prices = np.round(self.last[moving] * steps, 2)
+            # Le témoin change toujours de cours, même quand l'arrondi l'annule
+            probe = np.flatnonzero(moving).searchsorted(self.probe)
+            if prices[probe] == self.last[self.probe]:
+                prices[probe] += 0.01
+            quantities = self.rng.integers(1, 500, n)
+
+            self.last[moving] = prices
+            self.high[moving] = np.fmax(self.high[moving], prices)
+            self.low[moving] = np.fmin(self.low[moving], prices)
+            self.quantity[moving] += quantities
+            self.value[moving] += quantities * prices
+            self.trades[moving] += self.rng.integers(1, 4, n)
+            self.bid_size[moving] = self.rng.integers(1, 1000, n)
+            self.ask_size[moving] = self.rng.integers(1, 1000, n)
+            self.sequence += 1
+            quantity = int(self.quantity[self.probe])
+            self.tick_times[self.sequence] = (time.perf_counter(), quantity)
+            self.probe_ticks[quantity] = self.sequence
+            expired = self.tick_times.pop(self.sequence - self.history, None)
+            if expired is not None:
+                del self.probe_ticks[expired[1]]
+            return self.sequence
+
+    def tick_time(self, sequence):
+        """perf_counter() of a recent tick, or None once it left the history"""
+        entry = self.tick_times.get(sequence)
+        return entry[0] if entry else None
+
+    def rows(self):
+        """Current snapshot as rows of formatted strings, in MARKET_COLUMNS"""
+        with self.lock:
+            change = (self.last / self.reference - 1) * 100
+            spread = np.maximum(np.round(self.last * 0.001, 2), 0.01)
+            cap = self.shares * self.last
+            return [
+                dict(zip(MARKET_COLUMNS, (
+                    self.instruments[i], self.status[i], french_number(self.reference[i]), french_number(self.open[i]),
+                    french_number(self.last[i]), french_number(self.quantity[i], 0), french_number(self.value[i]),
+                    f"{french_number(change[i])} %", french_number(self.high[i]), french_number(self.low[i]),
+                    french_number(self.last[i] - spread[i]), french_number(self.last[i] + spread[i]),
+                    french_number(self.bid_size[i], 0), french_number(self.ask_size[i], 0),
+                    french_number(cap[i]), french_number(self.trades[i], 0),
+                )))
+                for i in range(len(self))
+            ]
+
+    def html(self):
+        return render_market_html(self.rows())
+
+    def fetch(self, url, timeout):
+        """Scraper backend (see bvc_orchestrator.BACKENDS): the current page, whatever the URL"""
+        return self.html()
+
+    def run(self, rate, stop):
+        """Tick `rate` times per second until `stop` is set"""
+        interval = 1.0 / rate
+        deadline = time.perf_counter()
+        while not stop.is_set():
+            self.tick()
+            deadline += interval
+            stop.wait(max(0.0, deadline - time.perf_counter()))
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    """Serve the simulated market page at the path of the BVC actions page"""
+
+    def __init__(self, simulator, *args, **kwargs):
+        self.simulator = simulator
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if self.path.rstrip("/").split("?")[0] != "/" + BVC_PAGES[PRIMARY_PAGE]["path"]:
+            self.send_error(404)
+            return
+        body = self.simulator.html().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_feed(simulator, host="127.0.0.1", port=0):
+    """Start a local HTTP server for the simulated page; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), functools.partial(FeedRequestHandler, simulator))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+# ===== LATENCE DE BOUT EN BOUT =====
+
+def _percentiles(values):
+    if not values:
+        return "no samples"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1e3
+    return f"p50 {pick(0.5):6.1f} ms  p95 {pick(0.95):6.1f} ms  max {values[-1] * 1e3:6.1f} ms  (n={len(values)})"
+
+def measure_latency(base_url, simulator, rate, duration, poll_interval=0.005):
+    """
+    Tick the simulator at `rate` while one client ingests (POST /api/refresh in
+    a loop) and another polls /api/stocks and the probe's alerts.
+    Returns (stock latencies, alert latencies, ticks generated, ticks seen).
+    """
+    from loadtest import Stats, VirtualUser
+
+    reader = VirtualUser(base_url, f"feed_{rate:g}", "stocks", Stats())
+    reader.login([simulator.probe_symbol])
+    ingest = VirtualUser(base_url, "ingest", "stocks", Stats())
+    probe = simulator.probe_symbol
+
+    stop = threading.Event()
+
+    def ingest_loop():
+        while not stop.is_set():
+            ingest.call("POST", "/api/refresh", record=False)
+
+    threads = [threading.Thread(target=simulator.run, args=(rate, stop), daemon=True),
+               threading.Thread(target=ingest_loop, daemon=True)]
+    for t in threads:
+        t.start()
+
+    stock_latencies, alert_latencies, seen = [], [], set()
+    alert = None  # séquence du dernier tick à la création de l'alerte en cours
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        status, body = reader.call("GET", "/api/stocks", record=False)
+        now = time.perf_counter()
+        if status == 200:
+            stock = next((s for s in json.loads(body)["stocks"] if s["symbol"] == probe), None)
+            sequence = simulator.probe_ticks.get(stock["volume"]) if stock else None
+            ticked = simulator.tick_time(sequence)
+            if ticked is not None and sequence not in seen:
+                seen.add(sequence)
+                stock_latencies.append(now - ticked)
+
+        # Une alerte à la fois sur le témoin, déclenchée par le premier tick qui suit sa création
+        # (échantillon ignoré si un scrape en cours l'a déclenchée avant ce tick)
+        if alert is None:
+            reader.call("POST", "/api/alerts", record=False,
+                        payload={"symbol": probe, "name": probe, "target_price": 0.01, "condition": "above"})
+            alert = simulator.sequence
+        else:
+            status, body = reader.call("GET", "/api/alerts", record=False)
+            if status == 200 and all(a["triggered"] for a in json.loads(body)["alerts"]):
+                triggered_by = simulator.tick_time(alert + 1)
+                if triggered_by is not None:
+                    alert_latencies.append(now - triggered_by)
+                alert = None
+        time.sleep(poll_interval)
+
+    stop.set()
+    for t in threads:
+        t.join(timeout=30)
+    return stock_latencies, alert_latencies, simulator.sequence, len(seen)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated BVC market feed")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--serve", action="store_true", help="Serve the simulated page over HTTP")
+    mode.add_argument("--latency", action="store_true", help="Measure tick -> visible latency on a local instance")
+    parser.add_argument("--size", type=int, default=None, help="Number of instruments (default: the seed CSV)")
+    parser.add_argument("--rate", type=float, default=1, help="With --serve: ticks per second")
+    parser.add_argument("--rates", default="1,10,100", help="With --latency: comma-separated tick rates")
+    parser.add_argument("--duration", type=float, default=20, help="With --latency: seconds per rate")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.serve:
+        simulator = MarketSimulator(args.size, seed=args.seed)
+        server, base_url = serve_feed(simulator, port=args.port)
+        print(f"[INFO] {len(simulator)} instruments at {args.rate} ticks/s on {base_url}/{BVC_PAGES[PRIMARY_PAGE]['path']}")
+        stop = threading.Event()
+        try:
+            simulator.run(args.rate, stop)
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        from loadtest import spawn_instance
+
+        for rate in [float(r) for r in args.rates.split(",") if r]:
+            simulator = MarketSimulator(args.size, seed=args.seed)
+            server, feed_url = serve_feed(simulator, port=0)
+            with tempfile.TemporaryDirectory() as scratch:
+                process, base_url = spawn_instance(scratch, 1, env={
+                    "BVC_SCRAPE_BACKEND": "http", "BVC_BASE_URL": feed_url, "ADMISSION_CONTROL": "false"})
+                try:
+                    stocks, alerts, ticks, seen = measure_latency(base_url, simulator, rate, args.duration)
+                finally:
+                    process.terminate()
+                    process.wait()
+                    server.shutdown()
+            print(f"[INFO] {rate:g} ticks/s, {len(simulator)} instruments: {seen}/{ticks} ticks visible")
+            print(f"[INFO]   tick -> /api/stocks : {_percentiles(stocks)}")
+            print(f"[INFO]   tick -> alert       : {_percentiles(alerts)}")
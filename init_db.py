@@ -1,6 +1,8 @@
 import os
 from datetime import datetime
 import hashlib
+from migrations import apply_migrations
+from request_profiler import TimedSQLiteConnection, timed_cursor_class
 
 # Check if running in production (Render)
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -11,9 +13,12 @@ if IS_PRODUCTION:
     import psycopg2
     from psycopg2.extras import RealDictCursor
 
+    # Curseurs chronométrés: temps base de données du journal des requêtes lentes
+    TimedRealDictCursor = timed_cursor_class(RealDictCursor)
+
     def get_db_connection():
         """Create a PostgreSQL database connection"""
-        conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+        conn = psycopg2.connect(DATABASE_URL, cursor_factory=TimedRealDictCursor)
         return conn
 else:
     # SQLite for local development
@@ -22,7 +27,7 @@ else:
 
     def get_db_connection():
         """Create a SQLite database connection"""
-        conn = sqlite3.connect(DATABASE_PATH)
+        conn = sqlite3.connect(DATABASE_PATH, factory=TimedSQLiteConnection)
         conn.row_factory = sqlite3.Row
         return conn
 
@@ -125,6 +130,21 @@ def init_database():
                 FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
             )
         ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_history (
+                id SERIAL PRIMARY KEY,
+                symbol TEXT NOT NULL,
+                price REAL,
+                change REAL,
+                volume INTEGER,
+                market_cap REAL,
+                statut TEXT,
+                prix_achat REAL,
+                prix_vente REAL,
+                snapshot_time TIMESTAMP NOT NULL
+            )
+        ''')
     else:
         # SQLite syntax
         cursor.execute('''
@@ -216,17 +236,33 @@ def init_database():
             )
         ''')
 
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                symbol TEXT NOT NULL,
+                price REAL,
+                change REAL,
+                volume INTEGER,
+                market_cap REAL,
+                statut TEXT,
+                prix_achat REAL,
+                prix_vente REAL,
+                snapshot_time TIMESTAMP NOT NULL
+            )
+        ''')
+
     # Create indexes for better performance
     try:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_stocks_symbol ON stocks(symbol)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_watchlists_user ON watchlists(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_portfolios_user ON portfolios(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_alerts_user ON price_alerts(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(session_token)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_symbol_time ON price_history(symbol, snapshot_time)')
     except Exception as e:
         print(f"[WARNING] Could not create some indexes: {e}")
 
     conn.commit()
+
+    # Index composites/partiels et évolutions du schéma (voir migrations.py)
+    apply_migrations(conn, 'postgres' if IS_PRODUCTION else 'sqlite')
     conn.close()
 
     db_type = "PostgreSQL" if IS_PRODUCTION else "SQLite"
@@ -0,0 +1,177 @@
+"""
+Dimension des instruments: identifiants entiers et symboles internés.
+
+La table instruments (migration 6) attribue un id entier à chaque symbole;
+stocks, watchlists, portfolios, price_alerts et price_history portent un
+instrument_id indexé à côté de leur colonne symbol. En mémoire, le
+registre garde le dictionnaire symbole <-> id et interne les chaînes: le
+cache des actions, les index de recherche et les moteurs partagent un seul
+objet par symbole au lieu d'une copie par champ et par snapshot.
+
+Benchmark (base SQLite temporaire; taille des index, jointures, RSS):
+    python instruments.py --history 500000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows: pas de RSS dans les benchmarks
+    resource = None
+
+import numpy as np
+
+SYMBOLS_PER_QUERY = 500
+
+def _is_postgres(conn):
+    return type(conn).__module__.startswith("psycopg2")
+
+def _row(row):
+    return dict(row) if hasattr(row, "keys") else {"id": row[0], "symbol": row[1]}
+
+class InstrumentRegistry:
+    """Interned symbol <-> integer id dictionary backed by the instruments table"""
+
+    def __init__(self):
+        self.ids = {}
+        self.symbols = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, symbol):
+        """The shared string object for this symbol"""
+        return sys.intern(symbol)
+
+    def _remember(self, rows):
+        with self.lock:
+            for row in map(_row, rows):
+                symbol = sys.intern(row["symbol"])
+                self.ids[symbol] = row["id"]
+                self.symbols[row["id"]] = symbol
+
+    def load(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, symbol FROM instruments")
+        self._remember(cursor.fetchall())
+        return self
+
+    def ensure(self, conn, items):
+        """
+        {symbol: id} for (symbol, name) pairs, creating the missing instruments.
+        Known symbols are answered from memory without touching the database.
+        """
+        items = {symbol: name for symbol, name in items if symbol}
+        missing = [s for s in items if s not in self.ids]
+        if missing:
+            postgres = _is_postgres(conn)
+            p = "%s" if postgres else "?"
+            cursor = conn.cursor()
+            insert = (f"INSERT INTO instruments (symbol, name) VALUES ({p}, {p}) ON CONFLICT (symbol) DO NOTHING"
+                      if postgres else "INSERT OR IGNORE INTO instruments (symbol, name) VALUES (?, ?)")
+            cursor.executemany(insert, [(s, items[s] or s) for s in missing])
+            for start in range(0, len(missing), SYMBOLS_PER_QUERY):
+                chunk = missing[start:start + SYMBOLS_PER_QUERY]
+                cursor.execute(f"SELECT id, symbol FROM instruments WHERE symbol IN ({', '.join([p] * len(chunk))})", chunk)
+                self._remember(cursor.fetchall())
+            conn.commit()
+        return {symbol: self.ids[symbol] for symbol in items if symbol in self.ids}
+
+    def id_for(self, conn, symbol, name=None):
+        if symbol in self.ids:
+            return self.ids[symbol]
+        return self.ensure(conn, [(symbol, name)]).get(symbol)
+
+    def symbol_for(self, instrument_id):
+        return self.symbols.get(instrument_id)
+
+    def array(self, symbols):
+        """int64 ids aligned with symbols (-1 when unknown), to index snapshot arrays by id"""
+        return np.fromiter((self.ids.get(s, -1) for s in symbols), dtype=np.int64, count=len(symbols))
+
+# ===== BENCHMARK =====
+
+def _rss_mb():
+    if resource is None:
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _index_bytes(conn, create):
+    """Size in bytes of the index built by `create` (growth of the database file)"""
+    before = conn.execute("PRAGMA page_count").fetchone()[0]
+    conn.execute(create)
+    conn.commit()
+    after = conn.execute("PRAGMA page_count").fetchone()[0]
+    return (after - before) * conn.execute("PRAGMA page_size").fetchone()[0]
+
+def _timed(conn, query, params=(), repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(query, params).fetchall()
+    return (time.perf_counter() - started) / repeat * 1e3
+
+def run_benchmark(history_rows, holdings):
+    names = [f"SOCIETE {i:03d} DES PARTICIPATIONS ET INVESTISSEMENTS DU MAROC" for i in range(80)]
+    with tempfile.TemporaryDirectory() as scratch:
+        conn = sqlite3.connect(os.path.join(scratch, "instruments.db"))
+        conn.executescript("""
+            CREATE TABLE instruments (id INTEGER PRIMARY KEY AUTOINCREMENT, symbol TEXT UNIQUE NOT NULL, name TEXT);
+            CREATE TABLE stocks (symbol TEXT UNIQUE NOT NULL, instrument_id INTEGER, price REAL);
+            CREATE TABLE portfolios (user_id INTEGER, symbol TEXT, instrument_id INTEGER, shares REAL);
+            CREATE TABLE price_history (symbol TEXT, instrument_id INTEGER, price REAL, snapshot_time TIMESTAMP);
+        """)
+        conn.executemany("INSERT INTO instruments (symbol, name) VALUES (?, ?)", [(n, n) for n in names])
+        conn.executemany("INSERT INTO stocks VALUES (?, ?, ?)", [(n, i + 1, 100.0 + i) for i, n in enumerate(names)])
+        conn.executemany("INSERT INTO portfolios VALUES (?, ?, ?, ?)",
+                         [(i % 1000, names[i % 80], i % 80 + 1, 10.0) for i in range(holdings)])
+        conn.executemany("INSERT INTO price_history VALUES (?, ?, ?, ?)",
+                         [(names[i % 80], i % 80 + 1, 100.0, f"2025-01-01 {i // 80:09d}") for i in range(history_rows)])
+        conn.commit()
+
+        text_index = _index_bytes(conn, "CREATE INDEX h_text ON price_history(symbol, snapshot_time)")
+        int_index = _index_bytes(conn, "CREATE INDEX h_int ON price_history(instrument_id, snapshot_time)")
+        print(f"[INFO] price_history index ({history_rows} rows): symbol {text_index / 1e6:.1f} MB, "
+              f"instrument_id {int_index / 1e6:.1f} MB")
+        conn.execute("CREATE INDEX p_text ON portfolios(user_id, symbol)")
+        conn.execute("CREATE INDEX p_int ON portfolios(user_id, instrument_id)")
+        conn.execute("CREATE UNIQUE INDEX s_int ON stocks(instrument_id)")
+        conn.execute("ANALYZE")
+
+        text_join = _timed(conn, "SELECT p.user_id, SUM(p.shares * s.price) FROM portfolios p "
+                                 "JOIN stocks s ON s.symbol = p.symbol GROUP BY p.user_id")
+        int_join = _timed(conn, "SELECT p.user_id, SUM(p.shares * s.price) FROM portfolios p "
+                                "JOIN stocks s ON s.instrument_id = p.instrument_id GROUP BY p.user_id")
+        print(f"[INFO] Portfolio valuation join ({holdings} holdings): symbol {text_join:.1f} ms, "
+              f"instrument_id {int_join:.1f} ms")
+        text_range = _timed(conn, "SELECT snapshot_time, price FROM price_history WHERE symbol = ? ORDER BY snapshot_time",
+                            (names[7],))
+        int_range = _timed(conn, "SELECT snapshot_time, price FROM price_history WHERE instrument_id = ? ORDER BY snapshot_time",
+                           (8,))
+        print(f"[INFO] One symbol's history: symbol {text_range:.1f} ms, instrument_id {int_range:.1f} ms")
+        conn.close()
+
+    # Cache des actions: chaînes recréées à chaque snapshot contre chaînes internées
+    registry = InstrumentRegistry()
+    for label, make in (("string copies", "".join), ("interned", lambda n: registry.intern("".join(n)))):
+        tracemalloc.start()
+        cache = [[{"symbol": make(n), "name": make(n), "details": {"symbol": make(n), "name": make(n)}}
+                  for n in names] for _ in range(200)]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"[INFO] 200 cached snapshots of 80 stocks, {label}: {size / 1e6:.1f} MB")
+        del cache
+    print(f"[INFO] Peak RSS {_rss_mb():.0f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare text symbols with integer instrument ids")
+    parser.add_argument("--history", type=int, default=500000)
+    parser.add_argument("--holdings", type=int, default=50000)
+    args = parser.parse_args()
+    run_benchmark(args.history, args.holdings)
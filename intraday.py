@@ -0,0 +1,202 @@
+"""
+Tampon circulaire des snapshots de la séance, en mémoire du worker.
+
+Les champs (prix, volume, meilleurs prix d'achat et de vente) sont stockés
+dans un tableau float64 préalloué [champ, tick, symbole]: ajouter un tick
+copie une ligne de N valeurs par champ, sans allocation, et la mémoire est
+fixée au démarrage (champs × ticks × symboles × 8 octets). Quand le tampon
+est plein, les ticks les plus anciens sont écrasés; il est vidé au
+changement de jour.
+
+Les graphiques intraday, les variations sur N minutes et les indicateurs
+se lisent directement dans ces tableaux, sans passer par le disque.
+
+Benchmark:
+    python intraday.py --symbols 80 --ticks 1024
+"""
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from snapshot_changes import load_history_frames
+
+FIELDS = ("price", "volume", "bid", "ask")
+MAX_SYMBOLS = int(os.getenv("INTRADAY_MAX_SYMBOLS", "128"))
+TICKS_PER_DAY = int(os.getenv("INTRADAY_TICKS", "1024"))
+
+def _epoch(timestamp):
+    return int(pd.Timestamp(timestamp).timestamp())
+
+def _day(epoch):
+    return epoch // 86400
+
+def json_values(values, digits=4):
+    """Floats for JSON, None for missing values"""
+    return [round(float(v), digits) if np.isfinite(v) else None for v in values]
+
+class IntradayBuffer:
+    """Fixed-size ring of the day's ticks for up to max_symbols symbols"""
+
+    def __init__(self, max_symbols=MAX_SYMBOLS, ticks=TICKS_PER_DAY):
+        self.max_symbols = max_symbols
+        self.ticks = ticks
+        self.data = np.full((len(FIELDS), ticks, max_symbols), np.nan)
+        self.times = np.zeros(ticks, dtype=np.int64)
+        self.index = {}
+        self.count = 0
+        self.day = None
+        self.lock = threading.Lock()
+        self._last_symbols = None
+        self._target = None
+        self._source = None
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.times.nbytes
+
+    @property
+    def last_timestamp(self):
+        return int(self.times[(self.count - 1) % self.ticks]) if self.count else None
+
+    def __len__(self):
+        return min(self.count, self.ticks)
+
+    def _columns(self, symbols):
+        """Where each snapshot column goes; cached while the symbol list is unchanged"""
+        if symbols == self._last_symbols:
+            return self._target, self._source
+        columns, source = [], []
+        for i, symbol in enumerate(symbols):
+            column = self.index.get(symbol)
+            if column is None and len(self.index) < self.max_symbols:
+                column = self.index[symbol] = len(self.index)
+            if column is not None:
+                columns.append(column)
+                source.append(i)
+        if columns == list(range(len(symbols))):
+            # Cas courant: mêmes symboles, même ordre -> copie d'une tranche
+            target, source = slice(0, len(symbols)), slice(0, len(symbols))
+        else:
+            target, source = np.array(columns, dtype=np.intp), np.array(source, dtype=np.intp)
+        self._last_symbols = list(symbols)
+        self._target, self._source = target, source
+        return target, source
+
+    def append(self, symbols, values, timestamp):
+        """Add one tick ({field: array aligned with symbols}); ignores ticks not newer than the last"""
+        epoch = _epoch(timestamp)
+        with self.lock:
+            if self.day is not None and _day(epoch) != self.day:
+                self.count = 0
+            if self.count and epoch <= self.last_timestamp:
+                return False
+            self.day = _day(epoch)
+            target, source = self._columns(symbols)
+            slot = self.count % self.ticks
+            rows = self.data[:, slot, :]
+            rows.fill(np.nan)
+            for k, field in enumerate(FIELDS):
+                column = values.get(field)
+                if column is not None:
+                    rows[k, target] = column[source]
+            self.times[slot] = epoch
+            self.count += 1
+            return True
+
+    def append_snapshot(self, snapshot):
+        """Snapshot listener entry point (see snapshot_changes.register_snapshot_listener)"""
+        return self.append(snapshot["symbols"], snapshot, snapshot["timestamp"])
+
+    def _order(self):
+        """Slots in chronological order"""
+        if self.count <= self.ticks:
+            return np.arange(self.count)
+        start = self.count % self.ticks
+        return np.r_[start:self.ticks, 0:start]
+
+    def series(self, symbol, fields=FIELDS):
+        """(epoch seconds, {field: values}) of one symbol for the day, oldest first"""
+        with self.lock:
+            column = self.index.get(symbol)
+            order = self._order()
+            times = self.times[order]
+            if column is None:
+                return times, {field: np.full(len(order), np.nan) for field in fields}
+            return times, {field: self.data[FIELDS.index(field), order, column] for field in fields}
+
+    def deltas(self, minutes, field="price"):
+        """{symbol: (value now, value `minutes` ago, % change)} for every symbol"""
+        with self.lock:
+            if not self.count:
+                return {}
+            order = self._order()
+            times = self.times[order]
+            k = FIELDS.index(field)
+            now = self.data[k, order[-1], :len(self.index)]
+            position = max(np.searchsorted(times, times[-1] - minutes * 60, side="right") - 1, 0)
+            before = self.data[k, order[position], :len(self.index)]
+            symbols = list(self.index)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change = (now / before - 1) * 100
+        return {s: (now[i], before[i], change[i]) for i, s in enumerate(symbols)}
+
+    @classmethod
+    def from_history(cls, conn, day=None, placeholder="?", **kwargs):
+        """Rebuild today's prices and volumes from price_history (after a restart)"""
+        buffer = cls(**kwargs)
+        day = day or pd.Timestamp.now().strftime("%Y-%m-%d")
+        history = load_history_frames(conn, ["price", "volume"], day, placeholder)
+        if history is None:
+            return buffer
+
+        times, symbols, frames = history
+        for timestamp, price_row, volume_row in zip(times, frames["price"], frames["volume"]):
+            buffer.append(symbols, {"price": price_row, "volume": volume_row}, timestamp)
+        return buffer
+
+def moving_average(values, window):
+    """Trailing simple moving average; NaN until `window` values are available"""
+    result = np.full(len(values), np.nan)
+    if window <= 0 or len(values) < window:
+        return result
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    result[window - 1:] = (cumulative[window:] - cumulative[:-window]) / window
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the intraday ring buffer")
+    parser.add_argument("--symbols", type=int, default=80)
+    parser.add_argument("--ticks", type=int, default=TICKS_PER_DAY)
+    args = parser.parse_args()
+
+    buffer = IntradayBuffer(max_symbols=max(args.symbols, MAX_SYMBOLS), ticks=args.ticks)
+    print(f"[INFO] {len(FIELDS)} fields x {args.ticks} ticks x {buffer.max_symbols} symbols: "
+          f"{buffer.nbytes / 1e6:.1f} MB preallocated")
+
+    rng = np.random.default_rng(0)
+    symbols = [f"SYM{i:03d}" for i in range(args.symbols)]
+    snapshot = {f: rng.uniform(10, 1000, args.symbols) for f in FIELDS}
+    start = pd.Timestamp("2025-01-02 09:30:00").timestamp()
+    stamps = [time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start + 20 * i)) for i in range(2 * args.ticks)]
+
+    started = time.perf_counter()
+    for stamp in stamps:
+        buffer.append(symbols, snapshot, stamp)
+    elapsed = time.perf_counter() - started
+    print(f"[INFO] Appended {len(stamps)} ticks (ring wrapped once): {elapsed / len(stamps) * 1e6:.1f} us per tick")
+
+    started = time.perf_counter()
+    for symbol in symbols:
+        times, series = buffer.series(symbol)
+        moving_average(series["price"], 20)
+    print(f"[INFO] Day series + SMA(20) for {len(symbols)} symbols: "
+          f"{(time.perf_counter() - started) / len(symbols) * 1e6:.0f} us per symbol")
+
+    started = time.perf_counter()
+    buffer.deltas(30)
+    print(f"[INFO] 30-minute deltas for the whole market: {(time.perf_counter() - started) * 1e6:.0f} us")
@@ -0,0 +1,317 @@
+"""
+Test de charge qui rejoue le trafic réel du frontend.
+
+Chaque utilisateur virtuel est connecté (cookie de session propre) et suit
+le comportement d'une page:
+
+- stocks     : stocks.html, script.js recharge /api/stocks toutes les 60 s
+               et watchlist-manager.js vérifie les alertes toutes les 60 s
+               (/api/stocks, /api/me puis /api/alerts);
+- details    : stock-details.html, /api/stocks/<symbol> toutes les 15 s;
+- dashboard  : dashboard.html, /api/me (navbar + dashboard) puis quatre
+               fetchs en parallèle (stocks, portfolio, watchlist, alerts),
+               rechargé toutes les 5 minutes.
+
+--speed compresse le temps (--speed 10: un poll de 60 s devient 6 s).
+Le rapport donne le débit, les latences p50/p95/p99 et les taux d'erreur et
+de refus (429/503) par route; --output l'enregistre en JSON et --baseline
+signale les régressions de p95 par rapport à une version précédente.
+
+Usage:
+    python loadtest.py --spawn --users 50 --duration 120 --speed 10
+    python loadtest.py --spawn --database-url postgresql://localhost/mafinance_load ...
+    python loadtest.py --base-url http://127.0.0.1:5000 --users 20 --output release.json
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+from startup_benchmark import copy_working_tree
+
+PAGE_INTERVALS = {
+    "stocks": 60,      # script.js startAutoRefresh + watchlist-manager.js alert check
+    "details": 15,     # stock-details.js startDetailsAutoRefresh
+    "dashboard": 300,  # rechargement de la page
+}
+DEFAULT_MIX = "stocks=50,details=30,dashboard=20"
+PASSWORD = "LoadTest123!"
+REQUEST_TIMEOUT = 30
+
+class Stats:
+    """Latencies and outcomes per route label, thread-safe"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+    def record(self, label, outcome, seconds):
+        with self.lock:
+            self.latencies[label].append(seconds)
+            self.outcomes[label][outcome] += 1
+
+    def report(self, elapsed):
+        rows = {}
+        for label in sorted(self.latencies):
+            values = sorted(self.latencies[label])
+            outcomes = self.outcomes[label]
+            count = len(values)
+
+            def pct(p):
+                return values[min(count - 1, int(p / 100 * count))] * 1e3
+
+            rows[label] = {
+                "requests": count,
+                "rps": round(count / elapsed, 2),
+                "p50_ms": round(pct(50), 1),
+                "p95_ms": round(pct(95), 1),
+                "p99_ms": round(pct(99), 1),
+                "error_rate": round(outcomes["error"] / count, 4),
+                "rejected_rate": round(outcomes["rejected"] / count, 4),
+            }
+        return rows
+
+class VirtualUser:
+    def __init__(self, base_url, index, page, stats):
+        self.base_url = base_url
+        self.email = f"loadtest_{index}@example.com"
+        self.page = page
+        self.stats = stats
+        self.symbol = None
+        self.details_path = None
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def call(self, method, path, label=None, payload=None, record=True):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"} if data else {})
+        started = time.perf_counter()
+        status, body = None, None
+        try:
+            with self.opener.open(req, timeout=REQUEST_TIMEOUT) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - started
+
+        if record:
+            if status in (429, 503):
+                outcome = "rejected"
+            elif status is None or status >= 400:
+                outcome = "error"
+            else:
+                outcome = "ok"
+            self.stats.record(f"{method} {label or path}", outcome, elapsed)
+        return status, body
+
+    def login(self, symbols):
+        """Register (or log in) and seed a watchlist, a portfolio and alerts"""
+        account = {"email": self.email, "password": PASSWORD, "full_name": self.email.split("@")[0]}
+        self.call("POST", "/api/register", payload=account, record=False)
+        status, _ = self.call("POST", "/api/login", payload=account, record=False)
+        if status != 200:
+            raise RuntimeError(f"login failed for {self.email} (HTTP {status})")
+
+        rng = random.Random(self.email)
+        picks = rng.sample(symbols, min(3, len(symbols)))
+        self.symbol = picks[0]
+        # stock-details.js: encodeURIComponent(symbol)
+        self.details_path = "/api/stocks/" + urllib.parse.quote(self.symbol, safe="")
+        for symbol in picks:
+            self.call("POST", "/api/watchlist", payload={"symbol": symbol, "name": symbol}, record=False)
+        self.call("POST", "/api/portfolio", record=False,
+                  payload={"symbol": picks[0], "name": picks[0], "shares": 10, "buy_price": 100})
+        self.call("POST", "/api/alerts", record=False,
+                  payload={"symbol": picks[0], "name": picks[0], "target_price": 100, "condition": "above"})
+
+    # --- Comportements des pages ---
+
+    def load_page(self):
+        if self.page == "stocks":
+            self.call("GET", "/api/me")
+            self.call("GET", "/api/stocks")
+        elif self.page == "details":
+            self.call("GET", "/api/me")
+            self.call("GET", self.details_path, "/api/stocks/<symbol>")
+        else:
+            self.dashboard()
+
+    def poll(self):
+        if self.page == "stocks":
+            self.call("GET", "/api/stocks")
+            # watchlist-manager.js: checkPriceAlerts -> requireAuth -> getPriceAlerts
+            self.call("GET", "/api/stocks")
+            self.call("GET", "/api/me")
+            self.call("GET", "/api/alerts")
+        elif self.page == "details":
+            self.call("GET", self.details_path, "/api/stocks/<symbol>")
+        else:
+            self.dashboard()
+
+    def dashboard(self):
+        # navbar.js et dashboard.js vérifient chacun la session, puis Promise.all de quatre fetchs
+        self.call("GET", "/api/me")
+        self.call("GET", "/api/me")
+        threads = [threading.Thread(target=self.call, args=("GET", path))
+                   for path in ("/api/stocks", "/api/portfolio", "/api/watchlist", "/api/alerts")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        page, _, weight = part.partition("=")
+        if page.strip() not in PAGE_INTERVALS:
+            raise ValueError(f"unknown page {page!r} (expected one of {', '.join(PAGE_INTERVALS)})")
+        weights[page.strip()] = float(weight or 1)
+    return weights
+
+def run_load(base_url, users, duration, speed, mix, concurrency, seed=1):
+    rng = random.Random(seed)
+    stats = Stats()
+    weights = parse_mix(mix)
+    pages = rng.choices(list(weights), weights=list(weights.values()), k=users)
+
+    # Symboles réels pour les pages de détails et les données des utilisateurs
+    with urllib.request.urlopen(base_url + "/api/stocks", timeout=REQUEST_TIMEOUT) as response:
+        symbols = [s["symbol"] for s in json.load(response)["stocks"]] or ["ATW"]
+    vusers = [VirtualUser(base_url, i, page, stats) for i, page in enumerate(pages)]
+    with ThreadPoolExecutor(max_workers=min(concurrency, 16)) as pool:
+        list(pool.map(lambda u: u.login(symbols), vusers))
+    print(f"[INFO] {users} users logged in: " + ", ".join(f"{p}={pages.count(p)}" for p in weights))
+
+    # File d'événements (échéance, n°, utilisateur, première visite?); arrivées étalées sur un intervalle
+    events = []
+    for n, user in enumerate(vusers):
+        interval = PAGE_INTERVALS[user.page] / speed
+        heapq.heappush(events, (rng.uniform(0, min(interval, duration / 4)), n, user, True))
+
+    started = time.perf_counter()
+    counter = len(events)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while events:
+            due, _, user, first = heapq.heappop(events)
+            if due > duration:
+                break
+            delay = due - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(user.load_page if first else user.poll)
+            counter += 1
+            heapq.heappush(events, (due + PAGE_INTERVALS[user.page] / speed, counter, user, False))
+    return stats.report(time.perf_counter() - started)
+
+def print_report(rows, baseline=None, tolerance=0.2):
+    print(f"{'route':<28}{'req':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>7}{'rej%':>7}")
+    regressions = []
+    for label, row in rows.items():
+        flag = ""
+        previous = (baseline or {}).get(label)
+        if previous and previous["p95_ms"] > 0 and row["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            flag = f"  p95 +{(row['p95_ms'] / previous['p95_ms'] - 1) * 100:.0f}%"
+            regressions.append(label)
+        print(f"{label:<28}{row['requests']:>7}{row['rps']:>8.1f}{row['p50_ms']:>8.1f}ms{row['p95_ms']:>7.1f}ms"
+              f"{row['p99_ms']:>7.1f}ms{row['error_rate'] * 100:>6.1f}%{row['rejected_rate'] * 100:>6.1f}%{flag}")
+    total = sum(r["requests"] for r in rows.values())
+    print(f"[INFO] {total} requests, {sum(r['rps'] for r in rows.values()):.1f} req/s overall")
+    return regressions
+
+# ===== INSTANCE LOCALE =====
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def spawn_instance(scratch, workers, database_url=None, env=None):
+    """Start the app from a copy of the tree (fresh SQLite, or database_url); returns (process, base_url)"""
+    tree = os.path.join(scratch, "app")
+    copy_working_tree(os.path.dirname(os.path.abspath(__file__)), tree)
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), ADMISSION_LOCK_DIR=os.path.join(scratch, "locks"), **(env or {}))
+    env.pop("DATABASE_URL", None)
+    if database_url:
+        env["DATABASE_URL"] = database_url
+    subprocess.run([sys.executable, "init_db.py"], cwd=tree, env=env, check=True, capture_output=True)
+
+    port = _free_port()
+    if shutil.which("gunicorn"):
+        command = ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--preload", "app:app"]
+    else:
+        print("[INFO] gunicorn not installed: using the threaded development server")
+        command = [sys.executable, "-c", f"import app; app.app.run(port={port}, threaded=True)"]
+    process = subprocess.Popen(command, cwd=tree, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/api/stocks", timeout=5).read()
+            return process, base_url
+        except Exception:
+            if process.poll() is not None:
+                break
+            time.sleep(0.3)
+    process.terminate()
+    raise RuntimeError("local instance did not start")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay the frontend polling mix against an instance")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--base-url", help="Existing instance, e.g. http://127.0.0.1:5000")
+    target.add_argument("--spawn", action="store_true", help="Start a local instance from this tree")
+    parser.add_argument("--database-url", help="With --spawn: PostgreSQL stand-in instead of SQLite")
+    parser.add_argument("--workers", type=int, default=2, help="With --spawn: gunicorn workers")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=120, help="Seconds of load")
+    parser.add_argument("--speed", type=float, default=1, help="Time compression of the polling intervals")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Share of users per page")
+    parser.add_argument("--concurrency", type=int, default=64, help="Max requests in flight")
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--baseline", help="Previous JSON report to compare p95 against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 increase vs baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        process = None
+        base_url = args.base_url
+        if args.spawn:
+            process, base_url = spawn_instance(scratch, args.workers, args.database_url)
+        try:
+            rows = run_load(base_url, args.users, args.duration, args.speed, args.mix, args.concurrency)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["routes"]
+    regressions = print_report(rows, baseline, args.tolerance)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"users": args.users, "duration": args.duration, "speed": args.speed,
+                       "mix": args.mix, "routes": rows}, f, indent=2)
+    if regressions:
+        print(f"[ERROR] p95 regression on: {', '.join(regressions)}")
+        sys.exit(1)
@@ -6,6 +6,10 @@ class Logger:
     def __init__(self, log_level=logging.INFO, log_dir="logs"):
         self.logger = logging.getLogger("moroccan_stocks")
         self.logger.setLevel(log_level)
+
+        # Un seul jeu de handlers par processus, même si Logger() est instancié plusieurs fois
+        if self.logger.handlers:
+            return
         
         # Create logs directory if it doesn't exist
         if not os.path.exists(log_dir):
@@ -16,7 +20,8 @@ class Logger:
         log_file = os.path.join(log_dir, f"app_{timestamp}.log")
         
         # Create file handler
-        file_handler = logging.FileHandler(log_file)
+        # delay=True: le fichier n'est ouvert qu'au premier message écrit
+        file_handler = logging.FileHandler(log_file, delay=True)
         file_handler.setLevel(log_level)
         
         # Create console handler
@@ -48,6 +53,3 @@ class Logger:
     
     def critical(self, message):
         self.logger.critical(message)
-
-# Create a default logger instance
-default_logger = Logger()
\ No newline at end of file
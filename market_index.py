@@ -0,0 +1,232 @@
+"""
+Indices de marché incrémentaux (pondérés par les capitalisations et équipondérés).
+
+Un indice "MARKET" (à la MASI) et un indice par secteur sont chaînés de
+snapshot en snapshot. Le rendement d'un indice pondéré est
+Σ cap_i(t-1)·r_i / Σ cap_i(t-1), celui d'un indice équipondéré la moyenne
+des r_i: seuls les constituants qui ont bougé contribuent au numérateur,
+et les dénominateurs (capitalisation totale, nombre de constituants) sont
+tenus à jour par différence. Un snapshot coûte donc O(lignes modifiées)
+en arithmétique, plus une comparaison vectorisée pour trouver ces lignes.
+
+Les niveaux partent de BASE_LEVEL au premier snapshot connu; au
+démarrage, seule la séance du jour est rejouée depuis price_history (un
+constituant qui n'a pas encore bougé rejoint l'indice à son premier
+cours). Les niveaux de la séance sont conservés pour les graphiques
+intraday.
+
+Benchmark et contrôle contre un recalcul complet:
+    python market_index.py --symbols 80 --snapshots 5000
+"""
+import argparse
+import os
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from snapshot_changes import load_history_frames
+
+MARKET = "MARKET"
+BASE_LEVEL = 1000.0
+MAX_TICKS = int(os.getenv("INTRADAY_TICKS", "1024"))
+
+def _day(timestamp):
+    return str(timestamp)[:10]
+
+class MarketIndexEngine:
+    """Cap-weighted and equal-weighted levels for the market and each sector"""
+
+    def __init__(self, base=BASE_LEVEL, max_ticks=MAX_TICKS):
+        self.base = base
+        self.groups = [MARKET]
+        self.group_index = {MARKET: 0}
+        self.symbols = []
+        self.index = {}
+        self.sector_of = np.zeros(0, dtype=np.intp)
+        self.prices = np.zeros(0)
+        self.caps = np.zeros(0)
+        self.cap_level = np.full(1, base)
+        self.equal_level = np.full(1, base)
+        self.total_cap = np.zeros(1)
+        self.members = np.zeros(1)
+        self.open_levels = None
+        self.day = None
+        self.series = deque(maxlen=max_ticks)
+        self.last_timestamp = None
+        self._last_symbols = None
+        self._positions = None
+
+    def _group(self, sector):
+        group = self.group_index.get(sector)
+        if group is None:
+            group = self.group_index[sector] = len(self.groups)
+            self.groups.append(sector)
+            self.cap_level = np.append(self.cap_level, self.base)
+            self.equal_level = np.append(self.equal_level, self.base)
+            self.total_cap = np.append(self.total_cap, 0.0)
+            self.members = np.append(self.members, 0.0)
+            if self.open_levels is not None:
+                self.open_levels = np.vstack([self.open_levels.T, [self.base, self.base]]).T
+        return group
+
+    def _align(self, symbols, sectors):
+        """Positions of the snapshot rows in the engine arrays (cached while the symbol list is unchanged)"""
+        if symbols == self._last_symbols:
+            return self._positions
+        new = [(s, sector) for s, sector in zip(symbols, sectors) if s not in self.index]
+        if new:
+            for symbol, sector in new:
+                self.index[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+            self.sector_of = np.concatenate([self.sector_of, [self._group(sector) for _, sector in new]]).astype(np.intp)
+            self.prices = np.concatenate([self.prices, np.full(len(new), np.nan)])
+            self.caps = np.concatenate([self.caps, np.full(len(new), np.nan)])
+        self._last_symbols = list(symbols)
+        self._positions = np.array([self.index[s] for s in symbols], dtype=np.intp)
+        return self._positions
+
+    def update(self, symbols, sectors, prices, caps, timestamp):
+        """Chain one snapshot into every index; returns the number of constituents that moved"""
+        if self.last_timestamp is not None and str(timestamp) <= str(self.last_timestamp):
+            return 0
+
+        positions = self._align(symbols, sectors)
+        if _day(timestamp) != self.day:
+            # Variation de séance mesurée depuis la dernière clôture
+            self.day = _day(timestamp)
+            self.open_levels = np.vstack([self.cap_level, self.equal_level])
+            self.series.clear()
+        prices = np.asarray(prices, dtype=np.float64)
+        caps = np.asarray(caps, dtype=np.float64)
+        valid = np.isfinite(prices) & (prices > 0)
+        caps = np.where(np.isfinite(caps) & (caps > 0), caps, 0.0)
+
+        # Seules les lignes modifiées participent au calcul
+        with np.errstate(invalid="ignore"):
+            moved = valid & ((prices != self.prices[positions]) | (caps != self.caps[positions]))
+        rows = positions[moved]
+        new_prices, new_caps = prices[moved], caps[moved]
+        old_prices, old_caps = self.prices[rows], self.caps[rows]
+        known = np.isfinite(old_prices)
+        returns = np.where(known, new_prices / np.where(known, old_prices, 1.0) - 1, 0.0)
+        old_caps = np.where(known, old_caps, 0.0)
+        groups = self.sector_of[rows]
+
+        size = len(self.groups)
+        cap_move = np.bincount(groups, weights=old_caps * returns, minlength=size)
+        equal_move = np.bincount(groups, weights=returns, minlength=size)
+        cap_move[0] += cap_move[1:].sum()
+        equal_move[0] += equal_move[1:].sum()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.cap_level *= 1 + np.where(self.total_cap > 0, cap_move / self.total_cap, 0.0)
+            self.equal_level *= 1 + np.where(self.members > 0, equal_move / self.members, 0.0)
+
+        # Dénominateurs pour le prochain snapshot: capitalisations courantes, nouveaux constituants
+        cap_delta = np.bincount(groups, weights=new_caps - old_caps, minlength=size)
+        joined = np.bincount(groups, weights=(~known).astype(np.float64), minlength=size)
+        cap_delta[0] += cap_delta[1:].sum()
+        joined[0] += joined[1:].sum()
+        self.total_cap += cap_delta
+        self.members += joined
+        self.prices[rows] = new_prices
+        self.caps[rows] = new_caps
+
+        self.series.append((str(timestamp), self.cap_level.copy(), self.equal_level.copy()))
+        self.last_timestamp = timestamp
+        return int(moved.sum())
+
+    def update_from_snapshot(self, snapshot):
+        """Snapshot listener entry point (see snapshot_changes.register_snapshot_listener)"""
+        return self.update(snapshot["symbols"], snapshot["sectors"], snapshot["price"], snapshot["market_cap"],
+                           snapshot["timestamp"])
+
+    def levels(self):
+        """Current level and session change of every index, market first"""
+        result = []
+        for group, name in enumerate(self.groups):
+            opened = self.open_levels[:, group] if self.open_levels is not None else (self.base, self.base)
+            result.append({
+                "name": name,
+                "constituents": int(self.members[group]),
+                "market_cap": round(float(self.total_cap[group]), 2),
+                "cap_weighted": round(float(self.cap_level[group]), 2),
+                "cap_weighted_change": round(float((self.cap_level[group] / opened[0] - 1) * 100), 2),
+                "equal_weighted": round(float(self.equal_level[group]), 2),
+                "equal_weighted_change": round(float((self.equal_level[group] / opened[1] - 1) * 100), 2),
+            })
+        return result
+
+    def intraday(self, name):
+        """(times, cap-weighted levels, equal-weighted levels) of one index for the session, or None"""
+        group = self.group_index.get(name)
+        if group is None:
+            return None
+        ticks = list(self.series)
+        return ([t for t, _, _ in ticks],
+                [round(float(cap[group]), 2) for _, cap, _ in ticks],
+                [round(float(equal[group]), 2) for _, _, equal in ticks])
+
+    @classmethod
+    def from_history(cls, conn, sector_of, day=None, placeholder="?", **kwargs):
+        """Replay today's price_history (price, market_cap) to rebuild levels; sector_of maps symbol -> sector"""
+        engine = cls(**kwargs)
+        day = day or pd.Timestamp.now().strftime("%Y-%m-%d")
+        history = load_history_frames(conn, ["price", "market_cap"], day, placeholder)
+        if history is None:
+            return engine
+
+        times, symbols, frames = history
+        sectors = [sector_of.get(s, "Other") for s in symbols]
+        for timestamp, price_row, cap_row in zip(times, frames["price"], frames["market_cap"]):
+            engine.update(symbols, sectors, price_row, cap_row, timestamp)
+        return engine
+
+def full_recompute(prices, caps, sectors, groups, base=BASE_LEVEL):
+    """Reference: chain every index from the full (snapshots x symbols) matrices"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.nan_to_num(prices[1:] / prices[:-1] - 1)
+    weights = caps[:-1]
+    cap_levels, equal_levels = [], []
+    for name in groups:
+        members = np.ones(len(sectors), bool) if name == MARKET else np.array([s == name for s in sectors])
+        cap_r = (weights[:, members] * returns[:, members]).sum(axis=1) / weights[:, members].sum(axis=1)
+        equal_r = returns[:, members].mean(axis=1)
+        cap_levels.append(base * np.prod(1 + cap_r))
+        equal_levels.append(base * np.prod(1 + equal_r))
+    return np.array(cap_levels), np.array(equal_levels)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark incremental index levels against a full recompute")
+    parser.add_argument("--symbols", type=int, default=80)
+    parser.add_argument("--snapshots", type=int, default=5000)
+    parser.add_argument("--moving", type=float, default=0.1, help="Share of constituents moving per snapshot")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(3)
+    n, t = args.symbols, args.snapshots
+    symbols = [f"SYM{i:03d}" for i in range(n)]
+    sectors = [f"Sector {i % 10}" for i in range(n)]
+    shares = rng.uniform(1e6, 1e8, n)
+    moves = (rng.random((t, n)) < args.moving) * rng.normal(0, 0.01, (t, n))
+    moves[0] = 0
+    prices = 100 * np.cumprod(1 + moves, axis=0)
+    caps = prices * shares
+    stamps = [f"2025-01-02 {i:08d}" for i in range(t)]
+
+    engine = MarketIndexEngine()
+    started = time.perf_counter()
+    for step in range(t):
+        engine.update(symbols, sectors, prices[step], caps[step], stamps[step])
+    incremental = time.perf_counter() - started
+
+    started = time.perf_counter()
+    cap_ref, equal_ref = full_recompute(prices, caps, sectors, engine.groups)
+    full = time.perf_counter() - started
+
+    error = max(np.abs(engine.cap_level / cap_ref - 1).max(), np.abs(engine.equal_level / equal_ref - 1).max())
+    print(f"[INFO] Incremental: {incremental / t * 1e6:.0f} us per snapshot ({len(engine.groups)} indices)")
+    print(f"[INFO] Full recompute of {t} snapshots: {full * 1e3:.0f} ms (what each snapshot would cost from scratch)")
+    print(f"[INFO] Max relative difference vs full recompute: {error:.2e}")
@@ -0,0 +1,65 @@
+"""
+Indicateurs de microstructure du carnet d'ordres, calculés à l'ingestion.
+
+À partir des colonnes déjà scrapées (meilleurs prix et quantités à l'achat et
+à la vente, nombre de transactions, quantité échangée et volume en MAD), on
+calcule en une passe vectorisée le spread, le prix milieu, le déséquilibre du
+carnet, la taille moyenne des transactions et le VWAP du jour.
+"""
+import numpy as np
+import pandas as pd
+
+METRIC_COLUMNS = ["spread", "spread_bps", "mid_price", "imbalance", "avg_trade_size", "vwap"]
+
+# Colonnes du snapshot nécessaires au calcul
+INPUT_COLUMNS = [
+    "Meilleur_Prix_Achat", "Meilleur_Prix_Vente", "Quantite_Meilleur_Prix_Achat",
+    "Quantite_Meilleur_Prix_Vente", "Quantite_Echangee", "Volume", "Nombre_Transactions",
+]
+
+def _column(df, name):
+    if name in df.columns:
+        return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=np.float64)
+    return np.full(len(df), np.nan)
+
+def compute_microstructure(df):
+    """
+    Compute order-book metrics from a cleaned snapshot (numeric columns).
+
+    Returns a float64 DataFrame aligned on df.index with METRIC_COLUMNS;
+    values are NaN when the inputs are missing or inconsistent.
+    """
+    bid = _column(df, "Meilleur_Prix_Achat")
+    ask = _column(df, "Meilleur_Prix_Vente")
+    bid_qty = _column(df, "Quantite_Meilleur_Prix_Achat")
+    ask_qty = _column(df, "Quantite_Meilleur_Prix_Vente")
+    quantity = _column(df, "Quantite_Echangee")
+    value = _column(df, "Volume")
+    trades = _column(df, "Nombre_Transactions")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Carnet exploitable seulement avec les deux côtés et sans croisement
+        two_sided = (bid > 0) & (ask > 0) & (ask >= bid)
+        mid = np.where(two_sided, (bid + ask) / 2, np.nan)
+        spread = np.where(two_sided, ask - bid, np.nan)
+        spread_bps = spread / mid * 1e4
+
+        depth = bid_qty + ask_qty
+        imbalance = np.where(depth > 0, (bid_qty - ask_qty) / depth, np.nan)
+
+        avg_trade_size = np.where(trades > 0, quantity / trades, np.nan)
+        vwap = np.where(quantity > 0, value / quantity, np.nan)
+
+    return pd.DataFrame({
+        "spread": spread,
+        "spread_bps": spread_bps,
+        "mid_price": mid,
+        "imbalance": imbalance,
+        "avg_trade_size": avg_trade_size,
+        "vwap": vwap,
+    }, index=df.index)
+
+def metrics_records(metrics):
+    """Metrics rows as JSON-friendly dicts (None instead of NaN), in row order"""
+    rounded = metrics[METRIC_COLUMNS].round(4).astype(object)
+    return rounded.where(metrics[METRIC_COLUMNS].notna(), None).to_dict("records")
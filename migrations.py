@@ -0,0 +1,343 @@
+"""
+Migrations de schéma versionnées (SQLite et PostgreSQL).
+
+init_database() crée les tables de base; les évolutions ultérieures (index
+composites, index partiels, nouvelles colonnes) sont décrites ici et appliquées
+une seule fois par base grâce à la table schema_migrations.
+
+    python migrations.py                 # appliquer les migrations en attente
+    python migrations.py --status        # versions appliquées / en attente
+    python migrations.py --check-plans   # EXPLAIN des requêtes critiques (base de test)
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+# Tables dont les lignes référencent un instrument par son symbole
+INSTRUMENT_TABLES = ("stocks", "watchlists", "portfolios", "price_alerts", "price_history")
+
+def _instrument_statements(dialect):
+    """Migration 6: instruments dimension, instrument_id columns, backfill and integer indexes"""
+    postgres = dialect == "postgres"
+    statements = [f"""CREATE TABLE IF NOT EXISTS instruments (
+        id {'SERIAL PRIMARY KEY' if postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT'},
+        symbol TEXT UNIQUE NOT NULL,
+        name TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )"""]
+    for table in INSTRUMENT_TABLES:
+        name = "symbol" if table == "price_history" else "MAX(name)"
+        select = f"SELECT symbol, {name} FROM {table} GROUP BY symbol"
+        statements.append(f"INSERT INTO instruments (symbol, name) {select} ON CONFLICT (symbol) DO NOTHING"
+                          if postgres else f"INSERT OR IGNORE INTO instruments (symbol, name) {select}")
+    for table in INSTRUMENT_TABLES:
+        statements += [
+            f"ALTER TABLE {table} ADD COLUMN instrument_id INTEGER REFERENCES instruments(id)",
+            f"UPDATE {table} SET instrument_id = (SELECT id FROM instruments WHERE instruments.symbol = {table}.symbol)",
+        ]
+    false = "FALSE" if postgres else "0"
+    return statements + [
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_stocks_instrument ON stocks(instrument_id)",
+        "CREATE INDEX IF NOT EXISTS idx_watchlists_user_instrument ON watchlists(user_id, instrument_id)",
+        "CREATE INDEX IF NOT EXISTS idx_portfolios_user_instrument ON portfolios(user_id, instrument_id)",
+        f"CREATE INDEX IF NOT EXISTS idx_alerts_pending_instrument ON price_alerts(instrument_id, target_price) WHERE triggered = {false}",
+        "CREATE INDEX IF NOT EXISTS idx_history_instrument_time ON price_history(instrument_id, snapshot_time)",
+    ]
+
+# Chaque migration: version, description et instructions SQL, communes
+# ("sql") ou propres à un dialecte ("sqlite" / "postgres").
+MIGRATIONS = [
+    {
+        "version": 1,
+        "description": "Composite indexes for per-user listings and lookups",
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_watchlists_user_added ON watchlists(user_id, added_date DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_portfolios_user_created ON portfolios(user_id, created_at DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_alerts_user_created ON price_alerts(user_id, created_date DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_portfolios_user_symbol ON portfolios(user_id, symbol)",
+            "CREATE INDEX IF NOT EXISTS idx_alerts_user_symbol ON price_alerts(user_id, symbol)",
+            # Préfixes des index composites ci-dessus
+            "DROP INDEX IF EXISTS idx_watchlists_user",
+            "DROP INDEX IF EXISTS idx_portfolios_user",
+            "DROP INDEX IF EXISTS idx_alerts_user",
+        ],
+    },
+    {
+        "version": 2,
+        "description": "Partial index on pending alerts for the alert engine",
+        "sqlite": [
+            "CREATE INDEX IF NOT EXISTS idx_alerts_pending_symbol ON price_alerts(symbol, target_price) WHERE triggered = 0",
+        ],
+        "postgres": [
+            "CREATE INDEX IF NOT EXISTS idx_alerts_pending_symbol ON price_alerts(symbol, target_price) WHERE triggered = FALSE",
+        ],
+    },
+    {
+        "version": 3,
+        "description": "Order-book microstructure columns on stocks",
+        "sql": [
+            "ALTER TABLE stocks ADD COLUMN spread REAL",
+            "ALTER TABLE stocks ADD COLUMN spread_bps REAL",
+            "ALTER TABLE stocks ADD COLUMN mid_price REAL",
+            "ALTER TABLE stocks ADD COLUMN imbalance REAL",
+            "ALTER TABLE stocks ADD COLUMN avg_trade_size REAL",
+            "ALTER TABLE stocks ADD COLUMN vwap REAL",
+        ],
+    },
+    {
+        "version": 4,
+        "description": "Portfolio risk results from the after-close batch",
+        "sql": [
+            """CREATE TABLE IF NOT EXISTS portfolio_risk (
+                user_id INTEGER PRIMARY KEY,
+                computed_at TIMESTAMP NOT NULL,
+                volatility REAL,
+                beta REAL,
+                payload TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )""",
+        ],
+    },
+    {
+        "version": 5,
+        "description": "Outbox of alert notifications for the dispatcher",
+        "sqlite": [
+            """CREATE TABLE IF NOT EXISTS notification_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                alert_id INTEGER,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedupe_key TEXT UNIQUE NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL,
+                locked_at TIMESTAMP,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_outbox_due ON notification_outbox(status, next_attempt_at)",
+        ],
+        "postgres": [
+            """CREATE TABLE IF NOT EXISTS notification_outbox (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                alert_id INTEGER,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedupe_key TEXT UNIQUE NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL,
+                locked_at TIMESTAMP,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_outbox_due ON notification_outbox(status, next_attempt_at)",
+        ],
+    },
+    {
+        "version": 6,
+        "description": "Integer instrument ids referenced by every symbol-keyed table",
+        "sqlite": _instrument_statements("sqlite"),
+        "postgres": _instrument_statements("postgres"),
+    },
+    {
+        "version": 7,
+        "description": "Time index for the bounded price_history replays at warm-up",
+        "sql": [
+            "CREATE INDEX IF NOT EXISTS idx_history_time ON price_history(snapshot_time)",
+        ],
+    },
+]
+
+def _placeholder(dialect):
+    return "%s" if dialect == "postgres" else "?"
+
+def _create_migrations_table(cursor, dialect):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def applied_versions(conn, dialect):
+    """Return the set of migration versions already applied to this database"""
+    cursor = conn.cursor()
+    _create_migrations_table(cursor, dialect)
+    conn.commit()
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row["version"] if hasattr(row, "keys") else row[0] for row in cursor.fetchall()}
+
+def pending_migrations(conn, dialect):
+    done = applied_versions(conn, dialect)
+    return [m for m in MIGRATIONS if m["version"] not in done]
+
+def apply_migrations(conn, dialect, logger=print):
+    """Apply pending migrations in order, each one in its own transaction"""
+    applied = []
+    for migration in sorted(pending_migrations(conn, dialect), key=lambda m: m["version"]):
+        cursor = conn.cursor()
+        try:
+            for statement in migration.get("sql", []) + migration.get(dialect, []):
+                cursor.execute(statement)
+            cursor.execute(
+                f"INSERT INTO schema_migrations (version, description) VALUES ({_placeholder(dialect)}, {_placeholder(dialect)})",
+                (migration["version"], migration["description"])
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(migration["version"])
+        logger(f"[SUCCESS] Migration {migration['version']} applied: {migration['description']}")
+    return applied
+
+# ===== PLANS D'EXÉCUTION DES REQUÊTES CRITIQUES =====
+
+# Requêtes des routes les plus appelées, avec des paramètres d'exemple.
+# Aucune ne doit dégénérer en parcours de table ni en tri temporaire.
+HOT_QUERIES = {
+    "login": (
+        "SELECT id, email, password_hash, full_name FROM users WHERE email = ?",
+        ("demo@mafinance.com",)),
+    "get_watchlist": (
+        "SELECT id, symbol, name, added_date, added_price FROM watchlists WHERE user_id = ? ORDER BY added_date DESC",
+        (1,)),
+    "add_to_watchlist": (
+        "SELECT id FROM watchlists WHERE user_id = ? AND instrument_id = ?",
+        (1, 1)),
+    "remove_from_watchlist": (
+        "DELETE FROM watchlists WHERE user_id = ? AND instrument_id = (SELECT id FROM instruments WHERE symbol = ?)",
+        (1, "ATTIJARIWAFA BANK")),
+    "get_portfolio": (
+        "SELECT id, symbol, name, shares, buy_price, buy_date, total_investment FROM portfolios WHERE user_id = ? ORDER BY created_at DESC",
+        (1,)),
+    "portfolio_holding": (
+        "SELECT id, shares, buy_price FROM portfolios WHERE user_id = ? AND symbol = ?",
+        (1, "ATTIJARIWAFA BANK")),
+    "remove_from_portfolio": (
+        "DELETE FROM portfolios WHERE id = ? AND user_id = ?",
+        (1, 1)),
+    "get_price_alerts": (
+        "SELECT id, symbol, name, target_price, condition, triggered, created_date, triggered_date FROM price_alerts WHERE user_id = ? ORDER BY created_date DESC",
+        (1,)),
+    "remove_price_alert": (
+        "DELETE FROM price_alerts WHERE id = ? AND user_id = ?",
+        (1, 1)),
+    "pending_alerts_for_symbol": (
+        "SELECT id, user_id, target_price, condition FROM price_alerts WHERE symbol = ? AND triggered = {false}",
+        ("ATTIJARIWAFA BANK",)),
+    "price_history_for_symbol": (
+        "SELECT snapshot_time, price FROM price_history WHERE symbol = ? ORDER BY snapshot_time",
+        ("ATTIJARIWAFA BANK",)),
+    "price_history_for_instrument": (
+        "SELECT snapshot_time, price FROM price_history WHERE instrument_id = ? ORDER BY snapshot_time",
+        (1,)),
+    "pending_alerts_for_instruments": (
+        "SELECT id, user_id, instrument_id, target_price, condition FROM price_alerts WHERE instrument_id IN (?, ?) AND triggered = {false}",
+        (1, 2)),
+    "replay_history_since": (
+        "SELECT symbol, price, market_cap, snapshot_time FROM price_history WHERE snapshot_time >= ? ORDER BY snapshot_time",
+        ("2025-01-02",)),
+    "claim_notifications": (
+        "SELECT id FROM notification_outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 500",
+        ("2025-01-01 00:00:00",)),
+}
+
+def _render_query(sql, dialect):
+    sql = sql.replace("{false}", "FALSE" if dialect == "postgres" else "0")
+    return sql.replace("?", "%s") if dialect == "postgres" else sql
+
+def _sqlite_plan_problems(cursor, sql, params):
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    details = [row[3] for row in cursor.fetchall()]
+    problems = [d for d in details if d.startswith("SCAN ") or "TEMP B-TREE" in d]
+    return details, problems
+
+def _walk_plan(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk_plan(child)
+
+def _postgres_plan_problems(cursor, sql, params):
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+    row = cursor.fetchone()
+    plan = (row["QUERY PLAN"] if hasattr(row, "keys") else row[0])[0]["Plan"]
+    nodes = list(_walk_plan(plan))
+    details = [f"{n['Node Type']} {n.get('Index Name', n.get('Relation Name', ''))}".strip() for n in nodes]
+    problems = [d for d in details if d.startswith("Seq Scan") or d.startswith("Sort")]
+    return details, problems
+
+def check_query_plans(conn, dialect, queries=None):
+    """
+    EXPLAIN every hot query and return {name: problems} for the regressions
+    (table scans or temporary sorts). An empty dict means all plans are fine.
+    """
+    queries = queries or HOT_QUERIES
+    cursor = conn.cursor()
+    if dialect == "postgres":
+        # Sur des tables presque vides le planner préfère un Seq Scan: on vérifie qu'un index est utilisable
+        cursor.execute("SET enable_seqscan = off")
+
+    regressions = {}
+    for name, (sql, params) in queries.items():
+        sql = _render_query(sql, dialect)
+        if dialect == "postgres":
+            details, problems = _postgres_plan_problems(cursor, sql, params)
+        else:
+            details, problems = _sqlite_plan_problems(cursor, sql, params)
+        status = "FAIL" if problems else "ok"
+        print(f"[{status:>4}] {name}: {' | '.join(details)}")
+        if problems:
+            regressions[name] = problems
+
+    if dialect == "postgres":
+        cursor.execute("RESET enable_seqscan")
+        conn.rollback()
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Versioned schema migrations")
+    parser.add_argument("--status", action="store_true", help="List applied and pending migrations")
+    parser.add_argument("--check-plans", action="store_true",
+                        help="Fail if a hot query regresses to a table scan or temp sort")
+    parser.add_argument("--scratch", action="store_true",
+                        help="Run against a fresh temporary SQLite database (default for --check-plans locally)")
+    args = parser.parse_args()
+
+    import init_db
+
+    if args.scratch or (args.check_plans and not init_db.IS_PRODUCTION):
+        init_db.DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="mafinance_"), "scratch.db")
+    dialect = "postgres" if init_db.IS_PRODUCTION else "sqlite"
+
+    if args.check_plans:
+        init_db.init_database()
+        conn = init_db.get_db_connection()
+        regressions = check_query_plans(conn, dialect)
+        conn.close()
+        if regressions:
+            print(f"[ERROR] {len(regressions)} query plan regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"[SUCCESS] All {len(HOT_QUERIES)} hot queries use an index without temp sort")
+        sys.exit(0)
+
+    conn = init_db.get_db_connection()
+    if args.status:
+        done = applied_versions(conn, dialect)
+        for migration in MIGRATIONS:
+            state = "applied" if migration["version"] in done else "pending"
+            print(f"{migration['version']:>4}  {state:<8} {migration['description']}")
+    else:
+        applied = apply_migrations(conn, dialect)
+        print(f"[INFO] {len(applied)} migration(s) applied")
+    conn.close()
@@ -0,0 +1,344 @@
+"""
+File d'envoi des notifications d'alertes (outbox en base).
+
+À l'ingestion d'un snapshot, les alertes en attente des symboles modifiés
+sont évaluées en une requête par instrument_id (index partiel
+idx_alerts_pending_instrument); les alertes déclenchées sont marquées et
+une ligne par canal est ajoutée à notification_outbox, dans la même
+transaction. Rien n'est envoyé à ce moment-là: l'ingestion ne dépend pas
+des serveurs SMTP ou webhooks.
+
+Le dispatcher réclame des lots de notifications dues, les regroupe par
+utilisateur et par canal (un seul e-mail pour dix alertes), les envoie via
+un pool de threads et replanifie les échecs avec un backoff exponentiel.
+La clé de déduplication (alerte, canal) est unique: une alerte ne produit
+jamais deux notifications sur le même canal.
+
+Usage:
+    python notifications.py --worker [--workers 4]        # dispatcher continu
+    python notifications.py --benchmark --alerts 20000     # ingestion + envoi vers un webhook local
+"""
+import argparse
+import json
+import os
+import smtplib
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHANNELS = [c.strip() for c in os.getenv("NOTIFICATION_CHANNELS", "email").split(",") if c.strip()]
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "1025"))  # python -m aiosmtpd -n en local
+SMTP_SENDER = os.getenv("SMTP_SENDER", "alerts@mafinance.local")
+WEBHOOK_URL = os.getenv("NOTIFY_WEBHOOK_URL", "http://127.0.0.1:8025/notifications")
+
+CLAIM_BATCH = 500
+MAX_ATTEMPTS = 6
+BACKOFF_SECONDS = 30          # 30 s, 60 s, 120 s, ... plafonné
+MAX_BACKOFF_SECONDS = 3600
+LEASE_SECONDS = 300           # une notification "sending" plus vieille est réclamée à nouveau
+SYMBOLS_PER_QUERY = 500
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _sql(sql, dialect):
+    """Render the shared SQL for a dialect ({true}/{false}, ? placeholders, insert-or-ignore)"""
+    if dialect == "postgres":
+        sql = sql.replace("{true}", "TRUE").replace("{false}", "FALSE").replace("?", "%s")
+        if sql.startswith("INSERT OR IGNORE"):
+            sql = sql.replace("INSERT OR IGNORE", "INSERT", 1) + " ON CONFLICT (dedupe_key) DO NOTHING"
+        return sql
+    return sql.replace("{true}", "1").replace("{false}", "0")
+
+def _row(row):
+    return dict(row) if hasattr(row, "keys") else row
+
+# ===== DÉCLENCHEMENT (chemin d'ingestion) =====
+
+def find_triggered_alerts(cursor, prices, instrument_ids, dialect):
+    """Pending alerts whose condition holds for the given {symbol: price}; instrument_ids maps symbol -> id"""
+    priced = {instrument_ids[s]: p for s, p in prices.items()
+              if s in instrument_ids and p is not None and p == p and p > 0}
+    ids = list(priced)
+    triggered = []
+    for start in range(0, len(ids), SYMBOLS_PER_QUERY):
+        chunk = ids[start:start + SYMBOLS_PER_QUERY]
+        cursor.execute(_sql(
+            "SELECT id, user_id, instrument_id, symbol, name, target_price, condition FROM price_alerts "
+            f"WHERE instrument_id IN ({', '.join('?' * len(chunk))}) AND triggered = {{false}}", dialect), chunk)
+        for alert in map(_row, cursor.fetchall()):
+            price = priced[alert["instrument_id"]]
+            if (alert["condition"] == "above" and price >= alert["target_price"]) or \
+               (alert["condition"] == "below" and price <= alert["target_price"]):
+                triggered.append(dict(alert, price=price))
+    return triggered
+
+def enqueue_alert_notifications(conn, prices, instrument_ids, dialect="sqlite", channels=None, triggered_at=None):
+    """
+    Mark the alerts triggered by {symbol: price} and add their notifications
+    to the outbox, in one transaction. Returns the triggered alerts.
+    """
+    channels = channels or CHANNELS
+    triggered_at = triggered_at or _now()
+    cursor = conn.cursor()
+    alerts = find_triggered_alerts(cursor, prices, instrument_ids, dialect)
+    if not alerts:
+        return []
+
+    cursor.executemany(
+        _sql("UPDATE price_alerts SET triggered = {true}, triggered_date = ? WHERE id = ? AND triggered = {false}", dialect),
+        [(triggered_at, alert["id"]) for alert in alerts])
+    cursor.executemany(
+        _sql("INSERT OR IGNORE INTO notification_outbox "
+             "(user_id, alert_id, channel, payload, dedupe_key, status, attempts, next_attempt_at) "
+             "VALUES (?, ?, ?, ?, ?, 'pending', 0, ?)", dialect),
+        [(alert["user_id"], alert["id"], channel,
+          json.dumps({"symbol": alert["symbol"], "name": alert["name"], "condition": alert["condition"],
+                      "target_price": alert["target_price"], "price": alert["price"],
+                      "triggered_at": triggered_at}, ensure_ascii=False),
+          f"alert:{alert['id']}:{channel}", triggered_at)
+         for alert in alerts for channel in channels])
+    conn.commit()
+    return alerts
+
+# ===== TRANSPORTS =====
+
+def _alert_line(n):
+    arrow = "≥" if n["condition"] == "above" else "≤"
+    return f"{n['name']} ({n['symbol']}): {n['price']:.2f} MAD {arrow} {n['target_price']:.2f} MAD"
+
+class SmtpTransport:
+    """One e-mail per user and batch, listing every triggered alert"""
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, sender=SMTP_SENDER):
+        self.host, self.port, self.sender = host, port, sender
+
+    def send(self, recipient, notifications):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = recipient["email"]
+        message["Subject"] = f"MaFinance: {len(notifications)} price alert(s) triggered"
+        message.set_content("\n".join(_alert_line(n) for n in notifications))
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+class WebhookTransport:
+    """POST one JSON document per user and batch"""
+
+    def __init__(self, url=WEBHOOK_URL):
+        self.url = url
+
+    def send(self, recipient, notifications):
+        body = json.dumps({"user_id": recipient["id"], "email": recipient["email"],
+                           "notifications": notifications}).encode()
+        request = urllib.request.Request(self.url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+def default_transports():
+    return {"email": SmtpTransport(), "webhook": WebhookTransport()}
+
+# ===== DISPATCHER =====
+
+class Dispatcher:
+    """Claim due notifications, send them grouped by (user, channel), retry failures with backoff"""
+
+    def __init__(self, connect, transports, dialect="sqlite", workers=4, batch_size=CLAIM_BATCH, logger=print):
+        self.connect = connect
+        self.transports = transports
+        self.dialect = dialect
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.logger = logger
+
+    def claim(self, conn):
+        """Atomically move a batch of due notifications to 'sending' and return them"""
+        now = _now()
+        cursor = conn.cursor()
+        lease = (datetime.now() - timedelta(seconds=LEASE_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute(_sql("UPDATE notification_outbox SET status = 'pending' "
+                            "WHERE status = 'sending' AND locked_at < ?", self.dialect), (lease,))
+        lock = " FOR UPDATE SKIP LOCKED" if self.dialect == "postgres" else ""
+        cursor.execute(_sql(
+            "UPDATE notification_outbox SET status = 'sending', locked_at = ? WHERE id IN ("
+            "SELECT id FROM notification_outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+            f"ORDER BY next_attempt_at LIMIT ?{lock}) "
+            "RETURNING id, user_id, channel, payload, attempts", self.dialect),
+            (now, now, self.batch_size))
+        claimed = [_row(r) for r in cursor.fetchall()]
+        conn.commit()
+        return claimed
+
+    def _recipients(self, cursor, user_ids):
+        ids = sorted(user_ids)
+        cursor.execute(_sql(f"SELECT id, email, full_name FROM users WHERE id IN ({', '.join('?' * len(ids))})",
+                            self.dialect), ids)
+        return {r["id"]: r for r in map(_row, cursor.fetchall())}
+
+    def _send_group(self, recipient, channel, rows):
+        transport = self.transports.get(channel)
+        if transport is None:
+            raise ValueError(f"no transport for channel {channel!r}")
+        transport.send(recipient, [json.loads(r["payload"]) for r in rows])
+
+    def run_once(self):
+        """Dispatch one claimed batch; returns (sent, retried, failed)"""
+        conn = self.connect()
+        try:
+            claimed = self.claim(conn)
+            if not claimed:
+                return 0, 0, 0
+            cursor = conn.cursor()
+            recipients = self._recipients(cursor, {r["user_id"] for r in claimed})
+
+            groups = defaultdict(list)
+            for row in claimed:
+                groups[(row["user_id"], row["channel"])].append(row)
+            futures = {
+                key: self.pool.submit(self._send_group, recipients.get(key[0]), key[1], rows)
+                for key, rows in groups.items()
+            }
+
+            now = datetime.now()
+            sent, retry, failed = [], [], []
+            for key, future in futures.items():
+                error = future.exception()
+                for row in groups[key]:
+                    if error is None and recipients.get(key[0]):
+                        sent.append((now.strftime("%Y-%m-%d %H:%M:%S"), row["id"]))
+                        continue
+                    attempts = row["attempts"] + 1
+                    message = str(error or "unknown user")[:500]
+                    if attempts >= MAX_ATTEMPTS:
+                        failed.append((attempts, message, row["id"]))
+                    else:
+                        delay = min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+                        retry.append((attempts, message, (now + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S"), row["id"]))
+
+            cursor.executemany(_sql("UPDATE notification_outbox SET status = 'sent', sent_at = ? WHERE id = ?",
+                                    self.dialect), sent)
+            cursor.executemany(_sql("UPDATE notification_outbox SET status = 'pending', attempts = ?, last_error = ?, "
+                                    "next_attempt_at = ? WHERE id = ?", self.dialect), retry)
+            cursor.executemany(_sql("UPDATE notification_outbox SET status = 'failed', attempts = ?, last_error = ? "
+                                    "WHERE id = ?", self.dialect), failed)
+            conn.commit()
+            if retry or failed:
+                self.logger(f"[ERROR] Notifications: {len(retry)} to retry, {len(failed)} failed permanently")
+            return len(sent), len(retry), len(failed)
+        finally:
+            conn.close()
+
+    def run_forever(self, poll_interval=2.0, stop=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                sent, retried, failed = self.run_once()
+            except Exception as e:
+                self.logger(f"[ERROR] Notification dispatch failed: {e}")
+                sent = 0
+            if sent < self.batch_size:
+                stop.wait(poll_interval)
+
+# ===== BANC D'ESSAI LOCAL =====
+
+class WebhookSink(BaseHTTPRequestHandler):
+    """Local webhook stand-in that counts received notifications"""
+    received = 0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with WebhookSink.lock:
+            WebhookSink.requests += 1
+            WebhookSink.received += len(body["notifications"])
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def serve_webhook_sink(port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), WebhookSink)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/notifications"
+
+def run_benchmark(alert_count, users, workers):
+    import init_db
+    from instruments import InstrumentRegistry
+
+    with tempfile.TemporaryDirectory() as scratch:
+        init_db.DATABASE_PATH = os.path.join(scratch, "bench.db")
+        init_db.init_database()
+
+        def connect():
+            conn = sqlite3.connect(init_db.DATABASE_PATH, timeout=30)
+            conn.row_factory = sqlite3.Row
+            return conn
+
+        conn = connect()
+        conn.executemany("INSERT INTO users (email, password_hash, full_name) VALUES (?, 'x', ?)",
+                         [(f"user{i}@example.com", f"User {i}") for i in range(users)])
+        symbols = [f"SYM{i:03d}" for i in range(80)]
+        instrument_ids = InstrumentRegistry().ensure(conn, [(s, s) for s in symbols])
+        conn.executemany(
+            "INSERT INTO price_alerts (user_id, symbol, instrument_id, name, target_price, condition) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(1 + i % users, symbols[i % 80], instrument_ids[symbols[i % 80]], symbols[i % 80], 90 + i % 20,
+              "above" if i % 2 else "below")
+             for i in range(alert_count)])
+        conn.commit()
+
+        # Ingestion: tous les prix bougent, environ la moitié des alertes se déclenchent
+        prices = {s: 100.0 for s in symbols}
+        started = time.perf_counter()
+        triggered = enqueue_alert_notifications(conn, prices, instrument_ids, "sqlite", channels=["webhook"])
+        ingest = time.perf_counter() - started
+        print(f"[INFO] Ingestion: {len(triggered)} alerts triggered and queued in {ingest * 1e3:.0f} ms")
+        again = enqueue_alert_notifications(conn, prices, instrument_ids, "sqlite", channels=["webhook"])
+        print(f"[INFO] Same snapshot again: {len(again)} new triggers (deduplicated)")
+        conn.close()
+
+        server, url = serve_webhook_sink()
+        dispatcher = Dispatcher(connect, {"webhook": WebhookTransport(url)}, "sqlite", workers=workers)
+        started = time.perf_counter()
+        total = 0
+        while True:
+            sent, _, _ = dispatcher.run_once()
+            if not sent:
+                break
+            total += sent
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+        print(f"[INFO] Dispatched {total} notifications in {WebhookSink.requests} batched requests "
+              f"({total / elapsed:.0f}/s, {workers} workers)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Alert notification dispatcher")
+    parser.add_argument("--worker", action="store_true", help="Run the dispatcher until interrupted")
+    parser.add_argument("--workers", type=int, default=4, help="Sending threads")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--alerts", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.alerts, args.users, args.workers)
+    elif args.worker:
+        from init_db import get_db_connection, IS_PRODUCTION
+
+        print(f"[INFO] Notification dispatcher started ({args.workers} workers, channels: {', '.join(CHANNELS)})")
+        Dispatcher(get_db_connection, default_transports(), "postgres" if IS_PRODUCTION else "sqlite",
+                   workers=args.workers).run_forever()
+    else:
+        parser.print_help()
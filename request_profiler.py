@@ -0,0 +1,193 @@
+"""
+Profilage des requêtes à la demande et journal des requêtes lentes.
+
+- Profil d'une requête: en-tête X-Profile (cprofile ou sample) accompagné de
+  X-Profile-Token égal à PROFILE_TOKEN, ou tirage aléatoire avec
+  PROFILE_SAMPLE_RATE (0 par défaut). cProfile écrit un fichier .prof
+  (python -m pstats, snakeviz); l'échantillonneur relève la pile du thread
+  de la requête toutes les PROFILE_INTERVAL_MS et écrit des piles repliées
+  (.folded, pour flamegraph.pl / speedscope). Les PROFILE_KEEP fichiers les
+  plus récents sont conservés dans PROFILE_DIR.
+- Journal des requêtes lentes, toujours actif: route, durée, temps passé en
+  base et état du cache au-delà de SLOW_REQUEST_MS.
+
+Le temps base de données est mesuré par les curseurs des connexions
+(TimedSQLiteConnection, timed_cursor_class), par thread.
+"""
+import cProfile
+import hmac
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("logs", "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+PROFILE_MODES = ("cprofile", "sample")
+
+# ===== TEMPS PASSÉ EN BASE =====
+
+_db = threading.local()
+
+def reset_db_time():
+    _db.seconds = 0.0
+    _db.queries = 0
+
+def db_time():
+    """(seconds, statements) spent in the database by this thread since reset_db_time()"""
+    return getattr(_db, "seconds", 0.0), getattr(_db, "queries", 0)
+
+def _timed_call(method, counts=False):
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _db.seconds = getattr(_db, "seconds", 0.0) + time.perf_counter() - started
+            if counts:
+                _db.queries = getattr(_db, "queries", 0) + 1
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+def timed_cursor_class(base):
+    """Subclass of a DB-API cursor class whose execute/fetch time is added to db_time()"""
+    return type(f"Timed{base.__name__}", (base,), {
+        "execute": _timed_call(base.execute, counts=True),
+        "executemany": _timed_call(base.executemany, counts=True),
+        "fetchone": _timed_call(base.fetchone),
+        "fetchmany": _timed_call(base.fetchmany),
+        "fetchall": _timed_call(base.fetchall),
+    })
+
+TimedSQLiteCursor = timed_cursor_class(sqlite3.Cursor)
+
+class TimedSQLiteConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors (including conn.execute) are timed"""
+
+    def cursor(self, factory=TimedSQLiteCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+# ===== PROFILS =====
+
+class SamplingProfiler:
+    """Sample one thread's stack every `interval` seconds into folded stack counts"""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="request-sampler", daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+def _prune(directory, keep):
+    files = sorted((os.path.join(directory, f) for f in os.listdir(directory)), key=os.path.getmtime)
+    for path in files[:-keep] if keep else files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class RequestProfiler:
+    """Per-request profiling decision, profile files and the slow-request log"""
+
+    def __init__(self, logger, directory=PROFILE_DIR, token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE,
+                 slow_ms=SLOW_REQUEST_MS, keep=PROFILE_KEEP):
+        self.logger = logger
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.keep = keep
+        self.lock = threading.Lock()
+
+    def requested_mode(self, headers):
+        """Profiling mode for a request, or None"""
+        mode = headers.get("X-Profile", "").lower()
+        if mode:
+            if mode not in PROFILE_MODES:
+                mode = "cprofile"
+            supplied = headers.get("X-Profile-Token", "")
+            if self.token and hmac.compare_digest(supplied, self.token):
+                return mode
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    def start(self, mode):
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                return mode, profiler
+            except ValueError:  # un autre profil cProfile tourne déjà dans ce processus
+                mode = "sample"
+        profiler = SamplingProfiler(threading.get_ident())
+        profiler.start()
+        return mode, profiler
+
+    def finish(self, handle, endpoint, duration_ms):
+        """Stop a profile and write it; returns the file name"""
+        mode, profiler = handle
+        if mode == "cprofile":
+            profiler.disable()
+        else:
+            profiler.stop()
+
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        name = f"{stamp}_{endpoint or 'unknown'}_{duration_ms:.0f}ms.{'prof' if mode == 'cprofile' else 'folded'}"
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, name)
+            if mode == "cprofile":
+                profiler.dump_stats(path)
+            else:
+                profiler.dump(path)
+            _prune(self.directory, self.keep)
+        return name
+
+    def record(self, method, path, endpoint, status, duration_ms, db_seconds, queries, cache_state):
+        """Log the request if it is slower than the threshold"""
+        if duration_ms < self.slow_ms:
+            return False
+        self.logger.warning(
+            f"Slow request: {method} {path} endpoint={endpoint} status={status} duration={duration_ms:.0f}ms "
+            f"db={db_seconds * 1e3:.0f}ms/{queries} queries cache={cache_state}")
+        return True
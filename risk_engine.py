@@ -0,0 +1,237 @@
+"""
+Moteur de risque incrémental pour les portefeuilles.
+
+Les rendements de tout l'univers (plus un proxy de marché pondéré par les
+capitalisations) alimentent une moyenne et une matrice de co-moments mises à
+jour à chaque snapshot (algorithme de Welford multivarié, O(N²) par snapshot
+au lieu de O(T·N²) pour tout recalculer). Le risque d'un portefeuille se lit
+ensuite sur une tranche de la matrice de covariance en cache.
+
+Un symbole qui apparaît en cours de route est considéré comme ayant eu des
+rendements nuls avant son entrée dans l'univers.
+
+Au démarrage de l'application, seuls les WARMUP_DAYS derniers jours de
+price_history sont rejoués; le mode batch rejoue tout l'historique.
+
+Mode batch (après la clôture), recalcul complet depuis price_history:
+    python risk_engine.py --batch
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from snapshot_changes import load_history_frames
+
+MARKET = "__MARKET__"
+
+# Nombre minimal d'observations avant de publier des statistiques
+MIN_OBSERVATIONS = 2
+WARMUP_DAYS = int(os.getenv("RISK_WARMUP_DAYS", "20"))
+
+class RiskEngine:
+    """Running mean / covariance of per-snapshot returns for the whole universe"""
+
+    def __init__(self):
+        # Index 0 = proxy de marché, puis les symboles dans l'ordre d'apparition
+        self.symbols = [MARKET]
+        self.index = {MARKET: 0}
+        self.observations = 0
+        self.mean = np.zeros(1)
+        self.comoment = np.zeros((1, 1))
+        self.last_prices = None
+        self.last_caps = None
+        self.last_timestamp = None
+        self._covariance = None
+
+    def _ensure_symbols(self, symbols):
+        new = [s for s in dict.fromkeys(symbols) if s not in self.index]
+        if not new:
+            return
+        for symbol in new:
+            self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        size = len(self.symbols)
+        grow = size - len(self.mean)
+        self.mean = np.concatenate([self.mean, np.zeros(grow)])
+        self.comoment = np.pad(self.comoment, ((0, grow), (0, grow)))
+        if self.last_prices is not None:
+            self.last_prices = np.concatenate([self.last_prices, np.full(grow, np.nan)])
+            self.last_caps = np.concatenate([self.last_caps, np.full(grow, np.nan)])
+
+    def _align(self, symbols, values):
+        aligned = np.full(len(self.symbols), np.nan)
+        aligned[[self.index[s] for s in symbols]] = np.asarray(values, dtype=np.float64)
+        return aligned
+
+    def update(self, symbols, prices, market_caps, timestamp=None):
+        """Feed one snapshot; returns False if it is not newer than the last one"""
+        if timestamp is not None and self.last_timestamp is not None and str(timestamp) <= str(self.last_timestamp):
+            return False
+
+        self._ensure_symbols(symbols)
+        prices = self._align(symbols, prices)
+        caps = self._align(symbols, market_caps)
+
+        if self.last_prices is not None:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                returns = prices / self.last_prices - 1
+            returns[~np.isfinite(returns)] = 0.0
+
+            # Proxy de marché: rendement pondéré par les capitalisations du snapshot précédent
+            weights = np.nan_to_num(self.last_caps)
+            weights[0] = 0.0
+            total = weights.sum()
+            returns[0] = float(weights @ returns / total) if total > 0 else 0.0
+
+            # Welford multivarié
+            self.observations += 1
+            delta = returns - self.mean
+            self.mean += delta / self.observations
+            self.comoment += np.outer(delta, returns - self.mean)
+            self._covariance = None
+
+        self.last_prices = np.where(np.isfinite(prices), prices, self.last_prices if self.last_prices is not None else np.nan)
+        self.last_caps = np.where(np.isfinite(caps), caps, self.last_caps if self.last_caps is not None else np.nan)
+        self.last_timestamp = timestamp
+        return True
+
+    def update_from_snapshot(self, snapshot):
+        """Snapshot listener entry point (see snapshot_changes.register_snapshot_listener)"""
+        return self.update(snapshot["symbols"], snapshot["price"], snapshot["market_cap"], snapshot["timestamp"])
+
+    @property
+    def covariance(self):
+        """Sample covariance matrix, cached until the next update"""
+        if self._covariance is None:
+            denominator = max(self.observations - 1, 1)
+            self._covariance = self.comoment / denominator
+        return self._covariance
+
+    def portfolio_risk(self, holdings):
+        """
+        Risk of a portfolio given {symbol: market value}.
+
+        Returns per-observation volatility and beta of the portfolio, with each
+        holding's weight, volatility, beta and contribution to risk, plus the
+        correlation matrix between holdings. Returns None without enough history.
+        """
+        if self.observations < MIN_OBSERVATIONS:
+            return None
+
+        symbols = [s for s, value in holdings.items() if s in self.index and value and value > 0]
+        if not symbols:
+            return None
+
+        values = np.array([holdings[s] for s in symbols], dtype=np.float64)
+        weights = values / values.sum()
+        idx = [self.index[s] for s in symbols]
+
+        cov = self.covariance
+        sub = cov[np.ix_(idx, idx)]
+        market_var = cov[0, 0]
+        betas = cov[idx, 0] / market_var if market_var > 0 else np.full(len(idx), np.nan)
+        vols = np.sqrt(np.diag(sub))
+
+        variance = float(weights @ sub @ weights)
+        volatility = float(np.sqrt(max(variance, 0.0)))
+        marginal = sub @ weights
+        contributions = weights * marginal / volatility if volatility > 0 else np.zeros(len(idx))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = sub / np.outer(vols, vols)
+
+        def _num(value):
+            return round(float(value), 6) if np.isfinite(value) else None
+
+        return {
+            "observations": self.observations,
+            "volatility": _num(volatility),
+            "beta": _num(weights @ betas) if market_var > 0 else None,
+            "market_volatility": _num(np.sqrt(market_var)),
+            "holdings": [
+                {
+                    "symbol": symbol,
+                    "weight": _num(weights[k]),
+                    "volatility": _num(vols[k]),
+                    "beta": _num(betas[k]),
+                    "risk_contribution": _num(contributions[k]),
+                    "risk_contribution_pct": _num(contributions[k] / volatility) if volatility > 0 else None,
+                }
+                for k, symbol in enumerate(symbols)
+            ],
+            "correlation": {
+                "symbols": symbols,
+                "matrix": [[_num(v) for v in row] for row in correlation],
+            },
+        }
+
+    @classmethod
+    def from_history(cls, conn, since=None, placeholder="?"):
+        """Rebuild an engine from the stored price history, from `since` on (default: all of it)"""
+        engine = cls()
+        history = load_history_frames(conn, ["price", "market_cap"], since, placeholder)
+        if history is None:
+            return engine
+
+        times, symbols, frames = history
+        for timestamp, price_row, cap_row in zip(times, frames["price"], frames["market_cap"]):
+            engine.update(symbols, price_row, cap_row, timestamp)
+        return engine
+
+def warmup_start(days=WARMUP_DAYS):
+    """First day replayed by the application at start-up"""
+    return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+def holdings_market_values(rows, prices):
+    """Aggregate portfolio rows into {symbol: market value} using current prices"""
+    values = {}
+    for row in rows:
+        price = prices.get(row["symbol"]) or row["buy_price"]
+        values[row["symbol"]] = values.get(row["symbol"], 0.0) + float(row["shares"]) * float(price)
+    return values
+
+def recompute_all_portfolios(conn, engine, placeholder="?"):
+    """Batch: compute and store the risk of every user's portfolio"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, symbol, shares, buy_price FROM portfolios ORDER BY user_id")
+    rows = [dict(r) for r in cursor.fetchall()]
+
+    prices = {}
+    if engine.last_prices is not None:
+        prices = {s: float(p) for s, p in zip(engine.symbols, engine.last_prices) if np.isfinite(p)}
+
+    by_user = {}
+    for row in rows:
+        by_user.setdefault(row["user_id"], []).append(row)
+
+    computed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for user_id, user_rows in by_user.items():
+        risk = engine.portfolio_risk(holdings_market_values(user_rows, prices))
+        cursor.execute(f"DELETE FROM portfolio_risk WHERE user_id = {placeholder}", (user_id,))
+        cursor.execute(
+            f"INSERT INTO portfolio_risk (user_id, computed_at, volatility, beta, payload) "
+            f"VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})",
+            (user_id, computed_at, risk and risk["volatility"], risk and risk["beta"], json.dumps(risk))
+        )
+    conn.commit()
+    return len(by_user)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Portfolio risk engine")
+    parser.add_argument("--batch", action="store_true", help="Recompute risk for all users from price_history")
+    args = parser.parse_args()
+
+    from init_db import get_db_connection, IS_PRODUCTION
+
+    conn = get_db_connection()
+    started = datetime.now()
+    engine = RiskEngine.from_history(conn)
+    print(f"[INFO] Risk engine rebuilt: {len(engine.symbols) - 1} symbols, {engine.observations} observations")
+    if args.batch:
+        count = recompute_all_portfolios(conn, engine, "%s" if IS_PRODUCTION else "?")
+        print(f"[SUCCESS] Portfolio risk recomputed for {count} users in {(datetime.now() - started).total_seconds():.1f}s")
+    conn.close()
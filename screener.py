@@ -0,0 +1,143 @@
+"""
+Screener côté serveur sur le snapshot courant.
+
+Les champs numériques du snapshot sont rangés dans des tableaux NumPy; les
+filtres deviennent des masques booléens et les tris utilisent des index
+argsort précalculés une seule fois par snapshot. Une requête ne coûte alors
+qu'un masque et une page de résultats.
+"""
+import numpy as np
+
+# Indicateurs de microstructure (voir microstructure.py) lus dans stock["metrics"]
+METRIC_FIELDS = ("spread_bps", "imbalance", "avg_trade_size", "vwap")
+NUMERIC_FIELDS = ("price", "change", "abs_change", "volume", "market_cap") + METRIC_FIELDS
+TEXT_FIELDS = ("name", "symbol")
+SORTABLE_FIELDS = NUMERIC_FIELDS + TEXT_FIELDS
+
+# Paramètres min_/max_ acceptés -> champ numérique filtré
+RANGE_FILTERS = {
+    "price": "price",
+    "change": "change",
+    "volume": "volume",
+    "market_cap": "market_cap",
+    "spread_bps": "spread_bps",
+    "imbalance": "imbalance",
+    "avg_trade_size": "avg_trade_size",
+    "vwap": "vwap",
+}
+
+DEFAULT_SORT = "change"
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+def _float_or_nan(value):
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+def _nan_last_order(values, descending):
+    """argsort with NaN always at the end, in either direction"""
+    keys = -values if descending else values
+    return np.argsort(np.where(np.isnan(keys), np.inf, keys), kind="stable")
+
+class ScreenerIndex:
+    """Column arrays and precomputed sort orders for one snapshot"""
+
+    def __init__(self, stocks):
+        self.stocks = stocks
+        self.columns = {
+            "price": np.array([_float_or_nan(s.get("price")) for s in stocks], dtype=np.float64),
+            "change": np.array([_float_or_nan(s.get("change")) for s in stocks], dtype=np.float64),
+            "volume": np.array([_float_or_nan(s.get("volume")) for s in stocks], dtype=np.float64),
+            "market_cap": np.array([_float_or_nan(s.get("marketCapValue")) for s in stocks], dtype=np.float64),
+            "sector": np.array([(s.get("sector") or "").lower() for s in stocks], dtype=object),
+            "status": np.array([(s.get("details", {}).get("statut") or "").upper() for s in stocks], dtype=object),
+            "name": np.array([(s.get("name") or "").lower() for s in stocks], dtype=object),
+            "symbol": np.array([(s.get("symbol") or "").lower() for s in stocks], dtype=object),
+        }
+        self.columns["abs_change"] = np.abs(self.columns["change"])
+        for field in METRIC_FIELDS:
+            self.columns[field] = np.array(
+                [_float_or_nan((s.get("metrics") or {}).get(field)) for s in stocks], dtype=np.float64)
+
+        self.orders = {}
+        for field in NUMERIC_FIELDS:
+            self.orders[(field, "asc")] = _nan_last_order(self.columns[field], False)
+            self.orders[(field, "desc")] = _nan_last_order(self.columns[field], True)
+        for field in TEXT_FIELDS:
+            ascending = np.argsort(self.columns[field], kind="stable")
+            self.orders[(field, "asc")] = ascending
+            self.orders[(field, "desc")] = ascending[::-1]
+
+    def mask(self, filters):
+        """Boolean mask of the stocks matching every filter"""
+        mask = np.ones(len(self.stocks), dtype=bool)
+        for field, (low, high) in filters.get("ranges", {}).items():
+            values = self.columns[field]
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        if filters.get("sectors"):
+            mask &= np.isin(self.columns["sector"], filters["sectors"])
+        if filters.get("status"):
+            mask &= np.isin(self.columns["status"], filters["status"])
+        return mask
+
+    def screen(self, filters, sort=DEFAULT_SORT, order="desc", page=1, limit=DEFAULT_LIMIT):
+        """Return (stocks of the requested page, total number of matches)"""
+        mask = self.mask(filters)
+        ordered = self.orders[(sort, order)]
+        matching = ordered[mask[ordered]]
+        start = (page - 1) * limit
+        return [self.stocks[i] for i in matching[start:start + limit]], int(len(matching))
+
+def parse_screen_params(args):
+    """
+    Validate query-string parameters of /api/screen.
+
+    Returns (filters, sort, order, page, limit); raises ValueError with a
+    user-facing message on invalid input.
+    """
+    ranges = {}
+    for param, field in RANGE_FILTERS.items():
+        bounds = []
+        for prefix in ("min_", "max_"):
+            raw = args.get(prefix + param)
+            if raw in (None, ""):
+                bounds.append(None)
+                continue
+            try:
+                bounds.append(float(raw))
+            except ValueError:
+                raise ValueError(f"{prefix}{param} must be a number")
+        if bounds != [None, None]:
+            ranges[field] = tuple(bounds)
+
+    def _list(name, transform):
+        raw = args.get(name, "")
+        return [transform(v.strip()) for v in raw.split(",") if v.strip()]
+
+    filters = {
+        "ranges": ranges,
+        "sectors": _list("sectors", str.lower),
+        "status": _list("status", str.upper),
+    }
+
+    sort = args.get("sort", DEFAULT_SORT)
+    if sort not in SORTABLE_FIELDS:
+        raise ValueError(f"sort must be one of: {', '.join(SORTABLE_FIELDS)}")
+    order = args.get("order", "asc" if sort in TEXT_FIELDS else "desc")
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be 'asc' or 'desc'")
+
+    try:
+        page = int(args.get("page", 1))
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("page and limit must be integers")
+    if page < 1 or limit < 1:
+        raise ValueError("page and limit must be positive")
+
+    return filters, sort, order, page, min(limit, MAX_LIMIT)
@@ -0,0 +1,178 @@
+"""
+Index de recherche (typeahead) sur les symboles et noms d'instruments.
+
+Les textes sont normalisés (accents, casse, ponctuation), puis indexés de deux
+façons: une liste triée de clés pour les recherches par préfixe (bisect) et
+des listes de postings par trigramme (tableaux NumPy) pour les recherches
+approximatives. L'index n'est reconstruit que si l'ensemble des instruments
+change.
+
+Benchmark:
+    python search_index.py --size 100000
+"""
+import argparse
+import bisect
+import random
+import re
+import time
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+# Scores par type de correspondance (le plus fort l'emporte)
+SCORE_EXACT_SYMBOL = 100
+SCORE_EXACT_NAME = 95
+SCORE_SYMBOL_PREFIX = 80
+SCORE_NAME_PREFIX = 70
+SCORE_WORD_PREFIX = 60
+SCORE_SUBSTRING = 50
+SCORE_TRIGRAM = 40  # multiplié par la part de trigrammes communs
+
+MIN_TRIGRAM_SIMILARITY = 0.5
+CANDIDATES_PER_LIMIT = 3  # candidats examinés par résultat demandé, pour chaque type de clé
+DEFAULT_LIMIT = 10
+
+def fold(text):
+    """Accent- and case-fold text, keeping only alphanumerics separated by single spaces"""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(" ", stripped.casefold()).strip()
+
+def trigrams(folded):
+    padded = f"  {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    """Prefix + trigram index over (symbol, name) entries"""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.symbols = [fold(symbol) for symbol, _ in self.entries]
+        self.names = [fold(name) for _, name in self.entries]
+
+        # Clés triées par type (symbole, nom complet, mot du nom) pour les préfixes
+        self.prefix_keys = {}
+        for kind, keys in (
+            ("symbol", [(s, i) for i, s in enumerate(self.symbols) if s]),
+            ("name", [(n, i) for i, n in enumerate(self.names) if n]),
+            ("word", [(w, i) for i, n in enumerate(self.names) for w in set(n.split()[1:])]),
+        ):
+            keys.sort()
+            self.prefix_keys[kind] = ([k for k, _ in keys], [i for _, i in keys])
+
+        postings = defaultdict(list)
+        for i, (symbol, name) in enumerate(zip(self.symbols, self.names)):
+            for gram in trigrams(symbol) | trigrams(name):
+                postings[gram].append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def _prefix_candidates(self, query, per_kind):
+        candidates = set()
+        for keys, ids in self.prefix_keys.values():
+            lo = bisect.bisect_left(keys, query)
+            hi = bisect.bisect_left(keys, query + "\uffff", lo)
+            candidates.update(ids[lo:min(hi, lo + per_kind)])
+        return candidates
+
+    def _trigram_candidates(self, query, top):
+        grams = trigrams(query)
+        lists = [self.postings[g] for g in grams if g in self.postings]
+        if not lists:
+            return [], []
+        # bincount est linéaire (pas de tri), même pour des trigrammes très fréquents
+        counts = np.bincount(np.concatenate(lists), minlength=len(self.entries))
+        ids = np.flatnonzero(counts >= MIN_TRIGRAM_SIMILARITY * len(grams))
+        if len(ids) > top:
+            ids = ids[np.argpartition(-counts[ids], top)[:top]]
+        return ids.tolist(), (counts[ids] / len(grams)).tolist()
+
+    def _score(self, i, query, similarity):
+        symbol, name = self.symbols[i], self.names[i]
+        if symbol == query:
+            return SCORE_EXACT_SYMBOL
+        if name == query:
+            return SCORE_EXACT_NAME
+        if symbol.startswith(query):
+            return SCORE_SYMBOL_PREFIX
+        if name.startswith(query):
+            return SCORE_NAME_PREFIX
+        if any(word.startswith(query) for word in name.split()):
+            return SCORE_WORD_PREFIX
+        if query in name or query in symbol:
+            return SCORE_SUBSTRING
+        return SCORE_TRIGRAM * similarity
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Return up to `limit` (symbol, name, score) tuples, best first"""
+        query = fold(query)
+        if not query:
+            return []
+
+        per_kind = limit * CANDIDATES_PER_LIMIT
+        similarities = dict.fromkeys(self._prefix_candidates(query, per_kind), 0.0)
+        if len(query) >= 3 and len(similarities) < limit:
+            # Pas assez de préfixes: correspondances approximatives par trigrammes
+            for i, sim in zip(*self._trigram_candidates(query, per_kind)):
+                similarities[i] = max(similarities.get(i, 0.0), sim)
+
+        scored = [(self._score(i, query, sim), i) for i, sim in similarities.items()]
+        # Meilleur score, puis nom le plus court, puis ordre alphabétique
+        scored.sort(key=lambda item: (-item[0], len(self.names[item[1]]), self.names[item[1]]))
+        return [(self.entries[i][0], self.entries[i][1], round(score, 1)) for score, i in scored[:limit]]
+
+class SearchIndexCache:
+    """Keep one SearchIndex and rebuild it only when the instrument set changes"""
+
+    def __init__(self):
+        self._key = None
+        self._index = None
+
+    def get(self, entries):
+        entries = tuple(entries)
+        key = hash(frozenset(entries))
+        if self._index is None or key != self._key:
+            self._index = SearchIndex(entries)
+            self._key = key
+        return self._index
+
+# ===== BENCHMARK =====
+
+_WORDS = [
+    "attijariwafa", "bank", "société", "générale", "maroc", "marsa", "ciments", "holding", "immobilière",
+    "assurance", "énergie", "télécom", "crédit", "industrie", "pharma", "agro", "foncière", "capital",
+    "développement", "transport", "minière", "boissons", "leasing", "finance", "distribution", "béton",
+]
+
+def _synthetic_entries(size, seed=42):
+    rng = random.Random(seed)
+    entries = []
+    for i in range(size):
+        name = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(2, 4))).upper()
+        entries.append((f"{name[:3]}{i:05d}".replace(" ", ""), f"{name} {i}"))
+    return entries
+
+def run_benchmark(size, queries=("ATT", "societe gen", "ciment", "MARSA MAR", "telecom", "xyz", "b", "attijariwafa bnk")):
+    entries = _synthetic_entries(size)
+    started = time.perf_counter()
+    index = SearchIndex(entries)
+    print(f"[INFO] Built index over {size} instruments in {time.perf_counter() - started:.2f}s")
+
+    for query in queries:
+        timings = []
+        for _ in range(200):
+            t0 = time.perf_counter()
+            results = index.search(query)
+            timings.append(time.perf_counter() - t0)
+        timings.sort()
+        print(f"{query!r:>22}: p50 {timings[100] * 1e3:.3f}ms  p99 {timings[197] * 1e3:.3f}ms  "
+              f"top: {results[0][1] if results else '-'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the instrument search index")
+    parser.add_argument("--size", type=int, default=100000)
+    args = parser.parse_args()
+    run_benchmark(args.size)
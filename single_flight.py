@@ -0,0 +1,128 @@
+"""
+Reconstruction d'un cache en un seul exemplaire (single-flight).
+
+Quand le snapshot en cache expire, une seule reconstruction tourne à la
+fois: en arrière-plan tant que l'ancienne valeur reste servable
+(stale-while-revalidate), au premier plan au-delà du plafond de péremption,
+les autres requêtes attendant alors la même reconstruction au lieu d'en
+lancer une chacune. La durée de fraîcheur est tirée avec un peu de gigue
+pour que les workers ne rechargent pas tous à la même seconde.
+
+Benchmark (rafale de requêtes à l'expiration, chargement simulé de 200 ms):
+    python single_flight.py --clients 32
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+
+class SingleFlight:
+    """At most one execution of a rebuild at a time; concurrent callers share it"""
+
+    def __init__(self, logger=None):
+        self.lock = threading.Lock()
+        self.current = None
+        self.logger = logger
+        self.runs = 0
+
+    @property
+    def in_flight(self):
+        return self.current is not None
+
+    def _begin(self):
+        with self.lock:
+            if self.current is not None:
+                return self.current, False
+            self.current = threading.Event()
+            return self.current, True
+
+    def _execute(self, rebuild, done):
+        try:
+            self.runs += 1
+            rebuild()
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Cache rebuild failed: {e}")
+        finally:
+            with self.lock:
+                self.current = None
+            done.set()
+
+    def run(self, rebuild, timeout=None):
+        """Rebuild now, or wait for the rebuild already in flight"""
+        done, leader = self._begin()
+        if leader:
+            self._execute(rebuild, done)
+        else:
+            done.wait(timeout)
+
+    def rerun(self, rebuild, timeout=None):
+        """Rebuild from inputs at least as new as this call: never joins a rebuild started before it"""
+        with self.lock:
+            current = self.current
+        if current is not None:
+            current.wait(timeout)
+        self.run(rebuild, timeout)
+
+    def start(self, rebuild):
+        """Rebuild in a background thread unless one is already running; returns True if started"""
+        done, leader = self._begin()
+        if leader:
+            threading.Thread(target=self._execute, args=(rebuild, done), name="cache-rebuild", daemon=True).start()
+        return leader
+
+def jittered(seconds, jitter):
+    """Freshness lifetime in [seconds * (1 - jitter), seconds]"""
+    return seconds * (1 - random.uniform(0, jitter))
+
+def cache_state(age, fresh_for, max_staleness):
+    """'fresh', 'stale' (serve and refresh in background) or 'expired' (refresh before serving)"""
+    if age < fresh_for:
+        return "fresh"
+    return "stale" if age < max_staleness else "expired"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency of a request burst at cache expiry")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--load-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    def simulate(stale_while_revalidate):
+        cache = {"value": 0, "loaded": time.monotonic() - 61}
+        builds = []
+
+        def rebuild():
+            time.sleep(args.load_ms / 1000)
+            builds.append(1)
+            cache.update(value=cache["value"] + 1, loaded=time.monotonic())
+
+        flight = SingleFlight()
+        latencies = []
+        barrier = threading.Barrier(args.clients)
+
+        def client():
+            barrier.wait()
+            started = time.perf_counter()
+            if time.monotonic() - cache["loaded"] >= 60:
+                if stale_while_revalidate:
+                    flight.start(rebuild)
+                else:
+                    rebuild()  # comportement actuel: chaque requête recharge
+            latencies.append((time.perf_counter() - started) * 1e3)
+
+        threads = [threading.Thread(target=client) for _ in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        while flight.in_flight:
+            time.sleep(0.01)
+        return latencies, len(builds)
+
+    for label, swr in (("rebuild per request", False), ("stale-while-revalidate", True)):
+        latencies, builds = simulate(swr)
+        latencies.sort()
+        print(f"[INFO] {label:>22}: {builds:>3} rebuilds, median {statistics.median(latencies):6.1f} ms, "
+              f"max {latencies[-1]:6.1f} ms")
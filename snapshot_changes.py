@@ -0,0 +1,155 @@
+"""
+Détection des changements entre deux snapshots du marché.
+
+Chaque ligne (instrument) reçoit un hash de son contenu, calculé de façon
+vectorisée par pandas. En comparant avec les hashes du snapshot précédent on
+sait quelles lignes ont réellement bougé: seules celles-ci sont écrites en
+base, ajoutées à l'historique et transmises aux consommateurs (caches, alertes).
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+KEY_COLUMN = "Instrument"
+
+# Colonnes qui changent à chaque scrape sans que les données aient bougé
+HASH_EXCLUDED_COLUMNS = ("Timestamp",)
+
+def compute_row_hashes(df):
+    """Return a Series of uint64 content hashes indexed by instrument"""
+    if df.empty:
+        return pd.Series(dtype="uint64")
+    columns = sorted(c for c in df.columns if c not in HASH_EXCLUDED_COLUMNS)
+    hashes = pd.util.hash_pandas_object(df[columns].astype(str), index=False)
+    return pd.Series(hashes.to_numpy(), index=df[KEY_COLUMN].astype(str).str.strip().to_numpy())
+
+class ChangeDetector:
+    """Keep the row hashes of the last snapshot and diff new snapshots against them"""
+
+    def __init__(self):
+        self.previous = None
+
+    @property
+    def seeded(self):
+        return self.previous is not None
+
+    def seed(self, df):
+        """Use df as the previous snapshot without reporting changes"""
+        self.previous = compute_row_hashes(df)
+
+    def seed_from_csv(self, csv_path):
+        """Seed from a snapshot saved on disk, if it exists"""
+        if os.path.exists(csv_path):
+            self.seed(pd.read_csv(csv_path, keep_default_na=False, dtype=str))
+        else:
+            self.previous = pd.Series(dtype="uint64")
+
+    def diff(self, df):
+        """
+        Compare df with the previous snapshot, without remembering it: call
+        commit(changes["current"]) once the changed rows have been persisted,
+        so that a failed write is diffed again on the next snapshot.
+
+        Returns a dict with a boolean 'mask' over df's rows (True = new or
+        modified), the added / modified / unchanged / removed counts and the
+        'current' row hashes.
+        """
+        current = compute_row_hashes(df)
+        previous = self.previous if self.previous is not None else pd.Series(dtype="uint64")
+
+        # Les doublons d'instrument gardent leur dernière valeur, comme l'upsert en base
+        previous = previous[~previous.index.duplicated(keep="last")]
+        known = current.index.isin(previous.index)
+        old_hashes = previous.reindex(current.index).to_numpy()
+        modified = known & (old_hashes != current.to_numpy())
+        added = ~known
+        removed = previous.index.difference(current.index).tolist()
+
+        mask = np.asarray(added | modified)
+        return {
+            "mask": mask,
+            "total": int(len(current)),
+            "changed": int(mask.sum()),
+            "added": int(added.sum()),
+            "modified": int(modified.sum()),
+            "unchanged": int(len(current) - mask.sum()),
+            "removed": removed,
+            "current": current,
+        }
+
+    def commit(self, current):
+        """Remember the row hashes returned by diff() as the previous snapshot"""
+        self.previous = current
+
+def load_history_frames(conn, columns, since=None, placeholder="?"):
+    """
+    Replay input for the engines: (snapshot times, symbols, {column: matrix})
+    from price_history, one matrix row per snapshot_time (from `since` on,
+    default all) and one column per symbol; None when there is no history.
+    """
+    query = f"SELECT symbol, {', '.join(columns)}, snapshot_time FROM price_history"
+    params = ()
+    if since is not None:
+        query += f" WHERE snapshot_time >= {placeholder}"
+        params = (since,)
+    cursor = conn.cursor()
+    cursor.execute(query + " ORDER BY snapshot_time", params)
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+
+    names = ["symbol", *columns, "snapshot_time"]
+    history = pd.DataFrame({name: [row[name] for row in rows] for name in names})
+    history["snapshot_time"] = history["snapshot_time"].astype(str)
+    # price_history ne contient que les lignes modifiées: on reporte les dernières valeurs connues
+    first = history.pivot_table(index="snapshot_time", columns="symbol", values=columns[0], aggfunc="last").ffill()
+    frames = {columns[0]: first.to_numpy(np.float64)}
+    for column in columns[1:]:
+        frame = history.pivot_table(index="snapshot_time", columns="symbol", values=column, aggfunc="last")
+        frames[column] = frame.reindex(index=first.index, columns=first.columns).ffill().to_numpy(np.float64)
+    return list(first.index), list(first.columns), frames
+
+def summarize_changes(changes):
+    """Changes dict without the row mask and hashes (for logs and JSON responses)"""
+    return {key: value for key, value in changes.items() if key not in ("mask", "current")}
+
+# ===== CONSOMMATEURS DES CHANGEMENTS =====
+
+_listeners = []
+
+def register_listener(listener):
+    """Register listener(changed_df, changes), called after each snapshot with changes"""
+    if listener not in _listeners:
+        _listeners.append(listener)
+    return listener
+
+def notify_listeners(changed_df, changes, logger=None):
+    """Push changed rows to every registered consumer; one failing consumer does not stop the others"""
+    for listener in list(_listeners):
+        try:
+            listener(changed_df, changes)
+        except Exception as e:
+            if logger:
+                logger.error(f"Snapshot listener {getattr(listener, '__name__', listener)} failed: {e}")
+
+# ===== CONSOMMATEURS DES SNAPSHOTS COMPLETS =====
+
+# Moteurs qui ont besoin de chaque nouveau snapshot (risque, indices, ...),
+# et pas seulement des lignes modifiées.
+_snapshot_listeners = []
+
+def register_snapshot_listener(listener):
+    """Register listener(snapshot), called once for every newly loaded snapshot"""
+    if listener not in _snapshot_listeners:
+        _snapshot_listeners.append(listener)
+    return listener
+
+def notify_snapshot_listeners(snapshot, logger=None):
+    """Hand a newly loaded snapshot (dict of column arrays) to every registered engine"""
+    for listener in list(_snapshot_listeners):
+        try:
+            listener(snapshot)
+        except Exception as e:
+            if logger:
+                logger.error(f"Snapshot listener {getattr(listener, '__name__', listener)} failed: {e}")
@@ -4,4 +4,6 @@
 echo "Starting MaFinance Pro..."
 
 # Run with gunicorn
-gunicorn --bind 0.0.0.0:$PORT app:app --workers 2 --timeout 120
+# --preload: app.py is imported once in the master and shared by the forked workers
+# (the schema is created at build time by init_db.py, not at import)
+gunicorn --bind 0.0.0.0:$PORT app:app --workers 2 --timeout 120 --preload
@@ -0,0 +1,90 @@
+"""
+Benchmark du démarrage d'un worker: temps d'import de app.py et mémoire (RSS).
+
+Chaque mesure tourne dans un processus Python neuf, dans une copie
+temporaire de l'arbre (les logs et la base SQLite créés à l'import ne
+touchent pas le dépôt). --compare REV mesure aussi une autre révision git
+pour comparer avant / après.
+
+Usage:
+    python startup_benchmark.py [--runs 5] [--compare HEAD~1]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Modules lourds dont on veut savoir s'ils sont chargés par un worker web
+HEAVY_MODULES = ("selenium", "bs4", "lxml", "pandas", "numpy")
+
+MARKER = "STARTUP "
+
+CHILD = f"""
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print({MARKER!r} + json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}))
+"""
+
+_IGNORED = shutil.ignore_patterns(".git", "logs", "dist", "__pycache__", "*.db", "node_modules")
+
+def copy_working_tree(source, target):
+    shutil.copytree(source, target, ignore=_IGNORED)
+
+def export_revision(revision, target, repo="."):
+    os.makedirs(target)
+    archive = subprocess.run(["git", "-C", repo, "archive", revision], check=True, capture_output=True).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+
+def measure(tree, runs):
+    """Import app.py `runs` times in fresh interpreters; returns the parsed measurements"""
+    env = dict(os.environ)
+    env.pop("DATABASE_URL", None)  # toujours SQLite, dans la copie temporaire
+    results = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, "-c", CHILD], cwd=tree, env=env,
+                                   capture_output=True, text=True)
+        lines = [l for l in completed.stdout.splitlines() if l.startswith(MARKER)]
+        if completed.returncode != 0 or not lines:
+            raise RuntimeError(f"import app failed in {tree}:\n{completed.stderr[-2000:]}")
+        results.append(json.loads(lines[-1][len(MARKER):]))
+    return results
+
+def report(label, results):
+    seconds = statistics.median(r["seconds"] for r in results)
+    rss = statistics.median(r["rss_mb"] for r in results)
+    heavy = ", ".join(results[-1]["heavy"]) or "-"
+    print(f"{label:>12}: import {seconds * 1e3:7.0f} ms   RSS {rss:6.1f} MB   heavy modules: {heavy}")
+    return seconds, rss
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure worker startup time and memory")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--compare", metavar="REV", help="Also measure this git revision (e.g. HEAD~1)")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as scratch:
+        rows = []
+        if args.compare:
+            before = os.path.join(scratch, "before")
+            export_revision(args.compare, before, repo=here)
+            rows.append(report(args.compare, measure(before, args.runs)))
+
+        current = os.path.join(scratch, "current")
+        copy_working_tree(here, current)
+        rows.append(report("working tree", measure(current, args.runs)))
+
+    if len(rows) == 2:
+        (t0, m0), (t1, m1) = rows
+        print(f"[INFO] Startup {t0 / t1:.1f}x faster, {m0 - m1:.1f} MB less RSS per worker")
@@ -0,0 +1,211 @@
+"""
+Cache par utilisateur des listes watchlist, portefeuille et alertes.
+
+Les lignes d'un utilisateur ne changent que lorsqu'il ajoute ou supprime
+quelque chose, ou qu'une de ses alertes se déclenche. Chaque liste est mise
+en cache avec la version des données de l'utilisateur au moment de la
+lecture; les écritures incrémentent cette version après le commit, ce qui
+rend l'entrée périmée sans toucher au cache. Les entrées sont évincées par
+LRU (USER_CACHE_ENTRIES). Les prix courants sont ajoutés à la lecture, depuis
+le snapshot, sur une copie des lignes.
+
+Les versions sont partagées entre les workers gunicorn: compteurs 64 bits
+dans un fichier mappé en mémoire du répertoire des verrous d'admission (un
+compteur par user_id modulo VERSION_SLOTS: une collision ne coûte qu'une
+relecture de trop), incrémentés sous verrou fcntl. Sans fcntl (Windows),
+les versions sont propres au processus.
+
+Benchmark (base SQLite temporaire, lectures répétées avec et sans cache):
+    python user_cache.py --users 200 --reads 20000
+"""
+import argparse
+import mmap
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: versions par processus
+    fcntl = None
+
+from admission import DEFAULT_LOCK_DIR
+
+USER_CACHE_ENTRIES = int(os.getenv("USER_CACHE_ENTRIES", "10000"))
+VERSION_SLOTS = 1 << 16
+VERSION_FILE = "user_versions.bin"
+
+class UserVersions:
+    """Per-user data version counters shared by every process using `directory`"""
+
+    def __init__(self, directory=DEFAULT_LOCK_DIR, slots=VERSION_SLOTS):
+        self.slots = slots
+        self.path = os.path.join(directory, VERSION_FILE)
+        self.lock = threading.Lock()
+        self.pid = None
+        self.fd = None
+        self.counters = [0] * slots if fcntl is None else None
+
+    def _attach(self):
+        """
+        Open and map the counters in this process. With gunicorn --preload the
+        object is created in the master: a descriptor inherited by the workers
+        would share one flock between them, so each process opens its own.
+        """
+        if fcntl is None or self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            size = self.slots * 8
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < size:
+                    os.ftruncate(fd, size)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self.fd = fd
+            self.counters = memoryview(mmap.mmap(fd, size)).cast("q")
+            self.pid = os.getpid()
+
+    def get(self, user_id):
+        self._attach()
+        return self.counters[user_id % self.slots]
+
+    def bump(self, user_id):
+        """Invalidate everything cached for the user, in every worker"""
+        self._attach()
+        slot = user_id % self.slots
+        with self.lock:
+            if self.fd is None:
+                self.counters[slot] += 1
+                return
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                self.counters[slot] += 1
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+class UserResponseCache:
+    """LRU of per-user result sets, valid while the user's data version is unchanged"""
+
+    def __init__(self, versions, max_entries=USER_CACHE_ENTRIES):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, user_id, kind, load):
+        """Copies of the user's `kind` rows: cached, or from load() if the user wrote since"""
+        # Version lue avant la requête: une écriture concurrente rend l'entrée stockée périmée
+        version = self.versions.get(user_id)
+        key = (user_id, kind)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return [dict(row) for row in entry[1]]
+
+        rows = load()
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = (version, rows)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return [dict(row) for row in rows]
+
+    def invalidate(self, user_id):
+        """Call after committing a change to the user's watchlist, portfolio or alerts"""
+        self.versions.bump(user_id)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions}
+
+def check_forked_bumps(directory, processes=4, bumps=20000):
+    """Bumps from forked workers (versions created in the parent, as with --preload) are never lost"""
+    versions = UserVersions(directory)
+    start = versions.get(7)
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            for _ in range(bumps):
+                versions.bump(7)
+            os._exit(0)
+        children.append(pid)
+    for pid in children:
+        os.waitpid(pid, 0)
+    return versions.get(7) - start, processes * bumps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Repeated watchlist reads with and without the per-user cache")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--reads", type=int, default=20000)
+    parser.add_argument("--writes", type=float, default=0.02, help="Share of requests that modify the watchlist")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "cache.db")
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE watchlists (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, symbol TEXT NOT NULL,
+                                     name TEXT, added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, added_price REAL);
+            CREATE INDEX idx_watchlists_user_added ON watchlists(user_id, added_date DESC);
+        """)
+        conn.executemany("INSERT INTO watchlists (user_id, symbol, name, added_price) VALUES (?, ?, ?, ?)",
+                         [(u, f"SYM{i:03d}", f"Company {i}", 100.0) for u in range(args.users) for i in range(15)])
+        conn.commit()
+        conn.close()
+
+        def load(user_id):
+            # Comme GET /api/watchlist: une connexion par requête
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            rows = [dict(r) for r in conn.execute(
+                "SELECT id, symbol, name, added_date, added_price FROM watchlists WHERE user_id = ? "
+                "ORDER BY added_date DESC", (user_id,))]
+            conn.close()
+            return rows
+
+        def write(user_id):
+            conn = sqlite3.connect(path)
+            conn.execute("INSERT INTO watchlists (user_id, symbol, name, added_price) VALUES (?, 'NEW', 'New', 1)",
+                         (user_id,))
+            conn.commit()
+            conn.close()
+
+        cache = UserResponseCache(UserVersions(os.path.join(scratch, "locks")))
+        rng = random.Random(1)
+        requests = [(rng.randrange(args.users), rng.random() < args.writes) for _ in range(args.reads)]
+        for label, cached in (("database", False), ("cache", True)):
+            started = time.perf_counter()
+            for user_id, is_write in requests:
+                if is_write:
+                    write(user_id)
+                    cache.invalidate(user_id)
+                elif cached:
+                    cache.get(user_id, "watchlist", lambda: load(user_id))
+                else:
+                    load(user_id)
+            elapsed = time.perf_counter() - started
+            print(f"[INFO] {label:>8}: {len(requests) / elapsed:8.0f} requests/s")
+        print(f"[INFO] Cache: {cache.stats()}")
+
+        if fcntl is not None:
+            counted, expected = check_forked_bumps(os.path.join(scratch, "fork"))
+            print(f"[{'SUCCESS' if counted == expected else 'ERROR'}] Forked bumps: {counted}/{expected}")
+            if counted != expected:
+                raise SystemExit(1)